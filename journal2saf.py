@@ -4,6 +4,7 @@ import sys
 import time
 import logging
 import logging.config
+import threading
 import argparse
 import warnings
 import pathlib
@@ -12,12 +13,8 @@ from datetime import datetime
 from pathlib import Path
 from configparser import ConfigParser
 
-from lib.export_saf import ExportSAF
-from lib.copy_saf import CopySAF
-from lib.retrieve_doi import RetrieveDOI
-from lib.write_remote_url import WriteRemoteUrl
-from lib.data_miner import DataPoll
-from lib.send_mail import send_report
+from lib.state_store import StateStore
+from lib.metrics import Metrics
 
 warnings.filterwarnings(
     'ignore', message='Unverified HTTPS request')
@@ -39,13 +36,22 @@ CP.optionxform = lambda option: option  # type: ignore[method-assign]
 class Report:
     """Gather information from all modules during
        they processing her tasks.
+       Every event is counted, but only the first 'sample'
+       values per key are kept.
     """
 
-    def __init__(self):
+    def __init__(self, sample: int = 1000):
         self.report = {}
+        self.counts = {}
+        self.sample = sample
+        self._lock = threading.Lock()
 
     def add(self, key, value):
-        self.report.setdefault(key, []).append(value)
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            values = self.report.setdefault(key, [])
+            if len(values) < self.sample:
+                values.append(value)
 
     def __get__(self):
         return str(self.report)
@@ -60,8 +66,10 @@ class Report:
     def print(self):
         print('################### report ###################')
         for k, v in self.report.items():
-            print(f"{k}: {', '.join(map(str, v))} "
-                  f"{'['+str(len(v))+']' if len(v) > 1 else ''}")
+            count = self.counts.get(k, len(v))
+            more = ', ...' if count > len(v) else ''
+            print(f"{k}: {', '.join(map(str, v))}{more} "
+                  f"{'['+str(count)+']' if count > 1 else ''}")
         print('################### report ###################')
 
 
@@ -76,10 +84,45 @@ class TaskDispatcher:
        * write DOI's back to OJS/OMP
     """
 
-    def __init__(self) -> None:
+    def __init__(self, full: bool = False, refresh: bool = False) -> None:
+        self.full = full
+        self.refresh = refresh
         self.datapoll = None
-        self.report = Report()
+        self.report = Report(
+            CP.getint('general', 'report_sample', fallback=1000))
         self.duration = 1
+        self._http = None
+        self._ssh = None
+        # progress of all publications, shared by all stages
+        self.store = StateStore(CP)
+        self.metrics = Metrics()
+
+    @property
+    def http(self):
+        """one pooled http session shared by all stages"""
+        if self._http is None:
+            from lib.http_client import HttpClient
+            self._http = HttpClient(CP, self.metrics)
+        return self._http
+
+    @property
+    def ssh(self):
+        """one SSH connection to DSpace shared by all stages"""
+        if self._ssh is None:
+            from lib.ssh_session import SSHSession
+            self._ssh = SSHSession(CP, self.report, self.metrics)
+        return self._ssh
+
+    def reset(self, publication_ids) -> None:
+        """export publications again, e.g. after a failed import"""
+        count = self.store.forget(publication_ids)
+        logger.info(f'reset {count} of {len(publication_ids)} publications')
+
+    def close(self) -> None:
+        if self._ssh is not None:
+            self._ssh.close()
+        if self._http is not None:
+            self._http.close()
 
     @staticmethod
     def gauge(func):
@@ -91,6 +134,16 @@ class TaskDispatcher:
             self.duration = delta.split('.')[0]
         return to_time
 
+    @staticmethod
+    def measure(stage):
+        """record wall time of a stage in metrics"""
+        def decorate(func):
+            def timed(self):
+                with self.metrics.timer('stage_seconds', stage=stage):
+                    func(self)
+            return timed
+        return decorate
+
     @staticmethod
     def update_doi_constraint(func):
         def check_and_proceed(self):
@@ -101,47 +154,161 @@ class TaskDispatcher:
 
     @gauge
     def launch(self) -> None:
+        if CP.getboolean('general', 'pipeline', fallback=False):
+            self.launch_pipeline()
+            return
+        if CP.getboolean('general', 'streaming', fallback=False):
+            self.launch_streaming()
+            return
         self.data_poll()
         self.export_saf_archive()
         self.copy_saf()
         self.retrieve_doi()
         self.write_remote_url()
 
+    def launch_pipeline(self) -> None:
+        """harvest, package and upload journal by journal, the stages
+           run side by side connected by bounded queues"""
+        from lib.copy_saf import CopySAF
+        from lib.workers import pipeline
+        dp, exportsaf = self.journal_stream()
+        copysaf = CopySAF(CP, self.report, store=self.store,
+                          metrics=self.metrics, session=self.ssh)
+
+        def package(publisher):
+            zipfiles = exportsaf.export_contexts([publisher])
+            dp.release(publisher)
+            return zipfiles
+
+        def upload(zipfile):
+            # one SFTP channel for all zips of the run
+            copysaf.upload(Path(zipfile).absolute())
+            return ()
+
+        try:
+            with self.metrics.timer('stage_seconds', stage='pipeline'):
+                pipeline(dp.harvest_publishers(), [package, upload],
+                         maxsize=CP.getint('general', 'pipeline_queue',
+                                           fallback=2))
+        finally:
+            copysaf.close()
+        self.finish_stream(dp, exportsaf)
+        self.copy_saf()
+        self.retrieve_doi()
+        self.write_remote_url()
+
+    def launch_streaming(self) -> None:
+        """harvest and package one journal after the other, each
+           journal is released before the next one is requested"""
+        dp, exportsaf = self.journal_stream()
+        with self.metrics.timer('stage_seconds', stage='streaming'):
+            for publisher in dp.harvest_publishers():
+                exportsaf.export_contexts([publisher])
+                dp.release(publisher)
+        self.finish_stream(dp, exportsaf)
+        self.copy_saf()
+        self.retrieve_doi()
+        self.write_remote_url()
+
+    def journal_stream(self) -> tuple:
+        """DataPoll and ExportSAF to process journal by journal"""
+        from lib.data_miner import DataPoll
+        from lib.export_saf import ExportSAF
+        from lib.saf_package import PACKAGING_ZIP
+        dp = DataPoll(CP, self.report, http=self.http, full=self.full,
+                      store=self.store, metrics=self.metrics,
+                      refresh=self.refresh)
+        dp.determine_done()
+        dp.load_cursors()
+        dp.request_publishers()
+        self.datapoll = dp
+        exportsaf = ExportSAF(CP, self.report, [],
+                              http=self.http, store=self.store,
+                              metrics=self.metrics)
+        if exportsaf.packaging != PACKAGING_ZIP:
+            # a journal is done once its items are zipped
+            logger.info('stream items into zips')
+            exportsaf.packaging = PACKAGING_ZIP
+        return dp, exportsaf
+
+    @staticmethod
+    def finish_stream(dp, exportsaf) -> None:
+        if exportsaf.filters_.timing:
+            exportsaf.filters_.log_timings()
+        # leftovers of former runs, zipped and uploaded as usual
+        exportsaf.write_zips()
+        dp.save_cursors()
+
+    @measure('harvest')
     def data_poll(self) -> None:
+        # stages are imported on demand, keeps startup short
+        from lib.data_miner import DataPoll
         # dp = DataPoll(CP, self.report, WHITE, BLACK)
-        dp = DataPoll(CP, self.report)
+        dp = DataPoll(CP, self.report, http=self.http, full=self.full,
+                      store=self.store, metrics=self.metrics,
+                      refresh=self.refresh)
         dp.determine_done()
+        dp.load_cursors()
         dp.request_publishers()
         dp.serialise_data()
         dp.request_submissions()
         dp.request_contexts()
         self.datapoll = dp
 
+    @measure('package')
     def export_saf_archive(self) -> None:
+        from lib.export_saf import ExportSAF
         if self.datapoll is not None:
             publishers = self.datapoll.publishers
-        exportsaf = ExportSAF(CP, self.report, publishers)
+        exportsaf = ExportSAF(CP, self.report, publishers,
+                              http=self.http, store=self.store,
+                              metrics=self.metrics)
         exportsaf.export()
         exportsaf.write_zips()
+        if self.datapoll is not None:
+            # everything harvested is packed now, move cursors forward
+            self.datapoll.save_cursors()
 
+    @measure('upload')
     def copy_saf(self) -> None:
-        copysaf = CopySAF(CP, self.report)
+        from lib.copy_saf import CopySAF
+        copysaf = CopySAF(CP, self.report, store=self.store,
+                          metrics=self.metrics, session=self.ssh)
         copysaf.copy()
 
     @update_doi_constraint
+    @measure('retrieve_doi')
     def retrieve_doi(self) -> None:
+        from lib.retrieve_doi import RetrieveDOI
         logger.info('retrieve DOI')
-        retrievedoi = RetrieveDOI(CP, self.report)
+        retrievedoi = RetrieveDOI(CP, self.report, store=self.store,
+                                  session=self.ssh)
         doi_done = retrievedoi.determine_done()
         retrievedoi.retrieve_files(doi_done)
 
     @update_doi_constraint
+    @measure('write_remote_url')
     def write_remote_url(self) -> None:
+        from lib.write_remote_url import WriteRemoteUrl
         logger.info('write DOI')
-        writeremoteurl = WriteRemoteUrl(CP, self.report)
+        writeremoteurl = WriteRemoteUrl(CP, self.report, http=self.http,
+                                        store=self.store)
         writeremoteurl.write()
 
+    def report_metrics(self) -> None:
+        """metrics summary into report, all metrics into a
+           node-exporter textfile if configured"""
+        for line in self.metrics.summary():
+            self.report.add('metrics', line)
+        metrics_file = CP.get('general', 'metrics_file', fallback=None)
+        if metrics_file:
+            try:
+                self.metrics.write_textfile(metrics_file)
+            except OSError as err:
+                logger.error(f'cannot write metrics {metrics_file}: {err}')
+
     def send_report(self):
+        from lib.send_mail import send_report
         receivers = None
         if CP.has_section('email'):
             receivers = CP.get('email', 'receivers')
@@ -152,12 +319,10 @@ class TaskDispatcher:
             port_ = CP.get('email', 'smtp_port')
             system_ = CP.get('general', 'system')
             if receivers:
-                for receiver in receivers.split():
-                    logger.info('try send report to %s', receiver)
-                    msg = self.report.report
-                    send_report(sender, user_, pass_,
-                                server_, port_, receiver,
-                                self.report.has_error(), msg, system_)
+                logger.info('try send report to %s', receivers)
+                send_report(sender, user_, pass_,
+                            server_, port_, receivers.split(),
+                            self.report.has_error(), self.report, system_)
             else:
                 logger.info(
                     'no receiver in section email found in config, skip')
@@ -165,12 +330,19 @@ class TaskDispatcher:
             logger.info('no section email found in config, skip')
 
 
-def main() -> None:
-    dispatcher = TaskDispatcher()
-    dispatcher.launch()
+def main(full: bool = False, refresh: bool = False,
+         reset: list | None = None) -> None:
+    dispatcher = TaskDispatcher(full, refresh)
+    if reset:
+        dispatcher.reset(reset)
+    try:
+        dispatcher.launch()
+    finally:
+        dispatcher.close()
     delta = dispatcher.duration
     logger.info(f"Elapsed time: {delta}")
     dispatcher.report.add('elapsed time', delta)
+    dispatcher.report_metrics()
     dispatcher.send_report()
     dispatcher.report.print()
 
@@ -203,6 +375,19 @@ if __name__ == "__main__":
         "-m", required=False,
         default=CONFIG_META,
         help="path to META Data configuration file")
+    parser.add_argument(
+        "--full", required=False,
+        action='store_true',
+        help="ignore stored harvest cursors, request all submissions")
+    parser.add_argument(
+        "--refresh", required=False,
+        action='store_true',
+        help="request details of already processed submissions too")
+    parser.add_argument(
+        "--reset", required=False,
+        nargs='+', type=int, metavar='PUBLICATION_ID',
+        help="forget the progress of these publications and export"
+             " them again (add --full when harvesting incrementally)")
 
     args = vars(parser.parse_args())
     conf = args['c']
@@ -232,4 +417,4 @@ if __name__ == "__main__":
         print(f"{now} [INFO] use black list: {BLACK}")
     init_logger()
 
-    main()
+    main(args['full'], args['refresh'], args['reset'])
@@ -1,56 +1,64 @@
 #!/usr/bin/env python3
 
+import time
 import logging
-import paramiko
+import threading
 from pathlib import Path
-from paramiko.client import SSHClient, AutoAddPolicy
-
+from .metrics import Metrics, journal_from_name
+from .ssh_session import SSHSession
+from .workers import ReportRouter, ordered_map
+from .state_store import (
+    StateStore, UPLOADED, saf_name)
 
 logger = logging.getLogger('journals-logging-handler')
 
+# largest write request most SFTP servers accept
+CHUNK_SIZE = 32 * 1024
+
+
+class Throttle:
+    """bandwidth cap shared by all upload channels"""
+
+    def __init__(self, rate) -> None:
+        self.rate = rate  # bytes per second
+        self.next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self, size) -> None:
+        """block until 'size' bytes may be sent"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(self.next, now)
+            self.next = start + size / self.rate
+        if start > now:
+            time.sleep(start - now)
+
 
 class CopySAF:
     """Copy SAF-zip files to dspace server via scp"""
 
-    def __init__(self, configparser, report) -> None:
+    def __init__(self, configparser, report, store=None,
+                 metrics=None, session=None) -> None:
         self.load_config(configparser)
-        self.client = None
-        self.report = report
+        self.report = ReportRouter(report)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.store = store if store is not None\
+            else StateStore(configparser)
+        self.session = session if session is not None\
+            else SSHSession(configparser, report, self.metrics)
+        self.channel = None
 
     def load_config(self, configparser) -> None:
         s = configparser['scp']
         ds = configparser['dspace']
         e = configparser['export']
         self.export_path = e['export_path']
-        # scp needed
-        self.server = s['server']
-        self.user = s['user']
-        self.key_filename = s['key_filename']
-
         self.server_source = ds['server_zipsource']
-
-    def get_client(self) -> SSHClient:
-        try:
-            transport = self.client.get_transport()
-            transport.send_ignore()
-            return self.client
-        except (AttributeError, EOFError):
-            # connection is closed, reconnect
-            logger.info(f'connect ssh {self.server}')
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        try:
-            client.connect(
-                self.server,
-                username=self.user,
-                key_filename=self.key_filename)
-        except Exception as err:
-            logger.error(err)
-            self.report.add('ERROR', err)
-            return None
-        self.client = client
-        return client
+        # parallel SFTP channels over one SSH connection
+        self.upload_workers = s.getint('upload_workers', fallback=1)
+        # KB/s for all channels together, 0 means no limit
+        limit = s.getint('bandwidth_limit', fallback=0)
+        self.throttle = Throttle(limit << 10) if limit > 0 else None
 
     def get_files(self) -> list:
         export_path = Path(self.export_path)
@@ -73,21 +81,122 @@ class CopySAF:
         if len(files) == 0:
             logger.info('no SAF files found to copy')
             return
-        client = self.get_client()
-        if client is not None:
-            with client.open_sftp() as ftp_client:
-                self.observer_count = 0
-                for file_ in files:
-                    logger.info(f'transfer file {file_}')
-                    logger.info(f"target: '{self.server_source}/{file_.name}")
-                    self.report.add('transfer files', file_.name)
-                    ftp_client.put(
-                        file_, f'{self.server_source}/{file_.name}',
-                        callback=self.transferobserver)
-                    done = file_.with_suffix(file_.suffix + '.done')
-                    file_.rename(done)
-                    logger.info(f'rename file {file_.name} to {done.name}')
-            client.close()
+        if self.session.get_client() is None:
+            return
+        self.observer_count = 0
+        local = threading.local()
+        channels: list = []
+
+        def upload(file_):
+            with self.report.deferred() as notes:
+                # every worker thread keeps its own channel
+                if getattr(local, 'sftp', None) is None:
+                    local.sftp = self.open_channel(file_)
+                    if local.sftp is None:
+                        self.report.add('error transfer file', file_.name)
+                        return notes
+                    channels.append(local.sftp)
+                self.copy_file(local.sftp, file_)
+            return notes
+
+        try:
+            for notes in ordered_map(upload, files, self.upload_workers):
+                notes.flush(self.report)
+        finally:
+            for channel in channels:
+                channel.close()
+
+    def upload(self, file_) -> None:
+        """upload a single zip over a channel kept open between calls
+           until 'close', while DSpace is unreachable the zip is left
+           for the next run"""
+        if self.channel is None:
+            if self.session.get_client() is None:
+                logger.info(f'DSpace unreachable, keep {file_.name}')
+                return
+            self.channel = self.open_channel(file_)
+            if self.channel is None:
+                self.report.add('error transfer file', file_.name)
+                return
+        if not self.copy_file(self.channel, file_):
+            # channel may be broken, the next zip opens a new one
+            self.close()
+
+    def close(self) -> None:
+        if self.channel is not None:
+            self.channel.close()
+            self.channel = None
+
+    def open_channel(self, file_):
+        """SFTP channel or None, e.g. connection lost or more
+           channels than sshd allows (MaxSessions)"""
+        from paramiko.ssh_exception import SSHException
+        try:
+            return self.session.open_sftp()
+        except (IOError, EOFError, SSHException) as err:
+            logger.error(f'no SFTP channel to transfer {file_.name}: {err}')
+            return None
+
+    def copy_file(self, sftp, file_) -> bool:
+        """upload under a temporary name and rename when complete,
+           so the DSpace import never sees a partial zip"""
+        from paramiko.ssh_exception import SSHException
+        target = f'{self.server_source}/{file_.name}'
+        part = f'{self.server_source}/.{file_.name}.part'
+        logger.info(f'transfer file {file_}')
+        logger.info(f"target: '{target}")
+        self.report.add('transfer files', file_.name)
+        journal = journal_from_name(file_.name)
+        size = file_.stat().st_size
+        try:
+            with self.metrics.timer('journal_seconds',
+                                    stage='upload', journal=journal):
+                self.put(sftp, file_, part, size)
+                try:
+                    sftp.posix_rename(part, target)
+                except IOError:
+                    # server without posix-rename extension
+                    sftp.rename(part, target)
+        except (IOError, SSHException) as err:
+            logger.error(f'transfer {file_.name} failed: {err}')
+            self.report.add('error transfer file', file_.name)
+            try:
+                sftp.remove(part)
+            except (IOError, SSHException):
+                pass
+            return False
+        self.metrics.inc('uploaded_bytes', size, journal=journal)
+        self.metrics.inc('items', stage='upload', journal=journal)
+        done = file_.with_suffix(file_.suffix + '.done')
+        file_.rename(done)
+        logger.info(f'rename file {file_.name} to {done.name}')
+        # recorded under the id the zip was packaged for
+        publication_id = self.store.publication_id(saf_name(file_.name))
+        if publication_id is None:
+            logger.warning(f'{file_.name} unknown in state database')
+        else:
+            self.store.mark(publication_id, UPLOADED)
+        return True
+
+    def put(self, sftp, local_path, remote_path, size) -> None:
+        """pipelined write, acknowledged when the file is closed"""
+        sent = 0
+        with open(local_path, 'rb') as src, \
+                sftp.open(remote_path, 'wb') as dst:
+            dst.set_pipelined(True)
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if self.throttle is not None:
+                    self.throttle.wait(len(chunk))
+                dst.write(chunk)
+                sent += len(chunk)
+                self.transferobserver(sent, size)
+        remote_size = sftp.stat(remote_path).st_size
+        if remote_size != size:
+            raise IOError(
+                f'{remote_path}: {remote_size} of {size} bytes written')
 
     def copy(self) -> dict:
         saf_files = self.get_files()
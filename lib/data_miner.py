@@ -1,49 +1,79 @@
 #!/usr/bin/env python3
 
-import re
 import sys
+import copy
+import threading
 import requests
 import logging
 from pathlib import Path
+from .workers import DeferredReport, ordered_map
+from .http_client import HttpClient
+from .metrics import Metrics
+from .state_store import StateStore, HARVESTED, PACKAGED
+from .meta_fields import compile_meta, referenced_attributes
 
 PKP_STATUS_PUBLISHED = 3  # convention by PKP ojs/omp
 STATE_PROCESSED = 'state_processed'
 STATE_SKIP = 'state_skip'
+# largest 'count' the OJS/OMP api accepts for listings
+MAX_PAGE_SIZE = 100
+
+# fields read by DataPoll and ExportSAF themselves, kept by the
+# compact model next to the fields referenced in section [meta]
+SUBMISSION_FIELDS = frozenset((
+    'id', 'submissionId', 'currentPublicationId', 'publication', 'files',
+    'locale', 'volume', 'seriesPosition', 'publishedUrl'))
+PUBLISHER_FIELDS = frozenset(('_href', ))
 
 logger = logging.getLogger('journals-logging-handler')
 
 
+def project(data, fields) -> dict:
+    """keep only given fields of data, all if fields is None"""
+    if fields is None:
+        return data
+    return {key: value for key, value in data.items() if key in fields}
+
+
 class Publisher():
     """This class stores single Publisher objects
         and according submissions"""
 
-    def __init__(self, data) -> None:
-        self._data = data
+    __slots__ = ('_data', '_fields', 'name', 'url_path', 'url',
+                 'publisher_id', 'submissions')
+
+    def __init__(self, data, fields=None) -> None:
+        self._fields = fields
+        self._data = project(data, fields)
         self.name = data['name']
         self.url_path = data['urlPath']
         self.url = data['url']
         self.publisher_id = data['id']
         self.submissions = []
 
+    def update(self, data) -> None:
+        """merge context details"""
+        self._data.update(project(data, self._fields))
+
     def __getattr__(self, name: str) -> str:
-        if name in self._data:
+        if name != '_data' and name in self._data:
             return self._data[name]
-        else:
-            return self.__getattribute__(name)
+        raise AttributeError(name)
 
 
 class Submission():
     """This class stores single Submission objects"""
 
-    def __init__(self, data, parent) -> None:
-        self._data = data
+    __slots__ = ('_data', 'parent')
+
+    def __init__(self, data, parent, fields=None) -> None:
+        self._data = project(data, fields)
         self.parent = parent   # journal object
 
     def __getattr__(self, name: str) -> str:
-        if name in self._data:
+        if name != '_data' and name in self._data:
             return self._data[name]
-        else:
-            return self.__getattribute__(name)
+        raise AttributeError(name)
 
 
 class DataPoll():
@@ -59,15 +89,41 @@ class DataPoll():
                  configparser,
                  report,
                  # whitelist: list, blacklist: list
+                 http=None,
+                 full: bool = False,
+                 store=None,
+                 metrics=None,
+                 refresh: bool = False,
                  ) -> None:
         # global WHITE, BLACK  (obsolete)
         # WHITE = whitelist
         # BLACK = blacklist
         self.publishers: list = []
         self.journals: dict[str, str] = {}
+        # issue details by (journal url, issue id), valid for whole run
+        self.issues: dict[tuple, dict] = {}
+        self._issue_locks: dict[tuple, threading.Lock] = {}
+        self._issue_guard = threading.Lock()
         # list[tuple[str, str], ] = []
         self.load_config(configparser)
         self.report = report
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.http = http if http is not None\
+            else HttpClient(configparser, self.metrics)
+        self.store = store if store is not None\
+            else StateStore(configparser)
+        self.submission_fields = self.publisher_fields = None
+        if self.compact_model:
+            self.model_fields(configparser)
+        # 'full' forces a complete resync, ignoring stored cursors
+        self.incremental = self.incremental and not full
+        # 'refresh' requests details of processed submissions too
+        self.refresh = refresh
+        self.cursors: dict[str, str] = {}
+        self.cursors_seen: dict[str, str] = {}
+        # (publication_id, lastModified) per journal of items still
+        # to be packaged, publication_id None if harvesting failed
+        self.unfinished: dict[str, list] = {}
 
     def load_config(self, configparser) -> None:
         """extract data from configuration"""
@@ -88,32 +144,108 @@ class DataPoll():
             self.journals[option] = token_
             logger.debug(f'append journal:{option} with token:{token_[:9]}...')
         # self.token = f"apiToken={g['api_token']}"  obsolete
+        # number of parallel detail requests per journal, 1 = sequential
+        self.harvest_workers: int = config_g.getint(
+            'harvest_workers', fallback=1)
+        # items per listing request ('count'), 0 = server default
+        self.page_size: int = config_g.getint('page_size', fallback=0)
+        if self.page_size > MAX_PAGE_SIZE:
+            logger.warning(f'page_size {self.page_size} too large,'
+                           f' use {MAX_PAGE_SIZE}')
+            self.page_size = MAX_PAGE_SIZE
+        # only request submissions modified since the former run
+        self.incremental: bool = config_g.getboolean(
+            'incremental', fallback=False)
+        # keep only fields used by export instead of whole responses
+        self.compact_model: bool = config_g.getboolean(
+            'compact_model', fallback=False)
         config_e = configparser['export']
         self.export_path = config_e['export_path']
 
+    def model_fields(self, configparser) -> None:
+        """fields kept by the compact model, derived from [meta]"""
+        if not configparser.has_section('meta'):
+            logger.warning('no section [meta], keep all fields')
+            return
+        try:
+            fields = compile_meta(configparser['meta'])
+        except ValueError:
+            # reported by ExportSAF, the full model works anyway
+            return
+        submission = referenced_attributes(fields, 'submission')
+        if submission is not None:
+            self.submission_fields = SUBMISSION_FIELDS | submission
+        context = referenced_attributes(fields, 'context')
+        if context is not None:
+            self.publisher_fields = PUBLISHER_FIELDS | context
+        logger.info(f'compact model, submission fields: '
+                    f'{sorted(self.submission_fields or ["all"])}')
+
     def determine_done(self):
         """check and register all former processed items
            to avoid repeated downloads """
-        self.processed = []
-        try:
-            paths = Path(self.export_path).iterdir()
-            export_done = [f for f in paths if f.is_file()]
-        except FileNotFoundError as err:
-            logger.error(f'export path failure {err}')
+        if not Path(self.export_path).is_dir():
+            logger.error(f'export path failure {self.export_path}')
             sys.exit(1)
-        for file_ in export_done:
-            parts = re.split('[_.]', file_.name)
-            publication_id = parts[3]
-            self.processed.append(int(publication_id))
+        self.store.import_markers(self.export_path)
+        self.processed = self.store.ids(PACKAGED)
+        logger.info(f'{len(self.processed)} publications already processed')
+
+    def load_cursors(self) -> None:
+        """read per journal high-water marks of the former run"""
+        if not self.incremental:
+            logger.info('full harvest, ignore stored cursors')
+            return
+        self.cursors = self.store.cursors()
+        if not self.cursors:
+            logger.info('no stored cursors, full harvest')
+
+    def save_cursors(self) -> None:
+        """persist high-water marks, call after successful export,
+           a journal's mark never passes an item which failed or
+           is not packaged, so the next run requests it again"""
+        if not self.cursors_seen:
+            return
+        cursors = self.store.cursors()
+        for journal, mark in self.cursors_seen.items():
+            failed = [modified for publication_id, modified
+                      in self.unfinished.get(journal, [])
+                      if publication_id is None
+                      or not self.store.has(publication_id, PACKAGED)]
+            if failed:
+                # moving back is intended, equal marks are requested
+                cursors[journal] = min([mark] + failed)
+                logger.warning(f'{len(failed)} items of {journal} not'
+                               f' packaged, hold cursor at'
+                               f' {cursors[journal]}')
+                continue
+            cursors[journal] = max(mark, cursors.get(journal, mark))
+        self.store.save_cursors(cursors)
+        logger.info(f'store harvest cursors for {list(self.cursors_seen)}')
+
+    def register_cursor(self, journal, items) -> None:
+        """remember latest modification seen for journal"""
+        marks = [self.last_modified(subm) for subm in items]
+        marks = [mark for mark in marks if mark]
+        if marks:
+            self.cursors_seen[journal] = max(marks)
+
+    @staticmethod
+    def last_modified(subm) -> str:
+        """timestamp of latest change, format 'YYYY-MM-DD hh:mm:ss'"""
+        return subm.get('lastModified') or subm.get('dateLastActivity') or ''
 
     def _server_request(self, query, api_token) -> dict:
         """do the http request"""
         mark = '&' if '?' in query else '?'
         # query += f'{mark}{self.token}'
         query += f'{mark}apiToken={api_token}'
-        # no need to verify, 'cause we trust the server
         logger.info(f"request server:{query}")
-        result = requests.get(query, verify=False)
+        result = self.http.get(query)
+        if self.http.is_transient(result):
+            logger.error(
+                f"server request failed due to: {result.status_code}")
+            result.raise_for_status()
         if result.status_code == 404:
             logger.error("server request failed due to: 404")
             sys.exit(1)
@@ -137,6 +269,8 @@ class DataPoll():
         endpoint = self.endpoint_contexts
         mark = '&' if '?' in endpoint else '?'
         endpoint = f"{endpoint}{mark}offset={offset}&isEnabled=true"
+        if self.page_size:
+            endpoint += f"&count={self.page_size}"
         rest_call = ''.join([
             # self.journal_server, 'sachunterricht', endpoint])
             self.journal_server, journal_name, endpoint])
@@ -144,25 +278,48 @@ class DataPoll():
             f"build contexts REST call: {rest_call}")
         return rest_call
 
+    def request_pages(self, rest_call, api_token) -> list:
+        """all items of a listing, rest_call builds the query for an
+           offset, once the first page tells 'itemsMax' all other
+           pages are requested concurrently"""
+        first = self._server_request(rest_call(0), api_token)
+        items = list(first['items'])
+        # server may cap 'count', its first page tells the real size
+        step = len(items)
+        if step == 0:
+            return items
+        offsets = range(step, first['itemsMax'], step)
+
+        def request_page(offset):
+            return self._server_request(
+                rest_call(offset), api_token)['items']
+
+        for page in ordered_map(request_page, offsets,
+                                self.harvest_workers):
+            items.extend(page)
+        return items
+
     def request_publishers(self) -> None:
         """batched Requests for publishers"""
-        allitems: int = 1
-        offset: int = 0
         items: list = []
-        for journal, api_token in self.journals.items():
-            while allitems > offset:
-                publishers_query = self.rest_call_contexts(journal, offset)
-                batch_ = self._server_request(publishers_query, api_token)
+        # every token lists all contexts, the first one is enough
+        for journal, api_token in list(self.journals.items())[:1]:
+            try:
+                items = self.request_pages(
+                    lambda start: self.rest_call_contexts(journal, start),
+                    api_token)
                 logger.info(
-                    f"Items: {[publ['urlPath'] for publ in batch_['items']]}")
-
-                for item in batch_['items']:
+                    f"Items: {[publ['urlPath'] for publ in items]}")
+                for item in items:
                     _href = item['_href']
-                    batch_extra_data = self._server_request(_href, api_token)
+                    batch_extra_data = self._server_request(
+                        _href, api_token)
                     item.update(batch_extra_data)
-                items.extend(batch_['items'])
-                allitems = batch_['itemsMax']
-                offset = len(items)
+            except requests.exceptions.RequestException as err:
+                logger.error(f"no publishers from {self.journal_server}:"
+                             f" {err}")
+                self.report.add('error server request', self.journal_server)
+                items = []
         items = self.filter_journals(items)
 
         for b in items:
@@ -182,23 +339,60 @@ class DataPoll():
     def serialise_data(self) -> None:
         """ store all received data as Publisher object"""
         logger.info(f"process {len(self.items)} publishers")
+        self.publishers.extend(self.iter_publishers())
+
+    def iter_publishers(self):
+        """Publisher objects created one at a time"""
         for data in self.items:
-            publisher = Publisher(data)
-            self.publishers.append(publisher)
+            yield Publisher(data, self.publisher_fields)
+
+    def harvest_publishers(self):
+        """harvest journal by journal, yield each publisher with its
+           submissions and context, none of them is kept here,
+           call 'release' when done with a publisher"""
+        for publisher in self.iter_publishers():
+            if publisher.url_path not in self.journals:
+                continue
+            self.request_journal_submissions(publisher)
+            if not self.request_context(publisher):
+                self.release(publisher)
+                continue
+            yield publisher
+
+    def release(self, publisher) -> None:
+        """drop harvested data of a publisher and its cached issues"""
+        publisher.submissions = []
+        with self._issue_guard:
+            for key in [key for key in self.issues
+                        if key[0] == publisher.url]:
+                del self.issues[key]
+                self._issue_locks.pop(key, None)
 
     def request_contexts(self) -> None:
         """loop publishers, request data form server"""
-        for publisher in self.publishers:
-            publisher_url = publisher._href
-            url_path = publisher.url_path
-            if url_path not in self.journals:
+        for publisher in list(self.publishers):
+            if publisher.url_path not in self.journals:
                 return
-            api_token: str = self.journals[url_path]
+            if not self.request_context(publisher):
+                self.publishers.remove(publisher)
+
+    def request_context(self, publisher) -> bool:
+        """request context data of a single publisher, without it
+           the journal is skipped and its cursor stays"""
+        publisher_url = publisher._href
+        api_token: str = self.journals[publisher.url_path]
+        try:
             context_dict = self._server_request(publisher_url, api_token)
-            logger.info(
-                f"request {publisher_url}"
-                f" / Contact Email {context_dict['contactEmail']}")
-            publisher._data.update(context_dict)
+        except requests.exceptions.RequestException as err:
+            logger.error(f"skip journal {publisher.url_path}: {err}")
+            self.report.add('error server request', publisher_url)
+            self.cursors_seen.pop(publisher.url_path, None)
+            return False
+        logger.info(
+            f"request {publisher_url}"
+            f" / Contact Email {context_dict['contactEmail']}")
+        publisher.update(context_dict)
+        return True
 
     def rest_call_issue(self, journal_url, issue_id) -> str:
         """build issue call by id for server REST-request"""
@@ -208,11 +402,32 @@ class DataPoll():
         logger.debug(f"build issue REST call: {rest_call}")
         return rest_call
 
-    def rest_call_submissions(self, journal_url, offset=0) -> str:
+    def request_issue(self, journal_url, issue_id, api_token) -> dict:
+        """request issue detail only once per run,
+           every submission gets its own copy"""
+        key = (journal_url, issue_id)
+        with self._issue_guard:
+            lock = self._issue_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.issues:
+                issue_request = self.rest_call_issue(journal_url, issue_id)
+                self.issues[key] = self._server_request(
+                    issue_request, api_token)
+            else:
+                logger.debug(f'use cached issue {issue_id} of {journal_url}')
+        # filters modify metadata values in place, never share them
+        return copy.deepcopy(self.issues[key])
+
+    def rest_call_submissions(self, journal_url, offset=0,
+                              newest_first=False) -> str:
         """build submissions call for server REST-request"""
         endpoint = self.endpoint_submissions
         mark = '&' if '?' in endpoint else '?'
         endpoint = f"{endpoint}{mark}offset={offset}&isPublish=true"
+        if self.page_size:
+            endpoint += f"&count={self.page_size}"
+        if newest_first:
+            endpoint += "&orderBy=lastModified&orderDirection=DESC"
         rest_call = ''.join([
             journal_url, endpoint])
         logger.debug(
@@ -226,106 +441,222 @@ class DataPoll():
             if fd['assocId'] == int(assocId):
                 return fd['id']
 
+    @staticmethod
+    def file_records(publication) -> list:
+        """galleys (OJS) or publicationFormats (OMP)"""
+        if 'publicationFormats' in publication:
+            return publication['publicationFormats']
+        return publication['galleys']
+
+    def known_from_listing(self, subm) -> bool:
+        """processed or remote_url set for all files,
+           no detail request needed to tell"""
+        if subm['currentPublicationId'] in self.processed:
+            return True
+        records = [record for publication in subm['publications']
+                   for record in self.file_records(publication)]
+        return bool(records) and all(
+            record['urlRemote'] for record in records)
+
+    @staticmethod
+    def report_remote_url(report, url_path, publication_id, submission_id):
+        mess = ('remote_url already set for '
+                '(publication_id, submission_id)')
+        report.add(f'{url_path}: {mess}', (publication_id, submission_id))
+
+    def listed_submission(self, publisher, subm, report):
+        """Submission object of a known submission from listing
+           data, file records are marked the same way as after
+           requesting all details"""
+        submission_id = subm['id']
+        publication_id = subm['currentPublicationId']
+        logger.debug(f"known from listing {subm['_href']}, skip details")
+        for publication in subm['publications']:
+            subm['publication'] = publication
+            for record in self.file_records(publication):
+                if record['urlRemote']:
+                    record['state'] = STATE_SKIP
+                    self.report_remote_url(
+                        report, publisher.url_path,
+                        publication_id, submission_id)
+                    continue
+                report.add('already processed submissions', submission_id)
+                record['state'] = STATE_PROCESSED
+                subm.setdefault('files', []).append(record)
+        self.metrics.inc('items', stage='harvest_skipped',
+                         journal=publisher.url_path)
+        return Submission(subm, publisher, self.submission_fields)
+
+    def request_submission(self, publisher, subm, api_token, report):
+        """request details of a single published submission
+           and build the according Submission object"""
+        if not self.refresh and self.known_from_listing(subm):
+            return self.listed_submission(publisher, subm, report)
+        url_path = publisher.url_path
+        url: str = publisher.url
+        subm_data = self._server_request(subm['_href'], api_token)
+        href = subm.get('_href')
+        logger.debug(f'process subm {href}')
+        for publication in subm['publications']:
+            subm_data['publication'] = publication
+            publ_href = publication['_href']
+            submission_id = subm['id']
+            publication_id = subm['currentPublicationId']
+            publication_detail = self._server_request(
+                publ_href, api_token)
+            subm_data.update(publication_detail)
+
+            issue_id = publication_detail.get('issueId')
+
+            if issue_id:
+                issue_detail = self.request_issue(url, issue_id, api_token)
+                subm_data.update(issue_detail)
+
+            omp = 'publicationFormats' in publication
+
+            for record in self.file_records(publication):
+                record['state'] = None
+                remote_url = record['urlRemote']
+                if remote_url:
+                    logger.debug(
+                        f"remote_url already set for {publ_href}"
+                        f" ({remote_url}), continue")
+                    # the record['urlRemote'] is already set!
+                    # no further processing is required
+                    self.report_remote_url(
+                        report, url_path, publication_id, submission_id)
+                    record['state'] = STATE_SKIP
+                    continue
+
+                if omp:
+                    assoc = str(record['id'])
+                    file_id = self.get_submission_file_id(
+                        href, assoc, api_token)
+                    record['submissionFileId'] = file_id
+                else:
+                    file_id = str(record['submissionFileId'])
+
+                if publication_id in self.processed:
+                    logger.info(
+                        f'file exists in export {publ_href}, skip')
+                    report.add(
+                        'already processed submissions', submission_id)
+                    record['state'] = STATE_PROCESSED
+                subm_data.setdefault('files', []).append(record)
+
+        subm.update(subm_data)
+        return Submission(subm, publisher, self.submission_fields)
+
     def request_submissions(self) -> None:
         """query all information via OJS/OMP REST api"""
         for publisher in self.publishers:
-            url_path = publisher.url_path
-            logger.debug('#' * 100)
-            logger.debug(url_path)
-            logger.debug('#' * 100)
-            url: str = publisher.url
-            allsubmission: int = 1
-            offset: int = 0
-            published: int = 0
-            not_published: int = 0
-            if url_path not in self.journals:
-                logger.debug(f"no api token in config for {url_path}")
+            if publisher.url_path not in self.journals:
+                logger.debug(
+                    f"no api token in config for {publisher.url_path}")
                 return
-            api_token: str = self.journals[url_path]
+            self.request_journal_submissions(publisher)
+
+    def request_journal_submissions(self, publisher) -> None:
+        """request submissions of a single publisher"""
+        url_path = publisher.url_path
+        with self.metrics.timer(
+                'journal_seconds', stage='harvest', journal=url_path):
+            self._request_journal_submissions(publisher)
+        self.metrics.inc('items', len(publisher.submissions),
+                         stage='harvest', journal=url_path)
+
+    def _request_journal_submissions(self, publisher) -> None:
+        url_path = publisher.url_path
+        logger.debug('#' * 100)
+        logger.debug(url_path)
+        logger.debug('#' * 100)
+        allsubmission: int = 1
+        offset: int = 0
+        api_token: str = self.journals[url_path]
 
-            submissions_dict = {'items': []}
-            while allsubmission > offset:
+        cursor = self.cursors.get(url_path) if self.incremental\
+            else None
+        submissions_dict = {'items': []}
+        try:
+            if not cursor:
+                # no early stop without cursor, fetch pages side by side
+                submissions_dict['items'] = self.request_pages(
+                    lambda start: self.rest_call_submissions(
+                        publisher.url, start), api_token)
+            # newest first page by page, until older than cursor
+            while cursor and allsubmission > offset:
                 query_submissions = self.rest_call_submissions(
-                    publisher.url, offset)
+                    publisher.url, offset, newest_first=bool(cursor))
                 logger.debug(
                     f'request submission for {url_path}:'
                     f' {query_submissions}')
-                batch_ = self._server_request(query_submissions, api_token)
+                batch_ = self._server_request(
+                    query_submissions, api_token)
                 submissions_dict['items'].extend(batch_['items'])
                 allsubmission = batch_['itemsMax']
                 offset = len(submissions_dict['items'])
+                if cursor and batch_['items'] and self.last_modified(
+                        batch_['items'][-1]) < cursor:
+                    # newest first, all following pages are older
+                    break
+        except requests.exceptions.RequestException as err:
+            logger.error(f"skip journal {url_path}: {err}")
+            self.report.add('error server request', url_path)
+            return
+        self.register_cursor(url_path, submissions_dict['items'])
+        if cursor:
+            # equal timestamps are processed again, they might
+            # have changed after the former run in the same second
+            submissions_dict['items'] = [
+                subm for subm in submissions_dict['items']
+                if self.last_modified(subm) >= cursor]
             logger.info(
-                f'request all submissions for {url_path}')
-            logger.info(
-                'got {} issues'.format(len(submissions_dict['items'])))
-
-            for subm in submissions_dict['items']:
-                if subm['status'] != PKP_STATUS_PUBLISHED:
-                    not_published += 1
-                    continue
-                published += 1
-                subm_data = self._server_request(subm['_href'], api_token)
-                href = subm.get('_href')
-                logger.debug(f'process subm {href}')
-                for publication in subm['publications']:
-                    subm_data['publication'] = publication
-                    publ_href = publication['_href']
-                    submission_id = subm['id']
-                    publication_id = subm['currentPublicationId']
-                    publication_detail = self._server_request(
-                        publ_href, api_token)
-                    subm_data.update(publication_detail)
-
-                    issue_id = publication_detail.get('issueId')
-
-                    if issue_id:
-                        issue_request = self.rest_call_issue(url, issue_id)
-                        issue_detail = self._server_request(
-                            issue_request, api_token)
-                        subm_data.update(issue_detail)
-
-                    omp = 'publicationFormats' in publication
-
-                    file_records = publication['publicationFormats'] if omp\
-                        else publication['galleys']
-
-                    for index, record in enumerate(file_records):
-                        record['state'] = None
-                        remote_url = record['urlRemote']
-                        if remote_url:
-                            logger.debug(
-                                f"remote_url already set for {publ_href}"
-                                f" ({remote_url}), continue")
-                            # the record['urlRemote'] is already set!
-                            # no further processing is required
-                            publ_href_tail = (publication_id, submission_id)
-                            mess = ('remote_url already set for '
-                                    '(publication_id, submission_id)')
-                            self.report.add(
-                                f'{url_path}: {mess}', publ_href_tail)
-                            record['state'] = STATE_SKIP
-                            continue
-
-                        if omp:
-                            assoc = str(record['id'])
-                            file_id = self.get_submission_file_id(
-                                href, assoc, api_token)
-                            record['submissionFileId'] = file_id
-                        else:
-                            file_id = str(record['submissionFileId'])
-
-                        if publication_id in self.processed:
-                            logger.info(
-                                f'file exists in export {publ_href}, skip')
-                            self.report.add(
-                                'already processed submissions', submission_id)
-                            record['state'] = STATE_PROCESSED
-                        subm_data.setdefault('files', []).append(record)
-
-                subm.update(subm_data)
-                subm_ob = Submission(subm, publisher)
-                publisher.submissions.append(subm_ob)
-            print()
-            logger.info(
-                f"request {published} publications, "
-                f"{not_published} unpublished skipped")
+                f"{len(submissions_dict['items'])} submissions of "
+                f"{url_path} changed since {cursor}")
+        logger.info(
+            f'request all submissions for {url_path}')
+        logger.info(
+            'got {} issues'.format(len(submissions_dict['items'])))
+
+        published_items = [
+            subm for subm in submissions_dict['items']
+            if subm['status'] == PKP_STATUS_PUBLISHED]
+        published: int = len(published_items)
+        not_published: int = len(submissions_dict['items']) - published
+
+        def harvest(subm):
+            # report entries are collected per submission and
+            # replayed in listing order, whatever the worker count
+            notes = DeferredReport()
+            try:
+                subm_ob = self.request_submission(
+                    publisher, subm, api_token, notes)
+            except requests.exceptions.RequestException as err:
+                logger.error(f"skip submission {subm['_href']}: {err}")
+                notes.add('error server request', subm['_href'])
+                subm_ob = None
+            return subm_ob, notes
+
+        results = ordered_map(
+            harvest, published_items, self.harvest_workers)
+        harvested = []
+        unfinished = self.unfinished.setdefault(url_path, [])
+        for subm, (subm_ob, notes) in zip(published_items, results):
+            notes.flush(self.report)
+            if subm_ob is None:
+                unfinished.append((None, self.last_modified(subm)))
+                continue
+            publisher.submissions.append(subm_ob)
+            if subm_ob.currentPublicationId not in self.processed:
+                harvested.append(
+                    (subm_ob.currentPublicationId, url_path,
+                     None, None))
+            if any(record['state'] is None
+                   for record in getattr(subm_ob, 'files', [])):
+                unfinished.append((subm_ob.currentPublicationId,
+                                   self.last_modified(subm)))
+        self.store.mark_many(harvested, HARVESTED)
+        print()
+        logger.info(
+            f"request {published} publications, "
+            f"{not_published} unpublished skipped")
@@ -1,36 +1,66 @@
 #!/usr/bin/env python3
 
+import re
 import sys
+import html
 import string
 import logging
 import shutil
 import mimetypes
-import pycountry
 import requests
 import inspect
 from pathlib import Path
 from xml.sax.handler import ContentHandler
-from xml.sax import make_parser
+from xml.sax import parseString
 from xml.sax import SAXParseException
+from xml.sax.saxutils import escape, quoteattr
 from .data_miner import STATE_PROCESSED, STATE_SKIP
+from .http_client import HttpClient, IncompleteDownload
+from .metrics import Metrics
+from .file_cache import FileCache, Download
+from .meta_fields import compile_meta
+from . import languages
+from .state_store import StateStore, PACKAGED
+from .workers import ReportRouter, ordered_map
+from .saf_package import (
+    ZipPackage, FolderPackage, as_package, PACKAGING_ZIP, PACKAGING_FOLDER)
 from . import filters  # Need to see whole file to get all functions
 
 logger = logging.getLogger('journals-logging-handler')
 
+# not allowed in XML 1.0, U+F0BA is a private use char copied from Word
+INVALID_XML_CHARS = re.compile(
+    '[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff\uf0ba]')
+
 
 class ExportSAF:
     """Export given data to -Simple Archive Format-"""
 
-    def __init__(self, configparser, report, contexts) -> None:
+    def __init__(self, configparser, report, contexts, http=None,
+                 store=None, metrics=None) -> None:
         self.contexts = contexts
         self.load_config(configparser)
-        self.report = report
+        self.report = ReportRouter(report)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.http = http if http is not None\
+            else HttpClient(configparser, self.metrics)
+        self.store = store if store is not None\
+            else StateStore(configparser)
+        self.cache = FileCache.from_config(configparser)
+        self.size_abs = 0
 
     def load_config(self, configparser) -> None:
         """load settings from configuration file"""
         e = configparser['export']
         g = configparser['general']
-        self.meta = configparser['meta']
+        try:
+            # parse expressions once, broken ones stop us right here
+            self.meta_fields = compile_meta(configparser['meta'])
+        except ValueError as err:
+            logger.error(f'invalid section [meta]: {err}')
+            sys.exit(1)
+        self.meta_language = any(
+            'language' in field.names for field in self.meta_fields)
         self.system = g['system']
         self.export_path = e['export_path']
         self.collection = e['collection']
@@ -38,71 +68,77 @@ class ExportSAF:
         self.type = g['type']
         self.generate_filename = e.getboolean(
             'generate_filename', fallback=False)
-        self.filters_ = inspect.getmembers(filters, inspect.isfunction)
+        # 'zip' streams every item straight into its final SAF zip
+        self.packaging = e.get('packaging', fallback=PACKAGING_FOLDER)
+        # submissions exported in parallel, per host limit see [http]
+        self.download_workers = e.getint('download_workers', fallback=1)
+        if self.packaging not in (PACKAGING_FOLDER, PACKAGING_ZIP):
+            logger.error(f"unknown packaging '{self.packaging}'")
+            sys.exit(1)
+        # log time spent per filter after export
+        self.filters_ = filters.FilterChain(
+            inspect.getmembers(filters, inspect.isfunction),
+            timing=e.getboolean('filter_timing', fallback=False))
+
+    @staticmethod
+    def xml_text(value) -> str:
+        """metadata value as xml character data, values from OJS/OMP
+           may contain html entities, they are resolved first"""
+        text = html.unescape(str(value)).replace('\xa0', ' ')
+        return escape(INVALID_XML_CHARS.sub('', text))
+
+    @staticmethod
+    def build_xml(dcvalues, schema) -> str:
+        """dublin_core document, dcvalues are tuples of
+           (value, element, qualifier, language)"""
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>']
+        lines.append('<dublin_core>' if schema == 'dc'
+                     else f'<dublin_core schema={quoteattr(schema)}>')
+        for value, element, qualifier, language in dcvalues:
+            lang = f' language={quoteattr(language)}' if language else ''
+            lines.append(
+                f'  <dcvalue element={quoteattr(element)}'
+                f' qualifier={quoteattr(qualifier)}{lang}>'
+                f'{ExportSAF.xml_text(value)}</dcvalue>')
+        lines.append('</dublin_core>')
+        return '\n'.join(lines)
 
     @staticmethod
-    def write_xml_file(work_dir, dblcore_original, schema) -> None:
-        """write dublin_core.xml or metadata_<schema>.xml file"""
+    def write_xml_file(work_dir, dcvalues, schema) -> str:
+        """write dublin_core.xml or metadata_<schema>.xml file,
+           raise SAXParseException and write nothing if the
+           document is not well-formed"""
         name = 'dublin_core.xml' if schema == 'dc'\
                else f'metadata_{schema}.xml'
-        work_dir.mkdir(parents=True, exist_ok=True)
-        pth = work_dir / name
+        xml = ExportSAF.build_xml(dcvalues, schema)
+        parseString(xml.encode('utf-8'), ContentHandler())
         logger.debug(f"write {name}")
-        dcline = '  <dcvalue element="{1}" qualifier="{2}"{3}>{0}</dcvalue>'
-        dblcore = []
-        for tpl in dblcore_original:
-            if isinstance(tpl[0], str):
-                new_tuple = (tpl[0]
-                             .replace('& ', '&amp; ')
-                             .replace('<', '&lt;')
-                             .replace('>', '&gt;')
-                             .replace("&nbsp;", " ")
-                             .replace("", ""), )
-                for i in range(len(tpl)-1):
-                    new_tuple = new_tuple + (tpl[i+1], )
-                dblcore.append(new_tuple)
-            else:
-                dblcore.append(tpl)
-        dcvalues = [dcline.format(*tpl) for tpl in dblcore]
-        schema = f' schema="{schema}"' if schema != 'dc' else ''
-
-        with open(pth, 'w', encoding='utf-8') as fh:
-            fh.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-            fh.write(f'<dublin_core{schema}>\n')
-            fh.write('\n'.join(dcvalues))
-            fh.write('\n</dublin_core>')
+        as_package(work_dir).write_text(name, xml)
+        return xml
 
     @staticmethod
     def locale2isolang(local_code) -> str:
         """transform locale to isolang e.g. 'de_DE'-->'ger' """
-        locale = local_code[0:2]
-        lang = pycountry.languages.get(alpha_2=locale)
-        isolang = getattr(lang, 'bibliographic')\
-            if hasattr(lang, 'bibliographic')\
-            else getattr(lang, 'alpha_3')
-        return isolang
+        return languages.locale2isolang(local_code)
 
     @staticmethod
     def write_contents_file(work_dir, file_list) -> None:
         """write contents file"""
         filename = 'contents'
-        pth = work_dir / filename
-        with open(pth, 'w') as fh:
-            fh.writelines("{}\n".format(line) for line in file_list)
+        as_package(work_dir).write_text(
+            filename, ''.join("{}\n".format(line) for line in file_list))
 
     @staticmethod
     def write_collections_file(work_dir, collection) -> None:
         """write collections file"""
         filename = 'collections'
-        Path(work_dir).mkdir(parents=True, exist_ok=True)
-        pth = work_dir / filename
-        with open(pth, 'w') as fh:
-            fh.write(collection)
+        as_package(work_dir).write_text(filename, collection)
 
-    def write_meta_file(self, item_folder, submission) -> None:
-        """write metadata_<schema>.xml"""
+    def write_meta_file(self, package, submission) -> None:
+        """write metadata_<schema>.xml, raise SAXParseException
+           if a document is not well-formed"""
         schema_dict = {}
-        # eval-call will use following variables
+        # names available to the expressions in section [meta]
         context = submission.parent
         pages = submission.publication.get('pages', 0)
         pagestart = pageend = pages
@@ -111,21 +147,31 @@ class ExportSAF:
         except (ValueError, AttributeError):
             logger.debug(
                 f"cannot split pages ({pages}) into start and end")
+        locale = getattr(submission, 'locale', None)
+        language = None
+        if self.meta_language and locale:
+            try:
+                language = self.locale2isolang(locale)
+            except AttributeError:
+                logger.debug(f"no iso language for locale {locale}")
+        namespace = {
+            'submission': submission, 'context': context, 'pages': pages,
+            'pagestart': pagestart, 'pageend': pageend,
+            'locale': locale, 'language': language}
 
-        for k, v in self.meta.items():
-            meta_tpl = k.split('.')
-            schema = meta_tpl.pop(0)
-            while len(meta_tpl) < 3:
-                meta_tpl.append('', )
+        for field in self.meta_fields:
+            k = field.key
+            schema = field.schema
+            meta_tpl = list(field.meta_tpl)
 
-            if v.startswith('"') and v.endswith('"'):
-                # static value, read from config as string
-                value = v[1:-1]
+            if field.static:
+                value = field.value
             else:
-                value = filters.filter_metadata(k, eval(v), self.filters_)
+                value = filters.filter_metadata(
+                    k, field.evaluate(namespace), self.filters_)
                 if value == '':
-                    LoggerPID = str(submission._data['currentPublicationId'])
-                    LoggerSID = str(submission._data['submissionId'])
+                    LoggerPID = str(submission.currentPublicationId)
+                    LoggerSID = str(submission.submissionId)
                     logger.warning("no value for %s", k)
                     self.report.add("WARNING: no value for meta",
                                     "Publisher: " + context.url_path
@@ -145,7 +191,7 @@ class ExportSAF:
                                     if first != "" and family != "":
                                         value_cur = f"{family}, {first}"
                                         lang_a = self.locale2isolang(locale)
-                                        meta_tpl[-1] = f' language="{lang_a}"'
+                                        meta_tpl[-1] = lang_a
                                         schema_dict.setdefault(
                                             schema, []).append(
                                                 (value_cur, *meta_tpl), )
@@ -155,7 +201,7 @@ class ExportSAF:
                         value_cur = value[locale_meta]
                         if value_cur != "" and value_cur != []:
                             language = self.locale2isolang(locale_meta)
-                            meta_tpl[-1] = f' language="{language}"'
+                            meta_tpl[-1] = language
                             schema_dict.setdefault(
                                 schema, []).append((value_cur, *meta_tpl), )
                 else:
@@ -163,14 +209,8 @@ class ExportSAF:
                         schema_dict.setdefault(
                                 schema, []).append((value, *meta_tpl), )
         for schema, dcl in schema_dict.items():
-            self.write_xml_file(item_folder, dcl, schema)
             try:
-                name = 'dublin_core.xml' if schema == 'dc'\
-                    else f'metadata_{schema}.xml'
-                pth = str(item_folder) + "/" + str(name)
-                xmlparser = make_parser()
-                xmlparser.setContentHandler(ContentHandler())
-                xmlparser.parse(pth)
+                self.write_xml_file(package, dcl, schema)
             except SAXParseException as e:
                 logger.error("Could not create proper xml file. Error: "
                              + str(e))
@@ -179,6 +219,14 @@ class ExportSAF:
                                 + " - Metadata to be written: " + str(dcl)
                                 + " - urlPublished: "
                                 + str(submission.publication["urlPublished"]))
+                raise
+
+    def request_file(self, url, submission_id, submission_file_id):
+        """request a submission file, use file cache if configured"""
+        if self.cache is not None:
+            return self.cache.request(
+                self.http, url, submission_id, submission_file_id)
+        return Download(url, self.http, self.http.get(url, stream=True))
 
     def download_galley(self, context, work_dir, submission) -> list:
         """download files form OJS server"""
@@ -201,9 +249,16 @@ class ExportSAF:
             url = "{}/article/download/{}/{}/{}".format(
                 context_url, submission_id, galley_id, submission_file_id)
             logger.debug(f'download file: {url}')
-            response = requests.get(url, verify=False)
+            try:
+                response = self.request_file(
+                    url, submission_id, submission_file_id)
+            except requests.exceptions.RequestException as err:
+                logger.error(f'error download file {url}: {err}')
+                self.report.add('error download file', url)
+                continue
             status_code = response.status_code
             if status_code != 200:
+                response.close()
                 logger.error(f'error download file code:{status_code} {url}')
                 self.report.add(f'error download file code:{status_code}', url)
                 continue
@@ -218,18 +273,12 @@ class ExportSAF:
                         filename = self.clean_filename(filename)
                 except Exception:
                     logger.warning(f'could not extract filename from {cd}')
-            export_path = work_dir / filename
-
-            with open(export_path, 'wb') as fh:
-                for chunk in response.iter_content(chunk_size=16*1024):
-                    fh.write(chunk)
-                    print(".", end=(''))
-                else:
-                    print('')
-                logger.debug(
-                    f'download galley file at {url} '
-                    f'size: {Path(export_path).stat().st_size >> 20} Mb')
-                filenames.append(filename)
+            with as_package(work_dir).open(filename) as fh:
+                size = response.write(fh)
+            logger.debug(
+                f'download galley file at {url} '
+                f'size: {size >> 20} Mb')
+            filenames.append(filename)
         return filenames
 
     def download_publicationFormat(
@@ -248,9 +297,16 @@ class ExportSAF:
                 context_url, submission_id, format_id, submission_file_id)
 
             logger.debug(f'download file: {url}')
-            response = requests.get(url, verify=False)
+            try:
+                response = self.request_file(
+                    url, submission_id, submission_file_id)
+            except requests.exceptions.RequestException as err:
+                logger.error(f'error download file {url}: {err}')
+                self.report.add('error download file', url)
+                continue
             status_code = response.status_code
             if status_code != 200:
+                response.close()
                 logger.error(f'error download file code:{status_code} {url}')
                 self.report.add(f'error download file code:{status_code}', url)
                 continue
@@ -267,18 +323,12 @@ class ExportSAF:
                         filename = self.clean_filename(filename)
                 except Exception:
                     logger.warning(f'could not extract filename from {cd}')
-            export_path = work_dir / filename
-
-            with open(export_path, 'wb') as fh:
-                for chunk in response.iter_content(chunk_size=16*1024):
-                    fh.write(chunk)
-                    print(".", end=(''))
-                else:
-                    print('')
-                logger.debug(
-                    f'download publicationFormat file at {url} '
-                    f'size: {Path(export_path).stat().st_size >> 20} Mb')
-                filenames.append(filename)
+            with as_package(work_dir).open(filename) as fh:
+                size = response.write(fh)
+            logger.debug(
+                f'download publicationFormat file at {url} '
+                f'size: {size >> 20} Mb')
+            filenames.append(filename)
         return filenames
 
     @staticmethod
@@ -290,59 +340,140 @@ class ExportSAF:
 
     def export(self) -> None:
         """download files write SAF format"""
-        for context in self.contexts:
-            context_name = context.url_path
-            for num, submission in enumerate(context.submissions):
-                filerecords = getattr(submission, 'files', [])
-                publication_id = None
-                for filerecord in filerecords:
-                    if not filerecord:
-                        logger.info(
-                            'no files found for publisher_id '
-                            f'{submission.parent.publisher_id} '
-                            f'submission id {submission.id} '
-                            '--> {submission.publishedUrl}')
-                        self.report.add(
-                            (f'{context_name}: no files found for'),
-                            submission.publishedUrl)
-                        continue
-                    if filerecord['state'] == STATE_PROCESSED:
-                        logger.info(
-                            'files already processed '
-                            f'{submission.parent.publisher_id} '
-                            f'submission id {submission.id}')
-                        self.report.add(
-                            (f'{context_name}: files already processed'
-                                '(publisher_id, submission_id) '),
-                            (submission.parent.publisher_id, submission.id,))
-                        continue
-                    if filerecord['state'] == STATE_SKIP:
-                        self.report.add(
-                            (f'[{context_name}] remote_url set for'
-                                '(publisher_id, submission_id) '),
-                            (submission.parent.publisher_id, submission.id,))
-                        continue
-                    # yes, there is a publication --> proceed
-                    publication_id = filerecord['publicationId']
-
-                if publication_id is not None:
-                    item_folder = Path(self.export_path)\
-                        .joinpath(
-                            context_name,
-                            f'publication_id_{publication_id}',
-                            f'files_{len(filerecords)}')
-
-                    self.write_meta_file(item_folder, submission)
-                    self.write_collections_file(item_folder, self.collection)
-
-                    if self.system == 'ojs':
-                        filenames = self.download_galley(
-                            context, item_folder, submission)
-                    else:
-                        filenames = self.download_publicationFormat(
-                            context, item_folder, submission)
-
-                    self.write_contents_file(item_folder, filenames)
+        self.export_contexts(self.contexts)
+        if self.filters_.timing:
+            self.filters_.log_timings()
+
+    def export_contexts(self, contexts) -> list:
+        """export all submissions of contexts, return the zip files
+           written right away (packaging 'zip')"""
+        jobs = [(context, submission)
+                for context in contexts
+                for submission in context.submissions]
+
+        def run(job):
+            # report entries of each item are replayed in job order
+            with self.report.deferred() as notes, self.metrics.timer(
+                    'journal_seconds', stage='package',
+                    journal=job[0].url_path):
+                publication_id = self.publication_to_export(*job)
+                zipfile = None if publication_id is None\
+                    else self.export_submission(*job, publication_id)
+            return job[0], publication_id, zipfile, notes
+
+        results = ordered_map(run, jobs, self.download_workers)
+        zipfiles = []
+        for context, publication_id, zipfile, notes in results:
+            notes.flush(self.report)
+            if zipfile is not None:
+                self.register_zip(zipfile, zipfile.stem, context.url_path,
+                                  publication_id)
+                zipfiles.append(zipfile)
+        return zipfiles
+
+    def publication_to_export(self, context, submission):
+        """publication id of a submission with new files,
+           None if there is nothing to export"""
+        context_name = context.url_path
+        filerecords = getattr(submission, 'files', [])
+        publication_id = None
+        for filerecord in filerecords:
+            if not filerecord:
+                logger.info(
+                    'no files found for publisher_id '
+                    f'{submission.parent.publisher_id} '
+                    f'submission id {submission.id} '
+                    '--> {submission.publishedUrl}')
+                self.report.add(
+                    (f'{context_name}: no files found for'),
+                    submission.publishedUrl)
+                continue
+            if filerecord['state'] == STATE_PROCESSED:
+                logger.info(
+                    'files already processed '
+                    f'{submission.parent.publisher_id} '
+                    f'submission id {submission.id}')
+                self.report.add(
+                    (f'{context_name}: files already processed'
+                        '(publisher_id, submission_id) '),
+                    (submission.parent.publisher_id, submission.id,))
+                continue
+            if filerecord['state'] == STATE_SKIP:
+                self.report.add(
+                    (f'[{context_name}] remote_url set for'
+                        '(publisher_id, submission_id) '),
+                    (submission.parent.publisher_id, submission.id,))
+                continue
+            # yes, there is a publication --> proceed
+            publication_id = filerecord['publicationId']
+        return publication_id
+
+    def export_submission(self, context, submission, publication_id):
+        """write SAF item of a single submission,
+           return zip file if packaging streams into zips"""
+        context_name = context.url_path
+        filerecords = getattr(submission, 'files', [])
+        package = self.open_package(
+            context_name, publication_id, len(filerecords))
+        if package is None:
+            return None
+        try:
+            self.write_meta_file(package, submission)
+            self.write_collections_file(package, self.collection)
+
+            if self.system == 'ojs':
+                filenames = self.download_galley(
+                    context, package, submission)
+            else:
+                filenames = self.download_publicationFormat(
+                    context, package, submission)
+
+            self.write_contents_file(package, filenames)
+        except IncompleteDownload as err:
+            # never pack an item with truncated files
+            package.abort()
+            logger.error(f'skip publication {publication_id}: {err}')
+            self.report.add('error incomplete download', str(err))
+            return None
+        except SAXParseException:
+            # never import an item with missing metadata, it stays
+            # unmarked and is exported again by the next run
+            package.abort()
+            logger.error(f'skip publication {publication_id}: bad metadata')
+            return None
+        except BaseException:
+            package.abort()
+            raise
+        return package.commit()
+
+    def open_package(self, context_name, publication_id, num_files):
+        """start new SAF item, either as folder or streamed zip"""
+        files_dir = f'files_{num_files}'
+        export_pth = Path(self.export_path)
+        if self.packaging == PACKAGING_FOLDER:
+            return FolderPackage(export_pth.joinpath(
+                context_name, f'publication_id_{publication_id}', files_dir))
+        name = f'{context_name}_publication_id_{publication_id}_{files_dir}'
+        already_done = export_pth / (name + '.zip.done')
+        if already_done.is_file():
+            logger.debug(f'{already_done} is already transfered, skip...')
+            self.report.add("zip already transfered", name)
+            return None
+        return ZipPackage(export_pth / f'{name}.zip', files_dir)
+
+    def register_zip(self, zipfile, name, context_name,
+                     publication_id) -> None:
+        """account for and record a finished SAF zip"""
+        zipsize = Path(zipfile).stat().st_size
+        self.size_abs += zipsize
+        fsize = zipsize >> 20 and str(zipsize >> 20) + " Mb"\
+            or str(zipsize) + " bytes"
+        logger.info(f"write zip file {name}.zip with {fsize}")
+        self.report.add("write zip file", f"{name}.zip")
+        self.metrics.inc('zip_bytes', zipsize, journal=context_name)
+        self.metrics.inc('items', stage='package', journal=context_name)
+        self.store.mark(publication_id, PACKAGED,
+                        journal=context_name, name=name)
 
     def write_zips(self) -> None:
         """write final zip file aka 'SAF' """
@@ -351,7 +482,6 @@ class ExportSAF:
             logger.info(f"export path not found ->'{export_pth}', stop export")
             sys.exit(1)
         contexts = [d for d in export_pth.iterdir() if d.is_dir()]
-        size_abs = 0
         for context in contexts:
             items = [i for i in context.iterdir() if i.is_dir()]
             for item in items:
@@ -369,15 +499,14 @@ class ExportSAF:
                     continue
                 zipfile = shutil.make_archive(
                     str(export_pth / name), 'zip', item)
-                zipsize = Path(zipfile).stat().st_size
-                size_abs += zipsize
-                fsize = zipsize >> 20 and str(zipsize >> 20) + " Mb"\
-                    or str(zipsize) + " bytes"
-                logger.info(f"write zip file {name}.zip with {fsize}")
-                self.report.add("write zip file", f"{name}.zip")
                 if Path(zipfile).is_file():
+                    # item folders are named 'publication_id_<id>'
+                    publication_id = int(item.name.split('_')[-1])
+                    self.register_zip(zipfile, name, context.name,
+                                      publication_id)
                     shutil.rmtree(item)
             shutil.rmtree(context)
+        size_abs = self.size_abs
         if size_abs:
             fsizeabs = size_abs >> 20 and str(size_abs >> 20) + " Mb"\
                     or str(size_abs) + " bytes"
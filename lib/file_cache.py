@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from requests.structures import CaseInsensitiveDict
+from .http_client import IncompleteDownload
+
+logger = logging.getLogger('journals-logging-handler')
+
+CACHE_DB = 'index.sqlite'
+# response headers needed to name the file, even if served from cache
+KEPT_HEADERS = ('Content-Disposition', 'Content-Type')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entry (
+    key TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_disposition TEXT,
+    content_type TEXT,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entry_sha256 ON entry (sha256);
+CREATE INDEX IF NOT EXISTS entry_last_access ON entry (last_access);
+"""
+
+
+class HashingWriter:
+    """file wrapper computing sha256 of everything written"""
+
+    def __init__(self, fh) -> None:
+        self.fh = fh
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        return self.fh.write(data)
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset) -> int:
+        # only used to start a download all over again
+        if offset != 0:
+            raise ValueError('only rewind supported')
+        self.sha256 = hashlib.sha256()
+        return self.fh.seek(0)
+
+    def truncate(self) -> int:
+        return self.fh.truncate()
+
+
+class Download:
+    """file requested from OJS/OMP, content comes either from
+       the server or from the local file cache"""
+
+    def __init__(self, url, http, response=None, cache=None, key=None,
+                 entry=None) -> None:
+        self.url = url
+        self.http = http
+        self.response = response
+        self.cache = cache
+        self.key = key
+        self.entry = entry
+
+    @property
+    def status_code(self) -> int:
+        if self.response is None:
+            return 200
+        return self.response.status_code
+
+    @property
+    def headers(self):
+        if self.response is None:
+            return self.entry['headers']
+        return self.response.headers
+
+    def write(self, fh) -> int:
+        """write file content to fh, return size"""
+        if self.response is not None and self.cache is not None:
+            self.entry = self.cache.store(
+                self.key, self.url, self.response, self.http)
+            self.response = None
+        if self.entry is not None:
+            try:
+                return self.cache.copy(self.entry, fh)
+            except FileNotFoundError:
+                # evicted by a parallel download since the lookup
+                logger.info(f'{self.key} evicted, download {self.url}')
+                return self.refetch(fh)
+        return self.http.fetch(self.url, fh, self.response)
+
+    def refetch(self, fh) -> int:
+        """download without validators, bypassing the cache"""
+        response = self.http.get(self.url, stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise IncompleteDownload(
+                f'{self.url}: evicted from cache,'
+                f' status {response.status_code}')
+        return self.http.fetch(self.url, fh, response)
+
+    def close(self) -> None:
+        if self.response is not None:
+            self.response.close()
+
+
+class FileCache:
+    """Local cache of downloaded submission files, keyed by
+       (submissionId, submissionFileId), content stored once per
+       sha256 and revalidated with ETag/Last-Modified,
+       least recently used files are evicted beyond max_size
+    """
+
+    def __init__(self, path, max_size) -> None:
+        self.path = Path(path)
+        self.blobs = self.path / 'blobs'
+        self.tmp = self.path / 'tmp'
+        self.max_size = max_size
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.tmp.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            self.path / CACHE_DB, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, configparser):
+        """cache is optional, configured by section [cache]"""
+        if not configparser.has_section('cache'):
+            return None
+        c = configparser['cache']
+        if not c.get('path'):
+            return None
+        max_size = c.getint('max_size', fallback=10240) << 20
+        logger.info(f"use file cache at {c['path']}")
+        return cls(c['path'], max_size)
+
+    @staticmethod
+    def cache_key(submission_id, submission_file_id) -> str:
+        return f'{submission_id}/{submission_file_id}'
+
+    def blob_path(self, sha256) -> Path:
+        return self.blobs / sha256[:2] / sha256
+
+    def lookup(self, key):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT sha256, size, etag, last_modified,"
+                " content_disposition, content_type"
+                " FROM entry WHERE key = ?", (key, )).fetchone()
+        if row is None or not self.blob_path(row[0]).is_file():
+            return None
+        headers = CaseInsensitiveDict({
+            name: value for name, value in zip(KEPT_HEADERS, row[4:])
+            if value is not None})
+        return {'key': key, 'sha256': row[0], 'size': row[1],
+                'etag': row[2], 'last_modified': row[3],
+                'headers': headers}
+
+    @staticmethod
+    def validators(entry) -> dict:
+        """conditional request headers for a cached entry"""
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def request(self, http, url, submission_id, submission_file_id):
+        """request file, answered from cache if not modified"""
+        key = self.cache_key(submission_id, submission_file_id)
+        entry = self.lookup(key)
+        headers = self.validators(entry) if entry else {}
+        response = http.get(url, stream=True, headers=headers)
+        if entry is not None and response.status_code == 304:
+            response.close()
+            logger.debug(f'not modified, use cached {key} for {url}')
+            self.touch(key)
+            return Download(url, http, cache=self, key=key, entry=entry)
+        return Download(url, http, response, cache=self, key=key)
+
+    def store(self, key, url, response, http):
+        """stream response into cache, return new entry"""
+        part = self.tmp / f'{uuid.uuid4().hex}.part'
+        try:
+            with open(part, 'wb') as fh:
+                writer = HashingWriter(fh)
+                size = http.fetch(url, writer, response)
+            sha256 = writer.sha256.hexdigest()
+            blob = self.blob_path(sha256)
+            blob.parent.mkdir(exist_ok=True)
+            os.replace(part, blob)
+        finally:
+            part.unlink(missing_ok=True)
+        headers = response.headers
+        row = (key, sha256, size, headers.get('ETag'),
+               headers.get('Last-Modified'),
+               *[headers.get(name) for name in KEPT_HEADERS], time.time())
+        with self._lock, self.connection as con:
+            con.execute(
+                "INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                row)
+        self.evict(keep=key)
+        return self.lookup(key)
+
+    def copy(self, entry, fh) -> int:
+        with open(self.blob_path(entry['sha256']), 'rb') as blob:
+            shutil.copyfileobj(blob, fh, 1 << 20)
+        return entry['size']
+
+    def touch(self, key) -> None:
+        with self._lock, self.connection as con:
+            con.execute("UPDATE entry SET last_access = ? WHERE key = ?",
+                        (time.time(), key))
+
+    def total_size(self) -> int:
+        """size of all blobs, shared content counts once"""
+        row = self.connection.execute(
+            "SELECT sum(size) FROM"
+            " (SELECT max(size) AS size FROM entry GROUP BY sha256)"
+            ).fetchone()
+        return row[0] or 0
+
+    def evict(self, keep=None) -> None:
+        """drop least recently used entries beyond max_size,
+           except entry 'keep' which is just in use"""
+        with self._lock, self.connection as con:
+            total = self.total_size()
+            if total <= self.max_size:
+                return
+            rows = con.execute(
+                "SELECT key, sha256, size FROM entry"
+                " ORDER BY last_access").fetchall()
+            for key, sha256, size in rows:
+                if total <= self.max_size:
+                    break
+                if key == keep:
+                    continue
+                con.execute("DELETE FROM entry WHERE key = ?", (key, ))
+                shared = con.execute(
+                    "SELECT 1 FROM entry WHERE sha256 = ?",
+                    (sha256, )).fetchone()
+                if shared is None:
+                    self.blob_path(sha256).unlink(missing_ok=True)
+                    total -= size
+                logger.debug(f'evict {key} from file cache')
@@ -1,129 +1,143 @@
-import inspect
 import re
+import time
+import logging
+import threading
+
+logger = logging.getLogger('journals-logging-handler')
+
 # Add your custom filters here
 # All functions need to follow the scheme:
 
+# @applies_to("<Metadata you want to filter>", ...)
 # def <your_function_name>(k, value)
-#   if k == "<Metadata you want to filter>"
-#       <Your filtering here>
+#   <Your filtering here>
 #   return value
 
 # k will be the metadata you want to assign (dc.title, ...) in config_meta
 # value will be what was parsed from the submission
 # The returned "value" needs to be the same format as the original
 
-# All functions in this file will be called automatically
+# All functions in this file will be called automatically,
+# functions without @applies_to are called for every metadata
+# Precompile regular expressions outside of the function
 
 # The function name should start with _X_ , where X is a number
 # Functions will be used from the lowest number to the highest (alphabetically)
 
 # Example filter: Remove abstracts that are too short (<40 symbols):
 
+# @applies_to("dc.description.abstract")  # Metadatum will be the abstract
 # def _1_filter_abstract(k, value):
-#     if k == "dc.description.abstract":  # Metadatum will be the abstract
-#         new_value = {}  # New dict to keep the same "value" format
-#         for lang in value:
-#             if len(value[lang])>=40:  # Found abstract is long enough
-#                new_value[lang] = value[lang]  # Keep the found abstract
-#         value = new_value  # Replace value with new dict
+#     new_value = {}  # New dict to keep the same "value" format
+#     for lang in value:
+#         if len(value[lang])>=40:  # Found abstract is long enough
+#            new_value[lang] = value[lang]  # Keep the found abstract
+#     value = new_value  # Replace value with new dict
 #     return value  # Only the abstracts with >40 symbols will be returned
 
+
+def applies_to(*keys):
+    """declare the metadata a filter is meant for"""
+    def register(func):
+        func.metadata_keys = frozenset(keys)
+        return func
+    return register
+
+
 # Live example
 
 
+@applies_to("Metadata_you_want_to_filter")
 def _0_your_function_name(k, value):
-    if k == "Metadata_you_want_to_filter":
-        pass  # Change "value" to your likings
+    pass  # Change "value" to your likings
     return value
 
 
 # Begin of Custom ULB functions:
+@applies_to("dc.contributor.author")
 def _1_filter_author(k, value):  # Filter authors with the placeholder names
-    if k == "dc.contributor.author":
-        list_of_unwanted_names = ["admin", ".", "Verschiedene", "Autoren",
-                                  "Editor", "Herausgeber"]
-        new_value = value
-        for lang in list(value[0]['familyName'].keys()):
-            cur_name = value[0]['familyName'][lang]
-            for bad_name in list_of_unwanted_names:
-                if bad_name == cur_name:
-                    del new_value[0]['familyName'][lang]
-                    break
-        for lang in list(value[0]['givenName'].keys()):
-            cur_name = value[0]['givenName'][lang]
-            for bad_name in list_of_unwanted_names:
-                if bad_name == cur_name:
-                    del new_value[0]['givenName'][lang]
-                    break
-        value = new_value
+    list_of_unwanted_names = ["admin", ".", "Verschiedene", "Autoren",
+                              "Editor", "Herausgeber"]
+    new_value = value
+    for lang in list(value[0]['familyName'].keys()):
+        cur_name = value[0]['familyName'][lang]
+        for bad_name in list_of_unwanted_names:
+            if bad_name == cur_name:
+                del new_value[0]['familyName'][lang]
+                break
+    for lang in list(value[0]['givenName'].keys()):
+        cur_name = value[0]['givenName'][lang]
+        for bad_name in list_of_unwanted_names:
+            if bad_name == cur_name:
+                del new_value[0]['givenName'][lang]
+                break
+    value = new_value
     return value
 
 
+@applies_to("local.bibliographicCitation.issue")
 def _2_remove_placeholder_issue(k, value):  # local.bibliographicCitation= "."
-    if k == "local.bibliographicCitation.issue":
-        if value == ".":
-            value = ""
+    if value == ".":
+        value = ""
     return value
 
 
+CLEANR = re.compile('<.*?>')
+
+
+@applies_to("dc.description.abstract",
+            "dc.description.note",
+            "dc.title")
 def _3_remove_html_elements(k, value):  # Remove HTML elements like <p>
-    list_of_potential_html_metadata = ["dc.description.abstract",
-                                       "dc.description.note",
-                                       "dc.title"]
-    if k in list_of_potential_html_metadata:
-        CLEANR = re.compile('<.*?>')
-        if isinstance(value, dict):
-            for key in value.keys():
-                value[key] = re.sub(CLEANR, '', value[key])
-        else:
-            value = re.sub(CLEANR, '', value)
+    if isinstance(value, dict):
+        for key in value.keys():
+            value[key] = CLEANR.sub('', value[key])
+    else:
+        value = CLEANR.sub('', value)
     return value
 
 
+@applies_to("dc.description.abstract",
+            "dc.title")
 def _4_remove_controls(k, value):  # Filter control chars that break xml
     list_of_control_chars = [""]
-    list_of_control_metadata = ["dc.description.abstract",
-                                "dc.title"]
-    if k in list_of_control_metadata:
-        for lang in value:
-            for cchar in list_of_control_chars:
-                value[lang] = value[lang].replace(cchar, "")
+    for lang in value:
+        for cchar in list_of_control_chars:
+            value[lang] = value[lang].replace(cchar, "")
     return value
 
 
+@applies_to("dc.description.abstract",
+            "dc.description.note")
 def _5_remove_spaces(k, value):  # Remove spaces and double spaces
-    list_of_potential_space_metadata = ["dc.description.abstract",
-                                        "dc.description.note"]
-    if k in list_of_potential_space_metadata:
-        if isinstance(value, dict):
-            for key in value.keys():
-                value[key] = value[key].replace("&nbsp;", " ")\
-                                        .strip().replace("  ", " ")
-        else:
-            value = value.replace("&nbsp;", " ").strip().replace("  ", " ")
+    if isinstance(value, dict):
+        for key in value.keys():
+            value[key] = value[key].replace("&nbsp;", " ")\
+                                    .strip().replace("  ", " ")
+    else:
+        value = value.replace("&nbsp;", " ").strip().replace("  ", " ")
     return value
 
 
+@applies_to("dc.description.abstract")
 def _6_filter_abstract(k, value):  # Filters abstracts that are too short
-    if k == "dc.description.abstract":
-        new_value = {}
-        for lang in value:
-            if len(value[lang]) >= 40:
-                new_value[lang] = value[lang]
-        value = new_value
+    new_value = {}
+    for lang in value:
+        if len(value[lang]) >= 40:
+            new_value[lang] = value[lang]
+    value = new_value
     return value
 
 
+@applies_to("dc.subject",
+            "dc.publisher",
+            "dc.relation.ispartof",
+            "dc.description.abstract",
+            "dc.description.note",
+            "dc.title",
+            "local.bibliographicCitation.journaltitle")
 def _7_remove_double_metadata(k, value):  # eng-ger doubles
-    list_of_potential_doubles = ["dc.subject",
-                                 "dc.publisher",
-                                 "dc.relation.ispartof",
-                                 "dc.description.abstract",
-                                 "dc.description.note",
-                                 "dc.title",
-                                 "local.bibliographicCitation.journaltitle"
-                                 ]
-    if k in list_of_potential_doubles and isinstance(value, dict):
+    if isinstance(value, dict):
         compare_value = value.copy()
         new_value = value.copy()
         for key in value.keys():
@@ -137,12 +151,12 @@ def _7_remove_double_metadata(k, value):  # eng-ger doubles
     return value
 
 
+@applies_to("dc.rights.uri")
 def _8_fix_license(k, value):  # Make sure license URLs end with "/"
-    if k == "dc.rights.uri":
-        if value:
-            if "http" in value:
-                if value[-1] != "/":
-                    value = value + "/"
+    if value:
+        if "http" in value:
+            if value[-1] != "/":
+                value = value + "/"
     return value
 
 # End of Custom ULB Functions
@@ -151,8 +165,56 @@ def _8_fix_license(k, value):  # Make sure license URLs end with "/"
 # Do not edit below this line
 # ---------------------------
 
-def filter_metadata(k, value, filter_functions):
-    for (sfun, func) in filter_functions:
-        if (sfun != inspect.currentframe().f_code.co_name):  # No recursion
+# functions of this module which are no filters
+NOT_FILTERS = ('applies_to', 'filter_metadata')
+
+
+class FilterChain:
+    """filters of this module ordered by name, the chain of filters
+       for each metadata is built on first use, timing=True sums
+       up the time spent in every filter"""
+
+    def __init__(self, filter_functions, timing=False) -> None:
+        self.filters = [(name, func) for name, func
+                        in sorted(filter_functions, key=lambda f: f[0])
+                        if name not in NOT_FILTERS]
+        self.chains: dict = {}
+        self.timing = timing
+        self.timings: dict = {}
+        self._lock = threading.Lock()
+
+    def chain(self, k) -> tuple:
+        """filters applying to metadata k"""
+        chain = self.chains.get(k)
+        if chain is None:
+            chain = tuple(
+                (name, func) for name, func in self.filters
+                if getattr(func, 'metadata_keys', None) is None
+                or k in func.metadata_keys)
+            self.chains[k] = chain
+        return chain
+
+    def apply(self, k, value):
+        if not self.timing:
+            for _, func in self.chain(k):
+                value = func(k, value)
+            return value
+        for name, func in self.chain(k):
+            start = time.perf_counter()
             value = func(k, value)
-    return value
+            spent = time.perf_counter() - start
+            with self._lock:
+                calls, total = self.timings.get(name, (0, 0.0))
+                self.timings[name] = (calls + 1, total + spent)
+        return value
+
+    def log_timings(self) -> None:
+        for name, (calls, total) in sorted(self.timings.items()):
+            logger.info(f'filter {name}: {calls} calls, {total:.3f}s')
+
+
+def filter_metadata(k, value, filter_chain):
+    if not isinstance(filter_chain, FilterChain):
+        # list of (name, function) like inspect.getmembers
+        filter_chain = FilterChain(filter_chain)
+    return filter_chain.apply(k, value)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .metrics import Metrics, endpoint_type
+
+logger = logging.getLogger('journals-logging-handler')
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# errors while reading a response body, worth to resume
+INTERRUPTED = (requests.exceptions.ChunkedEncodingError,
+               requests.exceptions.ConnectionError,
+               requests.exceptions.Timeout)
+
+
+class IncompleteDownload(requests.exceptions.RequestException):
+    """download could not be completed"""
+
+
+class HttpClient:
+    """Pooled HTTP session shared by all stages talking to OJS/OMP,
+       keeps connections alive, applies timeouts and retries
+       transient failures with exponential backoff
+    """
+
+    def __init__(self, configparser=None, metrics=None) -> None:
+        self.load_config(configparser)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.session = self.build_session()
+
+    def load_config(self, configparser) -> None:
+        """read optional section [http], every value has a default"""
+        h = None
+        if configparser is not None and configparser.has_section('http'):
+            h = configparser['http']
+
+        def get(option, fallback):
+            return h.getfloat(option, fallback=fallback)\
+                if h is not None else fallback
+
+        self.timeout: tuple = (get('timeout_connect', 10.0),
+                               get('timeout_read', 120.0))
+        self.retries: int = int(get('retries', 3))
+        self.backoff_factor: float = get('backoff_factor', 1.0)
+        # urllib3 keeps one connection pool per host
+        self.pool_connections: int = int(get('pool_connections', 10))
+        self.max_per_host: int = int(get('max_per_host', 8))
+        # fixed buffer size for streamed downloads
+        self.chunk_size: int = int(get('chunk_size', 64 * 1024))
+
+    def build_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.max_per_host,
+            pool_block=True,
+            max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        # no need to verify, 'cause we trust the server
+        session.verify = False
+        return session
+
+    def get(self, url, **kwargs) -> requests.Response:
+        """GET request with configured timeouts, retries are done
+           by the transport, raises requests.RequestException
+           if the server stays unreachable"""
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = endpoint_type(url)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.metrics.inc('http_requests', endpoint=endpoint,
+                             status='error')
+            raise
+        self.metrics.observe('http_request_seconds',
+                             time.perf_counter() - start, endpoint=endpoint)
+        self.metrics.inc('http_requests', endpoint=endpoint,
+                         status=str(response.status_code))
+        return response
+
+    def fetch(self, url, fh, response=None) -> int:
+        """stream body of url into binary file handle fh,
+           continue interrupted transfers with Range requests and
+           check the final size against Content-Length"""
+        written = 0
+        expected = None
+        attempt = 0
+        while True:
+            if response is None:
+                headers = {'Range': f'bytes={written}-'} if written else {}
+                response = self.get(url, stream=True, headers=headers)
+                if written and response.status_code != 206:
+                    response.close()
+                    if response.status_code != 200 or not fh.seekable():
+                        raise IncompleteDownload(
+                            f'{url}: cannot resume at {written} bytes,'
+                            f' status {response.status_code}')
+                    # no range support, start all over again
+                    fh.seek(0)
+                    fh.truncate()
+                    written = 0
+                    response = None
+                    continue
+            if expected is None:
+                expected = self.expected_size(response)
+            try:
+                for chunk in response.iter_content(self.chunk_size):
+                    fh.write(chunk)
+                    written += len(chunk)
+                break
+            except INTERRUPTED as err:
+                attempt += 1
+                if attempt > self.retries:
+                    raise IncompleteDownload(
+                        f'{url}: interrupted at {written} bytes') from err
+                logger.warning(
+                    f'download {url} interrupted at {written} bytes,'
+                    f' resume ({attempt}/{self.retries}): {err}')
+                time.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            finally:
+                response.close()
+            response = None
+        if expected is not None and written != expected:
+            raise IncompleteDownload(
+                f'{url}: got {written} of {expected} bytes')
+        self.metrics.inc('downloaded_bytes', written)
+        return written
+
+    @staticmethod
+    def expected_size(response):
+        """full size of the resource, None if unknown"""
+        if response.headers.get('Content-Encoding'):
+            # length of the encoded body, not of the file
+            return None
+        content_range = response.headers.get('Content-Range')
+        if content_range and '/' in content_range:
+            total = content_range.split('/')[-1]
+            return int(total) if total.isdigit() else None
+        length = response.headers.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+
+    @staticmethod
+    def is_transient(response) -> bool:
+        """still failing after all retries?"""
+        return response.status_code in RETRY_STATUS
+
+    def close(self) -> None:
+        self.session.close()
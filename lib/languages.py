@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import sys
+import functools
+from pathlib import Path
+
+# generated at build time, see main()
+try:
+    from .iso639_2 import LANGUAGES
+except ImportError:
+    LANGUAGES = {}
+
+TABLE = Path(__file__).with_name('iso639_2.py')
+
+
+def locale2isolang(local_code) -> str:
+    """transform locale to isolang e.g. 'de_DE'-->'ger',
+       pycountry is only asked for codes missing in the table"""
+    locale = local_code[0:2]
+    isolang = LANGUAGES.get(locale)
+    if isolang is None:
+        isolang = lookup(locale)
+    return isolang
+
+
+@functools.lru_cache(maxsize=None)
+def lookup(alpha_2) -> str:
+    import pycountry  # loads a large database, import on demand
+    lang = pycountry.languages.get(alpha_2=alpha_2)
+    isolang = getattr(lang, 'bibliographic')\
+        if hasattr(lang, 'bibliographic')\
+        else getattr(lang, 'alpha_3')
+    return isolang
+
+
+def generate_table() -> dict:
+    import pycountry
+    return {lang.alpha_2: getattr(lang, 'bibliographic', lang.alpha_3)
+            for lang in pycountry.languages if hasattr(lang, 'alpha_2')}
+
+
+def main(path=TABLE) -> None:
+    """write table module, run 'python -m lib.languages' on build"""
+    table = generate_table()
+    lines = [f'    {code!r}: {isolang!r},'
+             for code, isolang in sorted(table.items())]
+    Path(path).write_text(
+        '# generated by "python -m lib.languages", do not edit\n'
+        '# alpha 2 code to ISO 639-2 (bibliographic if available)\n'
+        'LANGUAGES = {\n' + '\n'.join(lines) + '\n}\n', encoding='utf-8')
+    print(f'wrote {len(table)} languages to {path}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
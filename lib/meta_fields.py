@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import ast
+import builtins
+
+# names an expression in section [meta] may refer to,
+# provided by ExportSAF.write_meta_file for every submission
+META_NAMES = ('submission', 'context', 'pages', 'pagestart', 'pageend',
+              'locale', 'language')
+# harvested objects, their attributes are projected by the compact model
+OBJECT_NAMES = ('submission', 'context')
+
+
+class MetaField:
+    """Single entry of section [meta], parsed once at startup,
+       e.g. 'dc.title = submission.fullTitle'
+    """
+
+    def __init__(self, key, expression) -> None:
+        self.key = key
+        self.expression = expression
+        meta_tpl = key.split('.')
+        self.schema = meta_tpl.pop(0)
+        while len(meta_tpl) < 3:
+            meta_tpl.append('', )
+        # element, qualifier, language attribute
+        self.meta_tpl = tuple(meta_tpl)
+        self.code = None
+        self.value = None
+        self.names = frozenset()
+        # attributes read per object name, None if the object
+        # is used as a whole, e.g. 'getattr(submission, name)'
+        self.attributes: dict = {name: frozenset() for name in OBJECT_NAMES}
+        if expression.startswith('"') and expression.endswith('"'):
+            # static value, read from config as string
+            self.value = expression[1:-1]
+        else:
+            self.compile()
+
+    @property
+    def static(self) -> bool:
+        return self.code is None
+
+    def compile(self) -> None:
+        """compile expression, raise ValueError for broken ones"""
+        try:
+            tree = ast.parse(self.expression.strip(), mode='eval')
+        except SyntaxError as err:
+            raise ValueError(
+                f"{self.key}: invalid expression '{self.expression}'"
+                f" ({err.msg})") from err
+        loaded, bound = set(), set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                target = loaded if isinstance(node.ctx, ast.Load) else bound
+                target.add(node.id)
+            elif isinstance(node, ast.arg):
+                bound.add(node.arg)
+        unknown = loaded - bound - set(META_NAMES) - set(dir(builtins))
+        if unknown:
+            raise ValueError(
+                f"{self.key}: unknown name {', '.join(sorted(unknown))}"
+                f" in '{self.expression}', use one of"
+                f" {', '.join(META_NAMES)}")
+        self.names = frozenset(loaded & set(META_NAMES))
+        self.attributes = self.find_attributes(tree)
+        self.code = compile(tree, f'<meta {self.key}>', 'eval')
+
+    @staticmethod
+    def find_attributes(tree) -> dict:
+        attributes: dict = {name: set() for name in OBJECT_NAMES}
+        owners = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Attribute)\
+                    and isinstance(node.value, ast.Name)\
+                    and node.value.id in attributes:
+                attributes[node.value.id].add(node.attr)
+                owners.add(id(node.value))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and node.id in attributes\
+                    and id(node) not in owners:
+                attributes[node.id] = None
+        return {name: None if attrs is None else frozenset(attrs)
+                for name, attrs in attributes.items()}
+
+    def evaluate(self, namespace):
+        """value for one submission, namespace maps META_NAMES"""
+        if self.code is None:
+            return self.value
+        return eval(self.code, dict(namespace))
+
+
+def compile_meta(section) -> list:
+    """MetaField for every entry of section [meta], all
+       errors are collected into one ValueError"""
+    fields, errors = [], []
+    for key, expression in section.items():
+        try:
+            fields.append(MetaField(key, expression))
+        except ValueError as err:
+            errors.append(str(err))
+    if errors:
+        raise ValueError('\n'.join(errors))
+    return fields
+
+
+def referenced_attributes(fields, name):
+    """attributes of object 'name' read by all fields,
+       None if any field needs the whole object"""
+    attributes: frozenset = frozenset()
+    for field in fields:
+        if field.attributes[name] is None:
+            return None
+        attributes |= field.attributes[name]
+    return attributes
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger('journals-logging-handler')
+
+PREFIX = 'journal2saf'
+# upper bounds in seconds for latency histograms
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DESCRIPTIONS = {
+    'stage_seconds': 'wall time of a stage',
+    'journal_seconds': 'time spent per journal and stage',
+    'items': 'items processed per journal and stage',
+    'http_requests': 'HTTP requests per endpoint type and status',
+    'http_request_seconds': 'HTTP latency until response headers',
+    'downloaded_bytes': 'bytes downloaded from OJS/OMP',
+    'zip_bytes': 'size of written SAF zips',
+    'uploaded_bytes': 'bytes uploaded to DSpace via SFTP',
+    'ssh_connects': 'SSH connections opened to DSpace',
+    'ssh_connect_seconds': 'time spent on SSH handshake and auth',
+    'last_run_timestamp_seconds': 'end of the last run',
+}
+
+# first match wins, publications are below submissions in the url
+ENDPOINT_TYPES = (
+    ('files', re.compile(r'/download/|/files\b')),
+    ('publications', re.compile(r'/publications\b')),
+    ('issues', re.compile(r'/issues\b')),
+    ('submissions', re.compile(r'/submissions\b')),
+    ('contexts', re.compile(r'/contexts\b')),
+)
+
+
+def endpoint_type(url) -> str:
+    """classify OJS/OMP urls for request metrics"""
+    path = url.split('?')[0]
+    for name, pattern in ENDPOINT_TYPES:
+        if pattern.search(path):
+            return name
+    return 'other'
+
+
+def journal_from_name(name) -> str:
+    """journal of SAF names like 'journal_publication_id_102_files_1'"""
+    return Path(name).name.split('_publication_id_')[0]
+
+
+class Metrics:
+    """Counters and latency histograms of a single run, labelled
+       by stage, journal or endpoint, shared by all stages and
+       exported into the report and a node-exporter textfile
+    """
+
+    def __init__(self) -> None:
+        self.values: dict = {}
+        self.histograms: dict = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels) -> None:
+        key = self.key(name, labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels) -> None:
+        with self._lock:
+            self.values[self.key(name, labels)] = value
+
+    def observe(self, name, value, **labels) -> None:
+        key = self.key(name, labels)
+        with self._lock:
+            counts, total, count = self.histograms.get(
+                key, ([0] * len(BUCKETS), 0.0, 0))
+            counts = [c + (value <= bound)
+                      for c, bound in zip(counts, BUCKETS)]
+            self.histograms[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """add elapsed seconds to counter 'name'"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(name, time.perf_counter() - start, **labels)
+
+    def value(self, name, **labels):
+        return self.values.get(self.key(name, labels), 0)
+
+    def total(self, name) -> float:
+        """sum over all labels"""
+        with self._lock:
+            values = list(self.values.items())
+        return sum(value for (key, _), value in values if key == name)
+
+    def by_label(self, name, label) -> dict:
+        """values of 'name' summed up per value of 'label'"""
+        with self._lock:
+            values = list(self.values.items())
+        result: dict = {}
+        for (key, labels), value in values:
+            labels = dict(labels)
+            if key == name and label in labels:
+                result[labels[label]] = result.get(labels[label], 0) + value
+        return result
+
+    @staticmethod
+    def format_labels(labels) -> str:
+        if not labels:
+            return ''
+        pairs = ','.join(
+            '{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                             .replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in labels)
+        return '{' + pairs + '}'
+
+    def exposition(self) -> str:
+        """all metrics in prometheus text format"""
+        lines = []
+        with self._lock:
+            values = sorted(self.values.items())
+            histograms = sorted(self.histograms.items())
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f'# HELP {PREFIX}_{name} {DESCRIPTIONS[name]}')
+                lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+
+        for (name, labels), value in values:
+            # textfile is rewritten every run, values are per run
+            declare(name, 'gauge')
+            lines.append(
+                f'{PREFIX}_{name}{self.format_labels(labels)} {value}')
+        for (name, labels), (counts, total, count) in histograms:
+            declare(name, 'histogram')
+            for bound, cumulated in zip(BUCKETS, counts):
+                bucket = labels + (('le', str(bound)), )
+                lines.append(f'{PREFIX}_{name}_bucket'
+                             f'{self.format_labels(bucket)} {cumulated}')
+            bucket = labels + (('le', '+Inf'), )
+            lines.append(f'{PREFIX}_{name}_bucket'
+                         f'{self.format_labels(bucket)} {count}')
+            lines.append(
+                f'{PREFIX}_{name}_sum{self.format_labels(labels)} {total}')
+            lines.append(
+                f'{PREFIX}_{name}_count{self.format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path) -> None:
+        """write atomically, node-exporter must never read half a file"""
+        self.set('last_run_timestamp_seconds', round(time.time()))
+        path = Path(path)
+        part = path.with_name(f'.{path.name}.part')
+        part.write_text(self.exposition(), encoding='utf-8')
+        os.replace(part, path)
+        logger.info(f'wrote metrics to {path}')
+
+    def summary(self) -> list:
+        """short lines for the report"""
+        lines = []
+        for stage, seconds in self.by_label('stage_seconds', 'stage').items():
+            lines.append(f'{stage}: {seconds:.1f}s')
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        for (name, labels), (_, total, count) in histograms:
+            if name == 'http_request_seconds':
+                endpoint = dict(labels).get('endpoint')
+                lines.append(f'http {endpoint}: {count} requests,'
+                             f' avg {total / count:.2f}s')
+        connects = self.total('ssh_connects')
+        if connects:
+            lines.append(f'ssh: {connects} connects,'
+                         f' {self.total("ssh_connect_seconds"):.2f}s')
+        for name in ('downloaded_bytes', 'uploaded_bytes'):
+            size = self.total(name)
+            if size:
+                lines.append(f'{name.split("_")[0]}: {size >> 20} Mb')
+        zips = self.by_label('zip_bytes', 'journal')
+        for journal, size in sorted(zips.items()):
+            spent = self.value('journal_seconds', stage='package',
+                               journal=journal)
+            rate = f', {size / spent / (1 << 20):.1f} Mb/s' if spent else ''
+            items = self.value('items', stage='package', journal=journal)
+            lines.append(f'{journal}: {items} zips, {size >> 20} Mb{rate}')
+        return lines
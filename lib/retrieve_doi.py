@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
+import io
+import shlex
 import logging
-import paramiko
+import tarfile
 import warnings
 from pathlib import Path
-from paramiko.client import SSHClient, AutoAddPolicy
+from .ssh_session import SSHSession
+from .state_store import (
+    StateStore, DOI_RECEIVED, publication_id_from_name, saf_name)
 
 
 warnings.filterwarnings(
@@ -12,92 +16,162 @@ warnings.filterwarnings(
 
 logger = logging.getLogger('journals-logging-handler')
 
+FETCH_SFTP = 'sftp'
+FETCH_ARCHIVE = 'archive'
+
 
 class RetrieveDOI:
     """Retrieve DOI-containing files form dspace server"""
 
-    def __init__(self, configparser, report) -> None:
+    def __init__(self, configparser, report, store=None,
+                 session=None) -> None:
         self.load_config(configparser)
-        self.client = None
         self.report = report
+        self.store = store if store is not None\
+            else StateStore(configparser)
+        self.session = session if session is not None\
+            else SSHSession(configparser, report)
 
     def load_config(self, configparser) -> None:
-        s = configparser['scp']
         ds = configparser['dspace']
-        e = configparser['export']
         self.doi_path = ds['server_doifiles']
+        # 'archive' streams one tar per batch via ssh (recommended),
+        # 'sftp' reads file by file for servers without shell access
+        self.doi_fetch = ds.get('doi_fetch', fallback=FETCH_SFTP)
+        if self.doi_fetch not in (FETCH_SFTP, FETCH_ARCHIVE):
+            logger.error(f'unknown doi_fetch {self.doi_fetch}, use sftp')
+            self.doi_fetch = FETCH_SFTP
+        self.doi_batch = ds.getint('doi_batch', fallback=100)
+        e = configparser['export']
         self.export_path = e['export_path']
-        # scp needed
-        self.server = s['server']
-        self.user = s['user']
-        self.key_filename = s['key_filename']
 
-    def get_client(self) -> SSHClient | None:
-        try:
-            if self.client is not None:
-                transport = self.client.get_transport()
-                if transport:
-                    transport.send_ignore()
-                return self.client
-        except (AttributeError, EOFError):
-            # connection is closed, reconnect
-            logger.info(f'connect ssh {self.server}')
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        server_ = self.server
-        try:
-            client.connect(
-                server_,
-                username=self.user,
-                key_filename=self.key_filename)
-        except Exception as err:
-            logger.error(err)
-            logger.info(f"is sshd running on {server_}?")
-            self.report.add(f'error ssh:{server_}', err)
-            return None
-        self.client = client
-        return client
-
-    def determine_done(self) -> list:
-        files = list(Path(self.export_path).iterdir())
-        donelist = []
-        for f in files:
-            if f.name.endswith('doi'):
-                donelist.append(f.name)
-            if f.name.endswith('doi.done'):
-                donelist.append(f.name[:-5])
-        return donelist
-
-    def retrieve_files(self, already_processed=[]) -> None:
-        client = self.get_client()
-        count_done = 0
-        count = 0
-        if client is not None:
-            with client.open_sftp() as ftp_client:
-                export_path = self.export_path
-                try:
-                    doifiles = ftp_client.listdir(self.doi_path)
-                except FileNotFoundError as err:
-                    logger.error(f'{self.doi_path} not found remote, {err}')
-                    self.report.add('remote not found', self.doi_path)
-                    exit()
-                if not doifiles:
-                    logger.info("no new DOI files")
-                for doifile in doifiles:
-                    if doifile in already_processed:
-                        count_done += 1
-                        continue
-                    count += 1
-                    ftp_client.get(
-                        f"{self.doi_path}/{doifile}",
-                        f"{export_path}/{doifile}"
-                        )
-                    logger.info(f"got file --> {doifile}")
-                    ftp_client.remove(f"{self.doi_path}/{doifile}")
-                    logger.info(f"delete remote --> {doifile}")
+    def determine_done(self) -> set:
+        """names of all DOI files retrieved in former runs"""
+        return {f'{name}.doi' for name in self.store.names(DOI_RECEIVED)}
 
+    def retrieve_files(self, already_processed=set()) -> dict:
+        """read all new DOI files in one pass, commit them to the
+           store, keep a local copy and delete them remote afterwards,
+           unreadable files stay remote and are reported"""
+        dois: dict = {}
+        with self.session.sftp() as ftp_client:
+            if ftp_client is None:
+                return dois
+            try:
+                doifiles = ftp_client.listdir_attr(self.doi_path)
+            except FileNotFoundError as err:
+                logger.error(f'{self.doi_path} not found remote, {err}')
+                self.report.add('remote not found', self.doi_path)
+                exit()
+            if not doifiles:
+                logger.info("no new DOI files")
+                return dois
+            sizes = {attr.filename: attr.st_size for attr in doifiles
+                     if attr.filename not in already_processed}
+            count_done = len(doifiles) - len(sizes)
             if count_done > 0:
                 logger.info(f"{count_done} DOI files already processed")
-            client.close()
-            logger.info(f'{count} DOI files copied')
+            try:
+                if self.doi_fetch == FETCH_ARCHIVE:
+                    contents = self.read_archive(list(sizes))
+                else:
+                    contents = self.read_files(ftp_client, list(sizes))
+            except (IOError, tarfile.TarError) as err:
+                logger.error(f'reading DOI files failed: {err}')
+                self.report.add('error reading DOI files', str(err))
+                return dois
+            records = []
+            for doifile, content in contents.items():
+                try:
+                    publication_id = publication_id_from_name(doifile)
+                    doi = content.decode('utf-8').strip()
+                except (IndexError, ValueError) as err:
+                    logger.error(f'can not read DOI file {doifile}: {err}')
+                    self.report.add('error reading DOI file', doifile)
+                    continue
+                dois[doifile] = doi
+                records.append(
+                    (publication_id, None, saf_name(doifile), doi))
+                logger.info(f"got file --> {doifile}")
+            self.write_local(dois)
+            self.store.mark_many(records, DOI_RECEIVED)
+            # committed locally, safe to delete remote now,
+            # files of former runs which were left over included
+            self.remove_files(
+                ftp_client, [attr.filename for attr in doifiles
+                             if attr.filename in dois
+                             or attr.filename in already_processed])
+        logger.info(f'{len(dois)} DOI files copied')
+        return dois
+
+    def read_files(self, ftp_client, names) -> dict:
+        """contents by name, open, read and close cost a round trip
+           each per file, use 'archive' where the server has a shell"""
+        contents = {}
+        for name in names:
+            with ftp_client.open(f'{self.doi_path}/{name}', 'rb') as handle:
+                contents[name] = handle.read()
+        return contents
+
+    def write_local(self, dois) -> None:
+        """copy of every DOI file in export_path, renamed to .doi.done
+           once the remote_url is written"""
+        for doifile, doi in dois.items():
+            Path(self.export_path, doifile).write_text(doi)
+
+    def read_archive(self, names) -> dict:
+        """contents by name, one tar stream per batch of files"""
+        contents: dict = {}
+        if not names:
+            return contents
+        client = self.session.get_client()
+        if client is None:
+            raise IOError(f'no connection to {self.session.server}')
+        for start in range(0, len(names), self.doi_batch):
+            archive = self.run(
+                client, 'tar -cf -', names[start:start + self.doi_batch])
+            with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+                for member in tar.getmembers():
+                    extracted = tar.extractfile(member)
+                    if extracted is not None:
+                        contents[Path(member.name).name] = extracted.read()
+        return contents
+
+    def run(self, client, command, names) -> bytes:
+        """run command in DOI folder with names as arguments"""
+        arguments = ' '.join(shlex.quote(name) for name in names)
+        _, stdout, stderr = client.exec_command(
+            f'cd {shlex.quote(self.doi_path)} && {command} -- {arguments}')
+        output = stdout.read()
+        if stdout.channel.recv_exit_status() != 0:
+            raise IOError(stderr.read().decode('utf-8', 'replace').strip())
+        return output
+
+    def remove_files(self, ftp_client, names) -> None:
+        """delete with one 'rm' per batch, file by file via SFTP
+           only if the server runs no commands (sftp mode)"""
+        from paramiko.ssh_exception import SSHException
+        client = self.session.get_client()
+        start = 0
+        try:
+            if client is None:
+                raise IOError(f'no connection to {self.session.server}')
+            for start in range(0, len(names), self.doi_batch):
+                batch = names[start:start + self.doi_batch]
+                self.run(client, 'rm -f', batch)
+                logger.info(f"delete remote --> {len(batch)} DOI files")
+            return
+        except (IOError, SSHException) as err:
+            if self.doi_fetch == FETCH_ARCHIVE:
+                logger.error(f'delete remote DOI files failed: {err}')
+                self.report.add('error delete DOI files', str(err))
+                return
+            logger.warning(f'no batched delete, use SFTP: {err}')
+        for name in names[start:]:
+            try:
+                ftp_client.remove(f"{self.doi_path}/{name}")
+            except IOError as err:
+                logger.error(f'delete remote {name} failed: {err}')
+                self.report.add('error delete DOI file', name)
+                continue
+            logger.info(f"delete remote --> {name}")
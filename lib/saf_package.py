@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import logging
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger('journals-logging-handler')
+
+PACKAGING_FOLDER = 'folder'
+PACKAGING_ZIP = 'zip'
+
+
+class FolderPackage:
+    """SAF item written into a folder on disk,
+       zipped afterwards by ExportSAF.write_zips
+    """
+
+    def __init__(self, item_folder) -> None:
+        self.item_folder = Path(item_folder)
+
+    def write_text(self, name, text) -> None:
+        self.item_folder.mkdir(parents=True, exist_ok=True)
+        with open(self.item_folder / name, 'w', encoding='utf-8') as fh:
+            fh.write(text)
+
+    @contextmanager
+    def open(self, name):
+        """binary file handle for item file 'name', the file is
+           written as '<name>.part' and renamed when complete"""
+        self.item_folder.mkdir(parents=True, exist_ok=True)
+        target = self.item_folder / name
+        part = target.with_name(f'{name}.part')
+        try:
+            with open(part, 'wb') as fh:
+                yield fh
+        except BaseException:
+            part.unlink(missing_ok=True)
+            raise
+        os.replace(part, target)
+
+    def commit(self) -> None:
+        """folders are zipped later on"""
+        return None
+
+    def abort(self) -> None:
+        """drop the whole publication folder, write_zips must
+           never find an incomplete item"""
+        shutil.rmtree(self.item_folder.parent, ignore_errors=True)
+        logger.warning(f'discard unfinished {self.item_folder}')
+
+
+class ZipPackage:
+    """SAF item streamed straight into its final zip file,
+       written to '<name>.zip.part' and renamed on commit, so a
+       half written zip is never picked up for upload
+    """
+
+    def __init__(self, zip_path, item_dir) -> None:
+        self.zip_path = Path(zip_path)
+        self.part_path = self.zip_path.with_suffix('.zip.part')
+        self.item_dir = item_dir
+        self.zipfile = zipfile.ZipFile(
+            self.part_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        # same layout as shutil.make_archive of the item folder
+        self.zipfile.writestr(f'{item_dir}/', '')
+
+    def arcname(self, name) -> str:
+        return f'{self.item_dir}/{name}'
+
+    def write_text(self, name, text) -> None:
+        self.zipfile.writestr(self.arcname(name), text.encode('utf-8'))
+
+    def open(self, name):
+        """binary stream into zip entry 'name'"""
+        return self.zipfile.open(
+            self.arcname(name), 'w', force_zip64=True)
+
+    def commit(self) -> Path:
+        self.zipfile.close()
+        os.replace(self.part_path, self.zip_path)
+        logger.debug(f'commit {self.zip_path}')
+        return self.zip_path
+
+    def abort(self) -> None:
+        self.zipfile.close()
+        self.part_path.unlink(missing_ok=True)
+        logger.warning(f'discard unfinished {self.part_path}')
+
+
+def as_package(target):
+    """accept packages and plain folders likewise"""
+    if isinstance(target, (FolderPackage, ZipPackage)):
+        return target
+    return FolderPackage(target)
@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
+import io
 import smtplib
-
 import zipfile
-import os
 import datetime
+import logging
 
 from email import encoders
 from email.mime.base import MIMEBase
@@ -11,7 +11,14 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate
 
-import logging
+logger = logging.getLogger('journals-logging-handler')
+
+# entries shown in the mail body, longer lists go into the zip
+MAX_ENTRIES = 10
+# keys which alone are no reason to send a mail
+ROUTINE = ('elapsed time', 'remote_url already set', 'processed journals',
+           'metrics')
+SEPARATOR = '--------------------------------'
 
 
 def create_smtp_session(login, password, server, port):
@@ -24,90 +31,82 @@ def create_smtp_session(login, password, server, port):
     return session
 
 
-def send_report(sender, login, passwd, server, port, receiver, error,
-                report, system):
-    # sender: Sender email
-    # login: Login for mailserver
-    # passwd: Password for login
-    # receiver: Receiver email
-    # error: If an error appeared, set to True, else False
-    # report: The actual report
-    content = ""  # "content" will be the body of the mail
-    list_of_attachements = []
-    MaxEntries = 10
-    New_Data = False
-    for key in report.keys():
-        if "elapsed time" not in key:
-            if "remote_url already set" not in key:
-                if "processed journals" not in key:
-                    New_Data = True # Something interesting to report
-        content = content + key + ":\n"
-        if len(report[key]) > MaxEntries:
-            filename = ""
-            for char in key:
-                if char.isalpha() or char.isdigit():
-                    filename = filename + char
-                else:
-                    filename = filename + "_"
-            filename = filename + ".txt"
-            with open(filename, mode="a", encoding="utf-8") as file:
-                file.write(key)
-                file.write("\n")
-                for item in report[key]:
-                    file.write(str(item))
-                    file.write("\n")
-            list_of_attachements.append(filename)
-            content = content + "More than " + str(MaxEntries) + " entries!" + "\n"
-            content = content + "Full list in file: " + filename + "\n"
+def attachment_name(key) -> str:
+    return ''.join(char if char.isalnum() else '_' for char in key) + '.txt'
+
+
+def render_report(report) -> tuple:
+    """mail body and attachments {filename: text} of a Report,
+       every key shows its count and at most MAX_ENTRIES values"""
+    lines = []
+    attachments = {}
+    for key, values in report.report.items():
+        count = report.counts.get(key, len(values))
+        lines.append(f'{key}:')
+        if count > MAX_ENTRIES:
+            filename = attachment_name(key)
+            kept = '' if count == len(values)\
+                else f' (first {len(values)} of {count})'
+            attachments[filename] = '\n'.join(
+                [f'{key}{kept}'] + [str(value) for value in values]) + '\n'
+            lines.append(f'More than {MAX_ENTRIES} entries! [{count}]')
+            lines.append(f'Full list in file: {filename}')
         else:
-            for item in report[key]:
-                content = content + str(item) + "\n"
-        content = content + "--------------------------------\n"
-    message = MIMEMultipart()
-    # Subject contains warning if error in log
-    if error:
-        subject = "[ERROR]"
-    else:
-        subject = "[Success]"
+            lines.extend(str(value) for value in values)
+        lines.append(SEPARATOR)
+    return '\n'.join(lines) + '\n', attachments
 
-    # Create zip for attachements, if attachements exist
-    if list_of_attachements:
-        current_date = datetime.date.today().strftime("%Y-%m-%d")
-        zip_filename = "Logs_" + current_date + ".zip"
-        with zipfile.ZipFile(zip_filename, mode="w") as zipF:
-            for file in list_of_attachements:
-                zipF.write(file)
 
-        # Attach zipfile
-        with open(zip_filename, "rb") as attach:
-            attachement = MIMEBase("application", "octet-stream")
-            attachement.set_payload(attach.read())
-        encoders.encode_base64(attachement)
-        attachement.add_header("Content-Disposition",
-                               "attachment; filename=" + zip_filename,)
-        message.attach(attachement)
+def zip_attachments(attachments) -> bytes:
+    """all attachments in one zip, built in memory"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, mode='w',
+                         compression=zipfile.ZIP_DEFLATED) as zip_:
+        for filename, text in attachments.items():
+            zip_.writestr(filename, text)
+    return buffer.getvalue()
 
-    message["From"] = sender
-    message["To"] = receiver
-    message["Subject"] = subject + " " + system.upper() +\
-        "-DSpace-Migration: Report"
-    message["Date"] = formatdate(localtime=True)
-    message.attach(MIMEText(content, "plain"))
 
-    full_email = message.as_string()
-    if New_Data: # Only send mail if something happened
-        try:
-            with create_smtp_session(login, passwd, server, port) as session:
-                session.sendmail(sender, receiver, full_email)
-        except (smtplib.SMTPException, ConnectionRefusedError) as exc:
-            logger = logging.getLogger('journals-logging-handler')
-            logger.error('could not send report %s', exc)
-    else:
-        print("Not sending email, nothing to report")
+def build_message(sender, receivers, error, content, attachments,
+                  system) -> MIMEMultipart:
+    message = MIMEMultipart()
+    # Subject contains warning if error in log
+    subject = '[ERROR]' if error else '[Success]'
+    if attachments:
+        current_date = datetime.date.today().strftime('%Y-%m-%d')
+        zip_filename = f'Logs_{current_date}.zip'
+        attachment = MIMEBase('application', 'octet-stream')
+        attachment.set_payload(zip_attachments(attachments))
+        encoders.encode_base64(attachment)
+        attachment.add_header('Content-Disposition',
+                              f'attachment; filename={zip_filename}')
+        message.attach(attachment)
+    message['From'] = sender
+    message['To'] = ', '.join(receivers)
+    message['Subject'] = f'{subject} {system.upper()}'\
+        '-DSpace-Migration: Report'
+    message['Date'] = formatdate(localtime=True)
+    message.attach(MIMEText(content, 'plain'))
+    return message
 
 
-    # Cleanup Step
-    if list_of_attachements:
-        for file in list_of_attachements:
-            os.remove(file)
-        os.remove(zip_filename)
+def send_report(sender, login, passwd, server, port, receivers, error,
+                report, system):
+    # sender: Sender email
+    # login: Login for mailserver
+    # passwd: Password for login
+    # receivers: list of receiver emails, all get the same message
+    # error: If an error appeared, set to True, else False
+    # report: The actual report (journal2saf.Report)
+    if all(any(routine in key for routine in ROUTINE)
+           for key in report.report):
+        print("Not sending email, nothing to report")
+        return
+    content, attachments = render_report(report)
+    message = build_message(sender, receivers, error, content,
+                            attachments, system)
+    try:
+        with create_smtp_session(login, passwd, server, port) as session:
+            session.sendmail(sender, receivers, message.as_string())
+    except (smtplib.SMTPException, ConnectionRefusedError) as exc:
+        logger.error('could not send report %s', exc)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+from .metrics import Metrics
+
+if TYPE_CHECKING:
+    from paramiko import SFTPClient
+    from paramiko.client import SSHClient
+
+logger = logging.getLogger('journals-logging-handler')
+
+
+class SSHSession:
+    """One SSH connection to the DSpace server per run, shared by
+       all stages, every stage works on its own SFTP channels,
+       after a failed connect no stage tries again in this run
+    """
+
+    def __init__(self, configparser, report=None, metrics=None) -> None:
+        self.load_config(configparser)
+        self.report = report
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.client: 'SSHClient | None' = None
+        self.unreachable = False
+        self._lock = threading.Lock()
+
+    def load_config(self, configparser) -> None:
+        s = configparser['scp']
+        self.server = s['server']
+        self.user = s['user']
+        self.key_filename = s['key_filename']
+        self.window_size = s.getint('window_size', fallback=8 << 20)
+        self.max_packet_size = s.getint('max_packet_size', fallback=32768)
+
+    def is_alive(self) -> bool:
+        if self.client is None:
+            return False
+        from paramiko.ssh_exception import SSHException
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (EOFError, OSError, SSHException):
+            return False
+        return True
+
+    def get_client(self) -> 'SSHClient | None':
+        """connected client, reconnects if the connection dropped,
+           None once a connect failed"""
+        with self._lock:
+            if self.unreachable:
+                return None
+            if self.is_alive():
+                return self.client
+            if self.client is not None:
+                logger.info(f'ssh connection to {self.server} lost')
+                self.client.close()
+                self.client = None
+            self.client = self.connect()
+            self.unreachable = self.client is None
+            return self.client
+
+    def connect(self) -> 'SSHClient | None':
+        # paramiko is slow to import, load it when connecting
+        from paramiko.client import SSHClient, AutoAddPolicy
+        logger.info(f'connect ssh {self.server}')
+        client = SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(AutoAddPolicy())
+        start = time.perf_counter()
+        try:
+            client.connect(
+                self.server,
+                username=self.user,
+                key_filename=self.key_filename)
+        except Exception as err:
+            logger.error(err)
+            logger.info(f"is sshd running on {self.server}?")
+            if self.report is not None:
+                self.report.add(f'error ssh:{self.server}', err)
+            return None
+        self.metrics.inc('ssh_connect_seconds', time.perf_counter() - start)
+        self.metrics.inc('ssh_connects')
+        return client
+
+    def open_sftp(self) -> 'SFTPClient | None':
+        """new SFTP channel with tuned window and packet size"""
+        client = self.get_client()
+        if client is None:
+            return None
+        from paramiko import SFTPClient
+        return SFTPClient.from_transport(
+            client.get_transport(), window_size=self.window_size,
+            max_packet_size=self.max_packet_size)
+
+    @contextmanager
+    def sftp(self):
+        """SFTP channel closed on exit, None without connection"""
+        channel = self.open_sftp()
+        try:
+            yield channel
+        finally:
+            if channel is not None:
+                channel.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self.client is not None:
+                self.client.close()
+                self.client = None
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+import re
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger('journals-logging-handler')
+
+STATE_DB = 'journal2saf.sqlite'
+# relative state paths start here, not in the working directory,
+# a cron job may be started anywhere
+HOME = Path(__file__).resolve().parent.parent
+
+# lifecycle of a publication, each stage is a timestamp column
+HARVESTED = 'harvested'
+PACKAGED = 'packaged'
+UPLOADED = 'uploaded'
+DOI_RECEIVED = 'doi_received'
+REMOTE_URL_WRITTEN = 'remote_url_written'
+STAGES = (HARVESTED, PACKAGED, UPLOADED, DOI_RECEIVED, REMOTE_URL_WRITTEN)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS publication (
+    publication_id INTEGER PRIMARY KEY,
+    journal TEXT,
+    name TEXT,
+    doi TEXT,
+    harvested TEXT,
+    packaged TEXT,
+    uploaded TEXT,
+    doi_received TEXT,
+    remote_url_written TEXT
+);
+CREATE INDEX IF NOT EXISTS publication_name ON publication (name);
+CREATE TABLE IF NOT EXISTS cursor (
+    journal TEXT PRIMARY KEY,
+    mark TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS setting (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def publication_id_from_name(name) -> int:
+    """extract publication id from SAF based file names like
+       'journal_publication_id_102_files_1.zip.done', the journal
+       may contain '_' too, raises ValueError for other names"""
+    match = re.search(r'_publication_id_(\d+)_', name)
+    if match is None:
+        raise ValueError(f'no publication id in {name}')
+    return int(match.group(1))
+
+
+def saf_name(name) -> str:
+    """SAF name without any suffix"""
+    return name.split('.')[0]
+
+
+def check_stage(stage) -> str:
+    """stage names are part of the queries, never trust them"""
+    if stage not in STAGES:
+        raise ValueError(f'unknown stage {stage}')
+    return stage
+
+
+class StateStore:
+    """Local sqlite database keeping the state of every publication
+       and the harvest cursors between runs
+    """
+
+    def __init__(self, configparser=None, path=None) -> None:
+        if path is None:
+            state_path = configparser.get(
+                'general', 'state_path', fallback='state')
+            path = HOME / state_path / STATE_DB
+        self.path = Path(path)
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """open database on first use"""
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            logger.debug(f'open state database {self.path}')
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    @staticmethod
+    def now() -> str:
+        return datetime.now().isoformat(sep=' ', timespec='seconds')
+
+    def mark(self, publication_id, stage, journal=None, name=None,
+             doi=None) -> None:
+        """record that publication passed given stage"""
+        self.mark_many([(publication_id, journal, name, doi)], stage)
+
+    def mark_many(self, records, stage) -> None:
+        """record stage for many (publication_id, journal, name, doi)
+           tuples in one transaction"""
+        check_stage(stage)
+        now = self.now()
+        rows = [(int(pid), journal, name, doi, now)
+                for pid, journal, name, doi in records]
+        query = (
+            "INSERT INTO publication"
+            f" (publication_id, journal, name, doi, {stage})"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(publication_id) DO UPDATE SET"
+            " journal = coalesce(excluded.journal, journal),"
+            " name = coalesce(excluded.name, name),"
+            " doi = coalesce(excluded.doi, doi),"
+            f" {stage} = excluded.{stage}")
+        with self._lock, self.connection as con:
+            con.executemany(query, rows)
+
+    def has(self, publication_id, stage) -> bool:
+        """primary key lookup for a single publication"""
+        check_stage(stage)
+        with self._lock:
+            row = self.connection.execute(
+                f"SELECT {stage} FROM publication WHERE publication_id = ?",
+                (int(publication_id),)).fetchone()
+        return row is not None and row[0] is not None
+
+    def ids(self, stage) -> set:
+        """all publication ids which passed given stage"""
+        check_stage(stage)
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT publication_id FROM publication"
+                f" WHERE {stage} IS NOT NULL").fetchall()
+        return {row[0] for row in rows}
+
+    def names(self, stage) -> set:
+        """SAF names of all publications which passed given stage"""
+        check_stage(stage)
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT name FROM publication"
+                f" WHERE {stage} IS NOT NULL AND name IS NOT NULL").fetchall()
+        return {row[0] for row in rows}
+
+    def publication_id(self, name):
+        """id of the publication with given SAF name, None if unknown"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT publication_id FROM publication WHERE name = ?",
+                (name, )).fetchone()
+        return None if row is None else row[0]
+
+    def pending_remote_urls(self) -> list:
+        """(publication_id, name, doi) with DOI but no remote_url yet"""
+        with self._lock:
+            return self.connection.execute(
+                "SELECT publication_id, name, doi FROM publication"
+                " WHERE doi_received IS NOT NULL"
+                " AND remote_url_written IS NULL"
+                " ORDER BY publication_id").fetchall()
+
+    def forget(self, publication_ids) -> int:
+        """drop all progress of publications, so they are exported
+           again, return how many were known"""
+        with self._lock, self.connection as con:
+            cursor = con.executemany(
+                "DELETE FROM publication WHERE publication_id = ?",
+                [(int(pid), ) for pid in publication_ids])
+        return cursor.rowcount
+
+    def cursors(self) -> dict:
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT journal, mark FROM cursor").fetchall()
+        return dict(rows)
+
+    def save_cursors(self, cursors) -> None:
+        with self._lock, self.connection as con:
+            con.executemany(
+                "INSERT INTO cursor (journal, mark) VALUES (?, ?)"
+                " ON CONFLICT(journal) DO UPDATE SET mark = excluded.mark",
+                cursors.items())
+
+    def import_markers(self, export_path) -> None:
+        """one-time import of the marker files in export path,
+           written by former versions to track the progress"""
+        with self._lock:
+            done = self.connection.execute(
+                "SELECT value FROM setting WHERE key = 'markers_imported'"
+                ).fetchone()
+        if done:
+            return
+        records: dict = {stage: [] for stage in STAGES}
+        for file_ in Path(export_path).iterdir():
+            if not file_.is_file():
+                continue
+            name = file_.name
+            try:
+                publication_id = publication_id_from_name(name)
+            except (IndexError, ValueError):
+                logger.warning(f'ignore unknown file {file_} in export')
+                continue
+            journal = name.split('_publication_id_')[0]
+            record = (publication_id, journal, saf_name(name), None)
+            if name.endswith('.zip') or name.endswith('.zip.done'):
+                records[PACKAGED].append(record)
+            if name.endswith('.zip.done'):
+                records[UPLOADED].append(record)
+            if name.endswith('.doi') or name.endswith('.doi.done'):
+                doi = file_.read_text(encoding='utf-8').strip()
+                records[PACKAGED].append(record)
+                records[UPLOADED].append(record)
+                records[DOI_RECEIVED].append(record[:3] + (doi, ))
+            if name.endswith('.doi.done'):
+                records[REMOTE_URL_WRITTEN].append(record)
+        for stage, stage_records in records.items():
+            if stage_records:
+                self.mark_many(stage_records, stage)
+        with self._lock, self.connection as con:
+            con.execute(
+                "INSERT INTO setting (key, value)"
+                " VALUES ('markers_imported', ?)", (self.now(), ))
+        imported = len({r[0] for r in records[PACKAGED]})
+        logger.info(f'imported {imported} publications from {export_path}')
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -7,9 +7,12 @@
 ##############################################################
 
 import logging
-import paramiko
 from pathlib import Path
-from paramiko.client import SSHClient, AutoAddPolicy
+from typing import TYPE_CHECKING
+from .ssh_session import SSHSession
+
+if TYPE_CHECKING:
+    from paramiko.client import SSHClient
 
 logger = logging.getLogger(__file__.split('/')[-1])
 
@@ -17,23 +20,20 @@ logger = logging.getLogger(__file__.split('/')[-1])
 class TransferSAF:
     """Transfer SAF-zip files to dspace server"""
 
-    def __init__(self, configparser) -> None:
+    def __init__(self, configparser, session=None) -> None:
         self.load_config(configparser)
-        self.client = None
         self.report = {}
+        self.session = session if session is not None\
+            else SSHSession(configparser)
 
     def load_config(self, configparser) -> None:
         """extract data from configuration"""
-        s = configparser['scp']
         d = configparser['docker']
         ds = configparser['dspace']
         e = configparser['export']
         self.dry_run = configparser['general'].getboolean('dry-run')
         self.export_path = e['export_path']
         self.doi_prefix = e['doi_prefix']
-        self.server = s['server']
-        self.user = s['user']
-        self.key_filename = s['key_filename']
         self.docker_user = d['user']
         self.docker_container = d['container']
         self.docker_dspace = ds['docker_dspace']
@@ -43,29 +43,9 @@ class TransferSAF:
         self.server_source = ds['server_zipsource']
         self.extra = ds['extra']
 
-    def get_client(self) -> SSHClient:
-        """get or recycle ssh client"""
-        try:
-            if self.client is not None:
-                transport = self.client.get_transport()
-                if transport:
-                    transport.send_ignore()
-                return self.client
-        except (AttributeError, EOFError):
-            # connection is closed, reconnect
-            logger.info(f'connect ssh {self.server}')
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        try:
-            client.connect(
-                self.server,
-                username=self.user,
-                key_filename=self.key_filename)
-        except Exception as err:
-            logger.error(err)
-        self.client = client
-        return client
+    def get_client(self) -> 'SSHClient | None':
+        """get or recycle ssh client, None without connection"""
+        return self.session.get_client()
 
     def get_files(self) -> list:
         """return list of exported zip files"""
@@ -90,8 +70,10 @@ class TransferSAF:
         if len(files) == 0:
             logger.info('no files found to transfer')
             return
-        client = self.get_client()
-        with client.open_sftp() as ftp_client:
+        with self.session.sftp() as ftp_client:
+            if ftp_client is None:
+                logger.error('no connection, files not transferred')
+                return
             self.observer_count = 0
             for file_ in files:
                 logger.info(f'transfer file {file_}')
@@ -99,7 +81,6 @@ class TransferSAF:
                 ftp_client.put(
                     file_, f'{self.server_source}/{file_.name}',
                     callback=self.transferobserver)
-        client.close()
         logger.info('transfer done...')
 
     def run_command(self, command) -> list:
@@ -107,6 +88,9 @@ class TransferSAF:
         client = self.get_client()
         logger.info(f"\n{'-' * 100}\n{command}\n{'-' * 100}")
         lines = []
+        if client is None:
+            logger.error("ERROR: no connection")
+            return ["ERROR: no connection"]
         stin, stdout, stderr = client.exec_command(command)
         for line in stderr.read().splitlines()[:1]:
             logger.error(f"ERROR: {line}")
@@ -179,6 +163,12 @@ class TransferSAF:
         logger.info(f'delete item with handel in {mapfile} done...')
 
     def transfer(self) -> dict:
+        try:
+            return self.transfer_and_import()
+        finally:
+            self.session.close()
+
+    def transfer_and_import(self) -> dict:
         zip_files = self.get_files()
         dry_run = self.dry_run
         self.transfer_files(zip_files)
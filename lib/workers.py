@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('journals-logging-handler')
+
+
+class DeferredReport:
+    """Collect report entries of a single worker task,
+       so they can be replayed in a deterministic order
+    """
+
+    def __init__(self) -> None:
+        self.entries: list = []
+
+    def add(self, key, value) -> None:
+        self.entries.append((key, value))
+
+    def flush(self, report) -> None:
+        """hand over all collected entries to the real report"""
+        for key, value in self.entries:
+            report.add(key, value)
+        self.entries = []
+
+
+class ReportRouter:
+    """Report proxy for stages running tasks in worker threads,
+       entries added inside 'deferred' end up in the task's own
+       DeferredReport, all others go straight to the report
+    """
+
+    def __init__(self, report) -> None:
+        self.report = report
+        self._local = threading.local()
+
+    def add(self, key, value) -> None:
+        getattr(self._local, 'notes', self.report).add(key, value)
+
+    @contextmanager
+    def deferred(self):
+        notes = DeferredReport()
+        self._local.notes = notes
+        try:
+            yield notes
+        finally:
+            del self._local.notes
+
+    def __getattr__(self, name):
+        return getattr(self.report, name)
+
+
+def ordered_map(func, items, workers: int = 1) -> list:
+    """apply func to every item using up to 'workers' threads,
+       results keep the order of the given items"""
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    workers = min(workers, len(items))
+    logger.debug(f'run {len(items)} tasks with {workers} workers')
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(func, items))
+
+
+# end of input, passed along the queues of a pipeline
+_END = object()
+
+
+def pipeline(source, stages, maxsize: int = 2) -> None:
+    """run source (an iterable) and every stage in its own thread,
+       connected by queues holding at most 'maxsize' items, a stage
+       is called with a single item and returns an iterable of items
+       for the next stage, results of the last stage are dropped
+       if a thread fails, the others finish their current item and
+       drain their input, the first error is raised afterwards"""
+    queues = [queue.Queue(maxsize) for _ in stages]
+    errors: list = []
+    failed = threading.Event()
+
+    def fail(name, err):
+        logger.error(f'pipeline {name} failed: {err}')
+        errors.append(err)
+        failed.set()
+
+    def produce():
+        try:
+            for item in source:
+                if failed.is_set():
+                    break
+                queues[0].put(item)
+        except BaseException as err:
+            fail('source', err)
+        finally:
+            queues[0].put(_END)
+
+    def consume(stage, inbox, outbox):
+        name = getattr(stage, '__name__', repr(stage))
+        while True:
+            item = inbox.get()
+            if item is _END:
+                break
+            if failed.is_set():
+                # keep the queue moving, upstream must not block
+                continue
+            try:
+                for result in stage(item):
+                    if outbox is not None:
+                        outbox.put(result)
+            except BaseException as err:
+                fail(name, err)
+        if outbox is not None:
+            outbox.put(_END)
+
+    threads = [threading.Thread(target=produce, name='pipeline-source')]
+    for num, stage in enumerate(stages):
+        outbox = queues[num + 1] if num + 1 < len(queues) else None
+        threads.append(threading.Thread(
+            target=consume, args=(stage, queues[num], outbox),
+            name=f'pipeline-{num}'))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 
-import re
 import logging
 import requests
 
 from pathlib import Path
+from .http_client import HttpClient
+from .state_store import StateStore, REMOTE_URL_WRITTEN
+from .workers import ReportRouter, ordered_map
 
 logger = logging.getLogger('journals-logging-handler')
 
@@ -15,10 +17,13 @@ class WriteRemoteUrl:
        on your OMP or OJS server
     """
 
-    def __init__(self, configparser, report) -> None:
+    def __init__(self, configparser, report, http=None, store=None) -> None:
         self.load_config(configparser)
         self.client = None
-        self.report = report
+        self.report = ReportRouter(report)
+        self.http = http if http is not None else HttpClient(configparser)
+        self.store = store if store is not None\
+            else StateStore(configparser)
 
     def load_config(self, configparser) -> None:
         e = configparser['export']
@@ -27,44 +32,64 @@ class WriteRemoteUrl:
         self.doi_prefix = e['doi_prefix']
         self.journal_server = g['journal_server']
         self.token = g['token']
+        # parallel requests to SetRemoteUrlPlugin (1 = sequential)
+        self.workers = g.getint('update_remote_workers', fallback=1)
 
     def write(self):
         logger.info('process dois')
-        export = Path(self.export_path).glob('*.doi')
-        if not export:
+        pending = self.store.pending_remote_urls()
+        if not pending:
             logger.info('no dois found...')
-        doiprefix = self.doi_prefix
-        count_doi_set = 0
-        for doi in export:
-            doi = Path(doi)
-            with open(doi) as fh:
-                doival = fh.read()
-                remote_url = (doiprefix + doival.split(':')[-1]).strip()
-                parts = re.split('[_.]', doi.name)
-                publication_id = parts[3]
-                logger.info(
-                    f'got DOI {remote_url} '
-                    f'for publication_id {publication_id}')
-                params = {'publication_id': publication_id,
-                          'remote_url': remote_url,
-                          'token': self.token}
-                result = requests.get(
-                    url=self.journal_server, params=params, verify=False)
 
-                if result.status_code == 200:
-                    logger.info(
-                        f'successfully committed remote_url {remote_url} '
-                        f'with publication_id {publication_id} ')
-                    self.report.add(
-                        'successfully committed remote_url', remote_url)
-                    done = doi.with_suffix(doi.suffix + '.done')
-                    doi.rename(done)
-                    count_doi_set += 1
-                    logger.debug(f'rename DOI file to {done.resolve()}')
-                    self.report.add('rename DOI file to', str(done.resolve()))
-                else:
-                    logger.error(f'rename DOI file to failed {result.reason}')
-                    self.report.add('rename DOI file to failed', result.reason)
+        def write_deferred(item):
+            with self.report.deferred() as notes:
+                done = self.write_one(*item)
+            return done, notes
 
+        # the plugin takes a single publication per request, so
+        # many requests run side by side over the pooled session
+        count_doi_set = 0
+        for done, notes in ordered_map(write_deferred, pending,
+                                       self.workers):
+            notes.flush(self.report)
+            count_doi_set += done
         if count_doi_set:
             logger.info(f"{count_doi_set} DOIs successfully set")
+
+    def write_one(self, publication_id, name, doival) -> bool:
+        """set remote_url of a single publication, transient
+           failures are retried by the http client"""
+        remote_url = (self.doi_prefix + doival.split(':')[-1]).strip()
+        logger.info(
+            f'got DOI {remote_url} '
+            f'for publication_id {publication_id}')
+        params = {'publication_id': publication_id,
+                  'remote_url': remote_url,
+                  'token': self.token}
+        try:
+            result = self.http.get(
+                self.journal_server, params=params)
+        except requests.exceptions.RequestException as err:
+            logger.error(f'write remote_url failed {err}')
+            self.report.add('write remote_url failed', remote_url)
+            return False
+
+        if result.status_code != 200:
+            logger.error(f'rename DOI file to failed {result.reason}')
+            self.report.add('rename DOI file to failed', result.reason)
+            return False
+        logger.info(
+            f'successfully committed remote_url {remote_url} '
+            f'with publication_id {publication_id} ')
+        self.report.add(
+            'successfully committed remote_url', remote_url)
+        self.store.mark(publication_id, REMOTE_URL_WRITTEN)
+        # local copy written by RetrieveDOI, missing for DOIs which
+        # were only imported into the store from older marker files
+        doi = Path(self.export_path, f'{name}.doi')
+        if doi.is_file():
+            done = doi.with_suffix(doi.suffix + '.done')
+            doi.rename(done)
+            logger.debug(f'rename DOI file to {done.resolve()}')
+            self.report.add('rename DOI file to', str(done.resolve()))
+        return True
@@ -0,0 +1,192 @@
+""" Benchmark harvest and export against the local mock server,
+
+    python -m tests.benchmark --journals 4 --submissions 200 \\
+        --file-size 1048576 --latency 0.01 --harvest-workers 4
+
+    reports throughput, requests and peak memory of a full run,
+    with --compare-models the memory held by the harvested objects
+    of the full and the compact model
+"""
+
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import resource
+import tracemalloc
+import configparser
+from pathlib import Path
+from tests.mock_ojs import Journals, MockServer
+
+META = {
+    'dc.title': 'submission.fullTitle',
+    'dc.contributor.author': 'submission.authors',
+    'dc.description.abstract': 'submission.abstract',
+    'dc.identifier.external': '"bench" + str(submission.id)',
+    'dc.subject.ddc': '"000"',
+    'dc.language.iso': 'language',
+    'local.bibliographicCitation.pagestart': 'pagestart',
+    'local.bibliographicCitation.pageend': 'pageend',
+    'local.bibliographicCitation.volume': 'submission.volume',
+}
+
+
+def configuration(server, work_dir, system='ojs', harvest_workers=1,
+                  download_workers=1, packaging='folder'):
+    """complete configuration for a run against 'server'"""
+    CP = configparser.ConfigParser()
+    CP.optionxform = lambda option: option  # type: ignore[method-assign]
+    export_path = Path(work_dir, 'export')
+    export_path.mkdir(parents=True, exist_ok=True)
+    CP.read_dict({
+        'general': {
+            'system': system, 'type': 'article',
+            'journal_server': server.url,
+            'endpoint_contexts': '/api/v1/contexts?isEnabled=true',
+            'endpoint_submissions': '/api/v1/submissions',
+            'endpoint_issues': '/api/v1/issues',
+            'harvest_workers': str(harvest_workers),
+            'state_path': str(Path(work_dir, 'state')),
+        },
+        'http': {'backoff_factor': '0.01', 'retries': '5'},
+        'journals-token': {
+            Journals.path(num): f'token{num}'
+            for num in range(server.data.journals)},
+        'export': {
+            'export_path': str(export_path),
+            'collection': '123456789/1',
+            'packaging': packaging,
+            'download_workers': str(download_workers),
+        },
+        'meta': META,
+    })
+    return CP
+
+
+def harvest(CP, report, http, store, metrics):
+    """harvest like TaskDispatcher does, return DataPoll"""
+    from lib.data_miner import DataPoll
+    dp = DataPoll(CP, report, http=http, store=store, metrics=metrics)
+    dp.determine_done()
+    dp.load_cursors()
+    dp.request_publishers()
+    dp.serialise_data()
+    dp.request_submissions()
+    dp.request_contexts()
+    return dp
+
+
+def run(CP, report=None):
+    """harvest and export like TaskDispatcher does, return metrics"""
+    from journal2saf import Report
+    from lib.export_saf import ExportSAF
+    from lib.http_client import HttpClient
+    from lib.metrics import Metrics
+    from lib.state_store import StateStore
+    report = report if report is not None else Report()
+    metrics = Metrics()
+    http = HttpClient(CP, metrics)
+    store = StateStore(CP)
+    with metrics.timer('stage_seconds', stage='harvest'):
+        dp = harvest(CP, report, http, store, metrics)
+    with metrics.timer('stage_seconds', stage='package'):
+        saf = ExportSAF(CP, report, dp.publishers, http=http, store=store,
+                        metrics=metrics)
+        saf.export()
+        saf.write_zips()
+    dp.save_cursors()
+    store.close()
+    http.close()
+    return metrics
+
+
+def model_memory(CP) -> dict:
+    """bytes held by the harvested publishers per model"""
+    from journal2saf import Report
+    from lib.http_client import HttpClient
+    from lib.metrics import Metrics
+    from lib.state_store import StateStore
+    sizes = {}
+    for model, compact in (('full', False), ('compact', True)):
+        CP.set('general', 'compact_model', str(compact))
+        metrics = Metrics()
+        http = HttpClient(CP, metrics)
+        store = StateStore(CP)
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        dp = harvest(CP, Report(), http, store, metrics)
+        # issue cache is shared by both models, drop it
+        dp.issues.clear()
+        dp.items = []
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        sizes[model] = after - before
+        del dp
+        store.close()
+        http.close()
+    return sizes
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split(',')[0])
+    parser.add_argument('--system', choices=('ojs', 'omp'), default='ojs')
+    parser.add_argument('--journals', type=int, default=2)
+    parser.add_argument('--submissions', type=int, default=50,
+                        help='submissions per journal')
+    parser.add_argument('--files', type=int, default=1,
+                        help='galleys/publication formats per submission')
+    parser.add_argument('--file-size', type=int, default=256 * 1024)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of api requests answered with 503')
+    parser.add_argument('--harvest-workers', type=int, default=1)
+    parser.add_argument('--download-workers', type=int, default=1)
+    parser.add_argument('--packaging', choices=('folder', 'zip'),
+                        default='folder')
+    parser.add_argument('--runs', type=int, default=1,
+                        help='repeat the run, later runs are up to date')
+    parser.add_argument('--compare-models', action='store_true',
+                        help='memory of harvested objects per model')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    data = Journals(args.system, args.journals, args.submissions,
+                    args.files, args.file_size)
+    with MockServer(data, args.latency, args.error_rate) as server, \
+            tempfile.TemporaryDirectory() as work_dir:
+        CP = configuration(server, work_dir, args.system,
+                           args.harvest_workers, args.download_workers,
+                           args.packaging)
+        if args.compare_models:
+            sizes = model_memory(CP)
+            for model, size in sizes.items():
+                print(f'{model} model: {size / (1 << 20):.1f} Mb'
+                      f' ({size // (args.journals * args.submissions)}'
+                      ' bytes per submission)')
+            print(f'compact/full: {sizes["compact"] / sizes["full"]:.2f}')
+            return
+        for num in range(1, args.runs + 1):
+            server.requests.clear()
+            server.bytes_sent = 0
+            tracemalloc.start()
+            start = time.perf_counter()
+            metrics = run(CP)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            items = metrics.by_label('items', 'stage').get('package', 0)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            print(f'run {num}: {elapsed:.2f}s, {items} zips,'
+                  f' {items / elapsed:.1f} items/s,'
+                  f' {server.bytes_sent / elapsed / (1 << 20):.1f} Mb/s')
+            for line in metrics.summary():
+                print(f'  {line}')
+            print(f'  server requests: {sorted(server.requests.items())}')
+            print(f'  python peak memory: {peak >> 20} Mb,'
+                  f' max rss: {rss >> 10} Mb')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+""" Local mock of the OJS/OMP REST api with synthetic journals,
+    used by the end-to-end tests and tests/benchmark.py"""
+
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+PAGE_SIZE = 20  # default 'count' of OJS/OMP
+ISSUES_PER_JOURNAL = 4
+BLOCK = 64 * 1024
+
+
+class Journals:
+    """synthetic data, every value derived from the numbers,
+       so nothing but the numbers is kept in memory"""
+
+    def __init__(self, system='ojs', journals=2, submissions=10,
+                 files=1, file_size=16 * 1024) -> None:
+        self.system = system
+        self.journals = journals
+        self.submissions = submissions
+        self.files = files
+        self.file_size = file_size
+
+    @staticmethod
+    def path(journal) -> str:
+        return f'journal{journal}'
+
+    @staticmethod
+    def publication_id(journal, submission) -> int:
+        return journal * 100000 + submission
+
+    @staticmethod
+    def file_id(journal, submission, num) -> int:
+        return (journal * 100000 + submission) * 10 + num
+
+    def context(self, base, journal, full=False) -> dict:
+        path = self.path(journal)
+        data = {
+            'id': journal, 'urlPath': path, 'url': f'{base}/{path}',
+            'name': {'en_US': f'Journal {journal}'},
+            '_href': f'{base}/{path}/api/v1/contexts/{journal}'}
+        if full:
+            data.update({
+                'contactEmail': f'editor@{path}.example.com',
+                'description': {'en_US': f'<p>About journal {journal}</p>'},
+                'onlineIssn': f'1234-{journal:04d}',
+                'licenseUrl': 'https://creativecommons.org/licenses/by/4.0'})
+        return data
+
+    def file_records(self, journal, submission) -> list:
+        publication_id = self.publication_id(journal, submission)
+        records = []
+        for num in range(self.files):
+            file_id = self.file_id(journal, submission, num)
+            record = {'id': file_id, 'urlRemote': '',
+                      'publicationId': publication_id}
+            if self.system == 'ojs':
+                record['submissionFileId'] = file_id
+                record['file'] = {'mimetype': 'application/pdf',
+                                  'submissionId': submission}
+            records.append(record)
+        return records
+
+    def submission(self, base, journal, submission) -> dict:
+        path = self.path(journal)
+        href = f'{base}/{path}/api/v1/submissions/{submission}'
+        publication_id = self.publication_id(journal, submission)
+        files = 'galleys' if self.system == 'ojs' else 'publicationFormats'
+        # newest first by id, like a journal growing over time
+        day = 1 + submission % 28
+        return {
+            'id': submission, 'status': 3,
+            'currentPublicationId': publication_id,
+            'lastModified': f'2024-01-{day:02d} 10:00:{submission % 60:02d}',
+            '_href': href,
+            'publications': [{
+                '_href': f'{href}/publications/{publication_id}',
+                'id': publication_id, 'pages': '1-9',
+                'urlPublished': f'{base}/{path}/article/view/{submission}',
+                files: self.file_records(journal, submission)}]}
+
+    @staticmethod
+    def publication(journal, submission, publication_id) -> dict:
+        return {
+            'id': publication_id, 'submissionId': submission,
+            'issueId': 1 + submission % ISSUES_PER_JOURNAL,
+            'fullTitle': {'en_US': f'Article {submission} & more',
+                          'de_DE': f'Artikel {submission} &amp; mehr'},
+            'abstract': {'en_US': '<p>' + 'Lorem ipsum dolor. ' * 20
+                         + '</p>'},
+            'authors': [{'givenName': {'en_US': 'Ada'},
+                         'familyName': {'en_US': f'Author{submission}'}}],
+            'locale': 'en_US', 'seriesPosition': str(submission),
+            'datePublished': '2024-01-01', 'licenseUrl': ''}
+
+    @staticmethod
+    def issue(issue_id) -> dict:
+        return {'id': issue_id, 'volume': 2024, 'number': str(issue_id),
+                'year': 2024, 'datePublished': '2024-01-01'}
+
+    def submission_files(self, journal, submission) -> dict:
+        """OMP only, submission files by publication format"""
+        return {'items': [
+            {'id': self.file_id(journal, submission, num),
+             'assocId': self.file_id(journal, submission, num)}
+            for num in range(self.files)]}
+
+    def content(self, file_id, start=0):
+        """file bytes, produced block by block"""
+        pattern = f'%PDF-1.4 file {file_id} '.encode()
+        block = (pattern * (BLOCK // len(pattern) + 1))[:BLOCK]
+        pos = start
+        while pos < self.file_size:
+            size = min(BLOCK - pos % BLOCK, self.file_size - pos)
+            offset = pos % BLOCK
+            yield block[offset:offset + size]
+            pos += size
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = [p for p in url.path.split('/') if p]
+        kind = server.classify(parts)
+        server.count(kind)
+        if server.latency:
+            time.sleep(server.latency)
+        if kind != 'files' and server.fail():
+            self.send_json({'error': 'unavailable'}, 503)
+            return
+        try:
+            self.route(parts, query)
+        except (KeyError, ValueError, IndexError):
+            self.send_json({'error': 'not found'}, 404)
+
+    def route(self, parts, query):
+        data = self.server.data
+        base = self.server.url
+        journal = int(parts[0][len('journal'):])
+        if journal < 0 or journal >= data.journals:
+            raise KeyError(journal)
+        if parts[1] in ('article', 'catalog'):
+            self.send_file(int(parts[-1]))
+            return
+        api = parts[3:]
+        if api[0] == 'contexts':
+            if len(api) == 1:
+                items = [data.context(base, num)
+                         for num in range(data.journals)]
+                self.send_json({'items': items, 'itemsMax': len(items)})
+            else:
+                self.send_json(data.context(base, int(api[1]), full=True))
+        elif api[0] == 'issues':
+            self.send_json(data.issue(int(api[1])))
+        elif api[0] == 'submissions' and len(api) == 1:
+            self.send_listing(base, journal, query)
+        elif len(api) == 2:
+            submission = int(api[1])
+            self.send_json({'submissionId': submission,
+                            'locale': 'en_US'})
+        elif api[2] == 'files':
+            self.send_json(data.submission_files(journal, int(api[1])))
+        else:
+            self.send_json(data.publication(
+                journal, int(api[1]), int(api[3])))
+
+    def send_listing(self, base, journal, query):
+        data = self.server.data
+        offset = int(query.get('offset', ['0'])[0])
+        count = int(query.get('count', [str(PAGE_SIZE)])[0])
+        ids = list(range(1, data.submissions + 1))
+        if query.get('orderDirection', [''])[0] == 'DESC':
+            ids.sort(key=lambda num: (1 + num % 28, num % 60), reverse=True)
+        page = ids[offset:offset + count]
+        self.send_json({
+            'items': [data.submission(base, journal, num) for num in page],
+            'itemsMax': len(ids)})
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, file_id):
+        data = self.server.data
+        start = 0
+        range_ = self.headers.get('Range')
+        etag = f'"{file_id}-{data.file_size}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if range_ and range_.startswith('bytes='):
+            start = int(range_[len('bytes='):].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-'
+                             f'{data.file_size - 1}/{data.file_size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(data.file_size - start))
+        self.send_header('Content-Disposition',
+                         f'attachment; filename="file_{file_id}.pdf"')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        for chunk in data.content(file_id, start):
+            self.wfile.write(chunk)
+            self.server.count_bytes(len(chunk))
+
+
+class MockServer(ThreadingHTTPServer):
+    """OJS/OMP mock on localhost, injects latency (seconds per
+       request) and transient errors (503 for 'error_rate' of all
+       api requests)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, data, latency=0.0, error_rate=0.0, seed=1) -> None:
+        super().__init__(('127.0.0.1', 0), MockHandler)
+        self.data = data
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests: dict = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @staticmethod
+    def classify(parts) -> str:
+        if len(parts) > 1 and parts[1] in ('article', 'catalog'):
+            return 'files'
+        api = parts[3:]
+        if not api:
+            return 'other'
+        if api[0] in ('contexts', 'issues'):
+            return api[0]
+        if len(api) > 2:
+            return 'publications' if api[2] == 'publications'\
+                else 'submission_files'
+        return 'submissions'
+
+    def count(self, kind) -> None:
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def count_bytes(self, size) -> None:
+        with self._lock:
+            self.bytes_sent += size
+
+    def fail(self) -> bool:
+        with self._lock:
+            return self.random.random() < self.error_rate
+
+    def start(self) -> 'MockServer':
+        self._thread = threading.Thread(
+            target=self.serve_forever, name='mock-ojs', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,175 @@
+""" Test SFTP upload of SAF zips"""
+
+import io
+import configparser
+import pytest
+from pathlib import Path
+from lib.copy_saf import CopySAF, Throttle
+from lib.state_store import StateStore, PACKAGED, UPLOADED
+from journal2saf import Report
+
+
+class RemoteFile(io.BytesIO):
+
+    def __init__(self, sftp, path) -> None:
+        super().__init__()
+        self.sftp = sftp
+        self.path = path
+        self.pipelined = False
+
+    def set_pipelined(self, pipelined=True) -> None:
+        self.pipelined = pipelined
+
+    def close(self) -> None:
+        self.sftp.files[self.path] = self.getvalue()[:self.sftp.truncate]
+        super().close()
+
+
+class FakeSFTP:
+    """in-memory SFTP channel, 'truncate' simulates a short write"""
+
+    def __init__(self, truncate=None) -> None:
+        self.files: dict = {}
+        self.truncate = truncate
+        self.opened: list = []
+
+    def open(self, path, mode):
+        remote = RemoteFile(self, path)
+        self.opened.append(remote)
+        return remote
+
+    def stat(self, path):
+        class Attributes:
+            st_size = len(self.files[path])
+        return Attributes
+
+    def posix_rename(self, old, new) -> None:
+        self.files[new] = self.files.pop(old)
+
+    def remove(self, path) -> None:
+        del self.files[path]
+
+
+@pytest.fixture
+def report():
+    return Report()
+
+
+@pytest.fixture
+def copysaf(tmpdir, report):
+    CP = configparser.ConfigParser()
+    CP.read_dict({
+        'scp': {'server': 'localhost', 'user': 'dspace',
+                'key_filename': 'id_rsa', 'bandwidth_limit': '0'},
+        'dspace': {'server_zipsource': '/data/import'},
+        'export': {'export_path': str(tmpdir)},
+    })
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    store.mark_many(
+        [(pid, 'hsg', f'hsg_publication_id_{pid}_files_1', None)
+         for pid in (102, 103, 104)], PACKAGED)
+    copysaf = CopySAF(CP, report=report, store=store)
+    copysaf.observer_count = 0
+    return copysaf
+
+
+def test_upload_renames_temporary_file(tmpdir, copysaf):
+    zipfile = Path(tmpdir, 'hsg_publication_id_102_files_1.zip')
+    zipfile.write_bytes(b'x' * 100000)
+    sftp = FakeSFTP()
+    copysaf.copy_file(sftp, zipfile)
+    assert sftp.opened[0].path == \
+        '/data/import/.hsg_publication_id_102_files_1.zip.part'
+    assert sftp.opened[0].pipelined
+    assert sftp.files == {
+        '/data/import/hsg_publication_id_102_files_1.zip': b'x' * 100000}
+    assert zipfile.with_suffix('.zip.done').exists()
+    assert copysaf.store.has(102, UPLOADED)
+
+
+def test_short_upload_is_removed(tmpdir, copysaf, report):
+    zipfile = Path(tmpdir, 'hsg_publication_id_102_files_1.zip')
+    zipfile.write_bytes(b'x' * 100000)
+    sftp = FakeSFTP(truncate=5000)
+    copysaf.copy_file(sftp, zipfile)
+    assert sftp.files == {}
+    assert zipfile.exists()
+    assert not copysaf.store.has(102, UPLOADED)
+    assert report.report['error transfer file'] == [
+        'hsg_publication_id_102_files_1.zip']
+
+
+def test_throttle_spreads_chunks(monkeypatch):
+    slept = []
+    monkeypatch.setattr('lib.copy_saf.time.sleep', slept.append)
+    throttle = Throttle(1000)
+    for _ in range(3):
+        throttle.wait(500)
+    assert len(slept) == 2
+    assert slept[-1] == pytest.approx(1.0, abs=0.1)
+
+
+class RefusingSession:
+    """connected, but sshd refuses further channels"""
+
+    def get_client(self):
+        return object()
+
+    def open_sftp(self):
+        from paramiko.ssh_exception import SSHException
+        raise SSHException('administratively prohibited')
+
+
+def test_channel_error_is_reported(tmpdir, copysaf, report):
+    zipfiles = [Path(tmpdir, f'hsg_publication_id_{pid}_files_1.zip')
+                for pid in (102, 103)]
+    for zipfile in zipfiles:
+        zipfile.write_bytes(b'x' * 1000)
+    copysaf.session = RefusingSession()
+    copysaf.copy_files(zipfiles)
+    assert report.report['error transfer file'] == [
+        'hsg_publication_id_102_files_1.zip',
+        'hsg_publication_id_103_files_1.zip']
+    assert all(zipfile.exists() for zipfile in zipfiles)
+    assert not copysaf.store.has(102, UPLOADED)
+
+
+class CountingSession:
+    """hands out FakeSFTP channels, None as client if unreachable"""
+
+    def __init__(self, reachable=True) -> None:
+        self.reachable = reachable
+        self.channels: list = []
+
+    def get_client(self):
+        return object() if self.reachable else None
+
+    def open_sftp(self):
+        channel = FakeSFTP()
+        channel.close = lambda: None
+        self.channels.append(channel)
+        return channel
+
+
+def test_upload_reuses_channel(tmpdir, copysaf, report):
+    zipfiles = [Path(tmpdir, f'hsg_publication_id_{pid}_files_1.zip')
+                for pid in (102, 103, 104)]
+    for zipfile in zipfiles:
+        zipfile.write_bytes(b'x' * 1000)
+    copysaf.session = CountingSession()
+    for zipfile in zipfiles:
+        copysaf.upload(zipfile)
+    copysaf.close()
+    assert len(copysaf.session.channels) == 1
+    assert len(copysaf.session.channels[0].files) == 3
+    assert copysaf.store.ids(UPLOADED) == {102, 103, 104}
+
+
+def test_upload_keeps_zips_if_unreachable(tmpdir, copysaf, report):
+    zipfile = Path(tmpdir, 'hsg_publication_id_102_files_1.zip')
+    zipfile.write_bytes(b'x' * 1000)
+    copysaf.session = CountingSession(reachable=False)
+    copysaf.upload(zipfile)
+    assert zipfile.exists()
+    assert copysaf.session.channels == []
+    assert 'error transfer file' not in report.report
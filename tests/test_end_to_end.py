@@ -0,0 +1,37 @@
+""" Harvest and export against the local mock OJS/OMP server"""
+
+from zipfile import ZipFile
+from pathlib import Path
+import pytest
+from tests.mock_ojs import Journals, MockServer
+from tests.benchmark import configuration, run
+from journal2saf import Report
+
+
+@pytest.mark.parametrize('system', ['ojs', 'omp'])
+def test_end_to_end(tmpdir, system):
+    data = Journals(system, journals=2, submissions=3, files=2,
+                    file_size=100 * 1024)
+    with MockServer(data, error_rate=0.05) as server:
+        CP = configuration(server, tmpdir, system, harvest_workers=2,
+                           download_workers=2, packaging='zip')
+        report = Report()
+        metrics = run(CP, report)
+        zips = sorted(Path(tmpdir, 'export').glob('*.zip'))
+        assert len(zips) == 6
+        assert metrics.total('downloaded_bytes') == 12 * 100 * 1024
+        with ZipFile(zips[0]) as zipfile:
+            names = zipfile.namelist()
+            contents = zipfile.read('files_2/contents').decode().split()
+            xml = zipfile.read('files_2/dublin_core.xml').decode()
+        assert len(contents) == 2
+        assert all(f'files_2/{name}' in names for name in contents)
+        assert '&amp; more' in xml
+        # second run: everything is packaged already
+        requests_before = dict(server.requests)
+        run(CP, Report())
+        assert len(list(Path(tmpdir, 'export').glob('*.zip'))) == 6
+        assert server.requests.get('files') == requests_before['files']
+        # known from the listing, no detail requests
+        assert server.requests.get('publications')\
+            == requests_before['publications']
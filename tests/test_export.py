@@ -1,13 +1,20 @@
 """ Test functionality of journal2saf"""
 
+import time
+import inspect
 import configparser
+from xml.sax import parseString
+from xml.sax.handler import ContentHandler
 from zipfile import ZipFile
 from pathlib import Path
 import pytest
 from tests.ressources import publishers
 from tests.ressources import issue, issues
 from lib.export_saf import ExportSAF
-from lib.data_miner import DataPoll
+from lib.meta_fields import MetaField, compile_meta, referenced_attributes
+from lib import filters, languages
+from lib.data_miner import DataPoll, Publisher, Submission
+from lib.state_store import StateStore, PACKAGED
 from journal2saf import Report
 
 
@@ -68,6 +75,11 @@ def test_locale2isolang():
     assert locale == 'eng'
 
 
+def test_locale2isolang_without_table(monkeypatch):
+    monkeypatch.setattr(languages, 'LANGUAGES', {})
+    assert ExportSAF.locale2isolang('fr_FR') == 'fre'
+
+
 def test_write_contents_file(tmpdir):
     saf_files = ['testfile.foo', 'testfile.bar', ]
     ExportSAF.write_contents_file(tmpdir, saf_files)
@@ -90,6 +102,18 @@ def test_write_collections_file(tmpdir):
         assert name.strip() == collection
 
 
+def test_write_xml_file_escapes(tmpdir):
+    dcvalues = [('Tom & Jerry &amp; "Co" <b>', 'title', '', 'ger'),
+                ('a&nbsp;b\x02', 'subject', '', ''),
+                (2023, 'date', 'issued', '')]
+    ExportSAF.write_xml_file(tmpdir, dcvalues, 'dc')
+    xml = Path(tmpdir, 'dublin_core.xml').read_text(encoding='utf-8')
+    assert ('<dcvalue element="title" qualifier="" language="ger">'
+            'Tom &amp; Jerry &amp; "Co" &lt;b&gt;</dcvalue>') in xml
+    assert '>a b</dcvalue>' in xml
+    assert '>2023</dcvalue>' in xml
+
+
 def test_write_zip(tmpdir, contexts, configuration):
     configuration.set('export', 'export_path', str(tmpdir))
     report = Report()
@@ -105,3 +129,154 @@ def test_write_zip(tmpdir, contexts, configuration):
         assert path.name in zipfiles
         zipfile = ZipFile(path)
         assert min([f.split('/')[-1] in contains for f in zipfile.namelist()])
+
+
+def _download_galley(context, package, submission):
+    with package.open('journal.pdf') as fh:
+        fh.write(b'%PDF-1.4 ' * 100)
+    return ['journal.pdf', ]
+
+
+def _export(configuration, export_path, packaging, url_path=None):
+    configuration.set('export', 'export_path', str(export_path))
+    configuration.set('export', 'packaging', packaging)
+    configuration.remove_option('meta', 'dc.date.available')
+    configuration.set('meta', 'dc.title', 'submission.fullTitle')
+    publisher = Publisher(publishers.publisher['items'][0])
+    if url_path is not None:
+        publisher.url_path = url_path
+    submission = Submission({
+        'id': 103, 'submissionId': 103, 'currentPublicationId': 102,
+        'fullTitle': {'de_DE': 'Umweltbelastung & Bergbau'},
+        'publication': {'pages': '1-9', 'urlPublished': JURL},
+        'files': [{'state': None, 'publicationId': 102}]}, publisher)
+    publisher.submissions.append(submission)
+    store = StateStore(path=Path(export_path).parent / 'state.sqlite')
+    saf = ExportSAF(configuration, Report(), [publisher], store=store)
+    saf.download_galley = _download_galley
+    saf.export()
+    saf.write_zips()
+    return store
+
+
+@pytest.mark.parametrize('packaging', ['folder', 'zip'])
+def test_export_packaging(tmpdir, configuration, packaging):
+    """streamed zips have the same layout as zipped folders"""
+    export_path = tmpdir.mkdir('export')
+    store = _export(configuration, export_path, packaging)
+    paths = list(Path(export_path).iterdir())
+    assert [p.name for p in paths] == [
+        'cicadina_publication_id_102_files_1.zip']
+    with ZipFile(paths[0]) as zipfile:
+        assert sorted(zipfile.namelist()) == [
+            'files_1/', 'files_1/collections', 'files_1/contents',
+            'files_1/dublin_core.xml', 'files_1/journal.pdf',
+            'files_1/metadata_local.xml']
+        assert zipfile.read('files_1/journal.pdf').startswith(b'%PDF')
+    assert store.has(102, PACKAGED)
+
+
+@pytest.mark.parametrize('packaging', ['folder', 'zip'])
+def test_export_journal_with_underscore(tmpdir, configuration, packaging):
+    """the publication id is never parsed from the zip name"""
+    export_path = tmpdir.mkdir('export')
+    store = _export(configuration, export_path, packaging, 'cica_dina')
+    assert store.ids(PACKAGED) == {102}
+    assert store.publication_id('cica_dina_publication_id_102_files_1')\
+        == 102
+
+
+@pytest.mark.parametrize('packaging', ['folder', 'zip'])
+def test_export_aborts_on_bad_xml(tmpdir, configuration, packaging,
+                                  monkeypatch):
+    """an item without all its metadata is neither packed nor marked"""
+    def write_xml_file(work_dir, dcvalues, schema):
+        parseString(b'<dublin_core>', ContentHandler())
+
+    monkeypatch.setattr(ExportSAF, 'write_xml_file',
+                        staticmethod(write_xml_file))
+    export_path = tmpdir.mkdir('export')
+    store = _export(configuration, export_path, packaging)
+    assert list(Path(export_path).iterdir()) == []
+    assert store.ids(PACKAGED) == set()
+
+
+def test_export_parallel_deterministic(tmpdir, configuration):
+    """parallel downloads keep order of contents and report"""
+    configuration.set('export', 'export_path', str(tmpdir))
+    configuration.set('export', 'packaging', 'zip')
+    configuration.set('export', 'download_workers', '4')
+    configuration.remove_option('meta', 'dc.date.available')
+    publisher = Publisher(publishers.publisher['items'][0])
+    for num in range(4):
+        publisher.submissions.append(Submission({
+            'id': num, 'submissionId': num, 'currentPublicationId': num,
+            'publication': {'pages': '1-9', 'urlPublished': JURL},
+            'files': [{'state': None, 'publicationId': num}]}, publisher))
+
+    def slow_download(context, package, submission):
+        # first submissions finish last
+        time.sleep(0.05 * (4 - submission.id))
+        names = [f'{submission.id}_{n}.pdf' for n in range(3)]
+        for name in names:
+            with package.open(name) as fh:
+                fh.write(b'%PDF')
+        return names
+
+    report = Report()
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    saf = ExportSAF(configuration, report, [publisher], store=store)
+    saf.download_galley = slow_download
+    saf.export()
+    assert report.report['write zip file'] == [
+        f'cicadina_publication_id_{num}_files_1.zip' for num in range(4)]
+    with ZipFile(tmpdir / 'cicadina_publication_id_2_files_1.zip') as zf:
+        contents = zf.read('files_1/contents').decode().split()
+    assert contents == ['2_0.pdf', '2_1.pdf', '2_2.pdf']
+
+
+def test_meta_fields_compiled_once():
+    fields = compile_meta({
+        'dc.subject.ddc': '"000"',
+        'dc.relation.ispartof': '{3: "Series"}.get(submission.seriesId)',
+        'local.bibliographicCitation.pagestart': 'pagestart'})
+    assert fields[0].static and fields[0].value == '000'
+    assert fields[1].meta_tpl == ('relation', 'ispartof', '')
+    submission = Submission({'seriesId': 3}, None)
+    assert fields[1].evaluate({'submission': submission}) == 'Series'
+    assert fields[2].evaluate({'pagestart': '7'}) == '7'
+
+
+def test_meta_fields_errors_at_startup(configuration):
+    with pytest.raises(ValueError, match='unknown name issue'):
+        MetaField('dc.date.available', 'issue.datePublished')
+    with pytest.raises(ValueError, match='invalid expression'):
+        MetaField('dc.title', 'submission.fullTitle[')
+    with pytest.raises(SystemExit):
+        ExportSAF(configuration, Report(), [])
+
+
+def test_filter_chain_per_key():
+    chain = filters.FilterChain(
+        inspect.getmembers(filters, inspect.isfunction), timing=True)
+    names = [name for name, _ in chain.chain('dc.rights.uri')]
+    assert names == ['_8_fix_license']
+    names = [name for name, _ in chain.chain('dc.title')]
+    assert names == ['_3_remove_html_elements', '_4_remove_controls',
+                     '_7_remove_double_metadata']
+    value = chain.apply('dc.title', {'de_DE': '<p>Titel</p>'})
+    assert value == {'de_DE': 'Titel'}
+    assert chain.timings['_3_remove_html_elements'][0] == 1
+    assert chain.apply('dc.rights.uri', 'http://cc.org') == 'http://cc.org/'
+
+
+def test_meta_fields_attributes():
+    fields = compile_meta({
+        'dc.title': 'submission.fullTitle',
+        'dc.rights.uri': 'submission.licenseUrl or context.licenseUrl',
+        'dc.subject.ddc': '"000"'})
+    assert referenced_attributes(fields, 'submission') == {
+        'fullTitle', 'licenseUrl'}
+    assert referenced_attributes(fields, 'context') == {'licenseUrl'}
+    fields.append(MetaField('dc.note', 'getattr(submission, "note", "")'))
+    assert referenced_attributes(fields, 'submission') is None
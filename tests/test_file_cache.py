@@ -0,0 +1,81 @@
+""" Test local file cache"""
+
+import io
+from lib.file_cache import FileCache
+from lib.http_client import HttpClient
+
+
+class _Response:
+
+    def __init__(self, body, status=200, etag='"v1"'):
+        self.status_code = status
+        self.body = body
+        self.headers = {'ETag': etag,
+                        'Content-Disposition': 'filename="article.pdf"'}
+
+    def iter_content(self, chunk_size):
+        for pos in range(0, len(self.body), chunk_size):
+            yield self.body[pos:pos + chunk_size]
+
+    def close(self):
+        pass
+
+
+def _client(files, requests_):
+    client = HttpClient()
+
+    def get(url, **kwargs):
+        headers = kwargs.get('headers', {})
+        requests_.append(headers)
+        if headers.get('If-None-Match') == '"v1"':
+            return _Response(b'', status=304)
+        return _Response(files[url])
+    client.get = get
+    return client
+
+
+def _download(cache, http, url, sid, fid):
+    download = cache.request(http, url, sid, fid)
+    fh = io.BytesIO()
+    size = download.write(fh)
+    return download, fh.getvalue(), size
+
+
+def test_file_cache_revalidates(tmpdir):
+    requests_ = []
+    http = _client({'https://ojs/1': b'%PDF' * 100}, requests_)
+    cache = FileCache(tmpdir, 1 << 20)
+    _, first, size = _download(cache, http, 'https://ojs/1', 1, 2)
+    download, second, _ = _download(cache, http, 'https://ojs/1', 1, 2)
+    assert first == second == b'%PDF' * 100
+    assert size == 400
+    assert requests_ == [{}, {'If-None-Match': '"v1"'}]
+    # served from cache, header still known
+    assert download.response is None
+    assert 'article.pdf' in download.headers['content-disposition']
+
+
+def test_file_cache_evicts_least_recently_used(tmpdir):
+    files = {f'https://ojs/{n}': bytes([n]) * 600 for n in range(3)}
+    http = _client(files, [])
+    cache = FileCache(tmpdir, 1000)
+    for n in range(3):
+        _download(cache, http, f'https://ojs/{n}', n, n)
+    assert cache.lookup('0/0') is None
+    assert cache.lookup('1/1') is None
+    assert cache.lookup('2/2') is not None
+    assert cache.total_size() == 600
+
+
+def test_file_cache_refetches_evicted_blob(tmpdir):
+    requests_ = []
+    http = _client({'https://ojs/1': b'%PDF' * 100}, requests_)
+    cache = FileCache(tmpdir, 1 << 20)
+    _download(cache, http, 'https://ojs/1', 1, 2)
+    download = cache.request(http, 'https://ojs/1', 1, 2)
+    # another worker evicts the blob after the 304
+    cache.blob_path(download.entry['sha256']).unlink()
+    fh = io.BytesIO()
+    assert download.write(fh) == 400
+    assert fh.getvalue() == b'%PDF' * 100
+    assert requests_ == [{}, {'If-None-Match': '"v1"'}, {}]
@@ -0,0 +1,82 @@
+""" Test shared http client"""
+
+import io
+import configparser
+import pytest
+import requests
+from lib.http_client import HttpClient, IncompleteDownload
+
+
+def test_http_client_defaults():
+    client = HttpClient()
+    adapter = client.session.get_adapter('https://ojs.example.com')
+    assert client.timeout == (10.0, 120.0)
+    assert adapter.max_retries.total == 3
+    assert 503 in adapter.max_retries.status_forcelist
+    assert client.session.verify is False
+
+
+def test_http_client_config():
+    CP = configparser.ConfigParser()
+    CP.add_section('http')
+    CP.set('http', 'timeout_connect', '2')
+    CP.set('http', 'timeout_read', '30')
+    CP.set('http', 'retries', '5')
+    CP.set('http', 'max_per_host', '2')
+    client = HttpClient(CP)
+    adapter = client.session.get_adapter('https://ojs.example.com')
+    assert client.timeout == (2.0, 30.0)
+    assert adapter.max_retries.total == 5
+    assert adapter._pool_maxsize == 2
+
+
+class _Response:
+    """streamed response breaking after 'broken' bytes"""
+
+    def __init__(self, body, status=200, start=0, broken=None):
+        self.status_code = status
+        self.body = body[start:]
+        self.broken = broken
+        self.headers = {'Content-Length': str(len(self.body))}
+        if status == 206:
+            self.headers['Content-Range'] = \
+                f'bytes {start}-{len(body) - 1}/{len(body)}'
+
+    def iter_content(self, chunk_size):
+        for pos in range(0, len(self.body), chunk_size):
+            if self.broken is not None and pos >= self.broken:
+                raise requests.exceptions.ChunkedEncodingError('broken')
+            yield self.body[pos:pos + chunk_size]
+
+    def close(self):
+        pass
+
+
+def test_fetch_resumes_with_range():
+    body = bytes(range(256)) * 64
+    ranges = []
+
+    def get(url, **kwargs):
+        range_ = kwargs['headers'].get('Range')
+        ranges.append(range_)
+        start = int(range_[6:-1])
+        return _Response(body, status=206, start=start)
+
+    client = HttpClient()
+    client.chunk_size = 1024
+    client.backoff_factor = 0
+    client.get = get
+    fh = io.BytesIO()
+    first = _Response(body, broken=4096)
+    assert client.fetch('https://ojs.example.com/x', fh, first) == len(body)
+    assert fh.getvalue() == body
+    assert ranges == ['bytes=4096-']
+
+
+def test_fetch_checks_size():
+    body = b'%PDF' * 100
+    truncated = _Response(body)
+    truncated.headers['Content-Length'] = str(len(body) + 1)
+    client = HttpClient()
+    with pytest.raises(IncompleteDownload):
+        client.fetch('https://ojs.example.com/x', io.BytesIO(), truncated)
@@ -2,7 +2,9 @@
 
 import pytest
 import configparser
+import requests
 from lib.data_miner import DataPoll
+from lib.state_store import StateStore, PACKAGED
 from journal2saf import Report
 from tests.ressources import publishers
 from tests.ressources import issue, issues
@@ -80,3 +82,236 @@ def test_request_issues(configuration):
     dp._server_request = _server_request
     dp.rest_call_issue('url', 1)
     assert(len(dp.publishers)) == 2
+
+
+def _fake_api(query, api_token):
+    """minimal OJS api: one journal, five published submissions"""
+    path = query.split('?')[0]
+    if 'offset=' in query:
+        items = []
+        for num in range(1, 6):
+            galley = {'id': num, 'submissionFileId': 10 + num,
+                      'urlRemote': 'https://doi.org/x' if num == 4 else '',
+                      'publicationId': 100 + num}
+            items.append({
+                '_href': f'{JURL}/cicadina/api/v1/submissions/{num}',
+                'id': num, 'status': 3, 'currentPublicationId': 100 + num,
+                'lastModified': f'2024-01-0{num} 10:00:00',
+                'publications': [{
+                    '_href': f'{JURL}/cicadina/api/v1/submissions/{num}'
+                             f'/publications/{100 + num}',
+                    'galleys': [galley]}]})
+        items.append({'id': 6, 'status': 1,
+                      'lastModified': '2023-12-24 10:00:00'})
+        if 'orderDirection=DESC' in query:
+            items.sort(key=lambda i: i['lastModified'], reverse=True)
+        return {'items': items, 'itemsMax': len(items)}
+    if '/publications/' in path:
+        return {'issueId': 7, 'pages': '1-9'}
+    if path.endswith('/issues/7'):
+        return {'volume': 3, 'datePublished': '2018-08-13'}
+    return {'submissionId': int(path.split('/')[-1])}
+
+
+@pytest.fixture(name='harvest')
+def fixture_harvest(configuration, tmpdir):
+    """harvest journal 'cicadina' from an api like _fake_api,
+       all runs share one state store"""
+    configuration.add_section('journals-token')
+    configuration.set('journals-token', 'cicadina', 'token')
+    store = StateStore(path=tmpdir / 'state.sqlite')
+
+    def harvest(api=_fake_api, processed=(), request=True, **kwargs):
+        report = Report()
+        dp = DataPoll(configuration, report, store=store, **kwargs)
+        dp.load_cursors()
+        dp.items = publishers.publisher['items'][:1]
+        dp.processed = set(processed)
+        dp._server_request = api
+        if request:
+            dp.serialise_data()
+            dp.request_submissions()
+        return dp, report
+
+    harvest.store = store
+    return harvest
+
+
+def test_request_submissions_concurrent(configuration, harvest):
+    """concurrent harvest delivers same objects and report as sequential"""
+    sequential, report_seq = harvest(processed=[102])
+    configuration.set('general', 'harvest_workers', '4')
+    concurrent, report_con = harvest(processed=[102])
+    subm_seq = sequential.publishers[0].submissions
+    subm_con = concurrent.publishers[0].submissions
+    assert len(subm_seq) == 5
+    assert [s._data for s in subm_seq] == [s._data for s in subm_con]
+    assert report_seq.report == report_con.report
+    assert report_seq.report['already processed submissions'] == [2]
+
+
+def test_request_issue_cached(harvest):
+    """issue detail is requested once for all submissions of an issue"""
+    queries = []
+
+    def counting_api(query, api_token):
+        queries.append(query)
+        return _fake_api(query, api_token)
+
+    dp, _ = harvest(counting_api)
+    submissions = dp.publishers[0].submissions
+    assert len([q for q in queries if q.endswith('/issues/7')]) == 1
+    # remote_url of submission 4 is set, it is taken from the listing
+    assert all(s.volume == 3 for s in submissions if s.id != 4)
+    assert list(dp.issues) == [(dp.publishers[0].url, 7)]
+
+
+def test_request_submissions_incremental(configuration, harvest):
+    """only submissions changed since stored cursor are harvested"""
+    configuration.set('general', 'incremental', 'True')
+    harvest.store.save_cursors({'cicadina': '2024-01-04 10:00:00'})
+    dp, _ = harvest()
+    assert [s.id for s in dp.publishers[0].submissions] == [5, 4]
+    dp.save_cursors()
+    assert harvest.store.cursors() == {'cicadina': '2024-01-05 10:00:00'}
+
+    full, _ = harvest(request=False, full=True)
+    assert full.cursors == {}
+
+
+def test_compact_model(configuration, harvest):
+    """compact model keeps only fields used by [meta] and export"""
+    configuration.set('general', 'compact_model', 'True')
+    configuration.remove_option('meta', 'dc.date.available')
+    configuration.set('meta', 'dc.date.issued', 'submission.datePublished')
+    configuration.set('meta', 'dc.publisher', 'context.name')
+    dp, _ = harvest()
+    submission = dp.publishers[0].submissions[0]
+    assert set(submission._data) == {
+        'id', 'currentPublicationId', 'publication', 'files',
+        'submissionId', 'volume', 'datePublished'}
+    assert submission.volume == 3
+    assert not hasattr(submission, 'pages')
+    assert set(dp.publishers[0]._data) == {'_href', 'name'}
+
+
+def test_harvest_publishers_streams(harvest):
+    """journals are harvested on demand and released afterwards"""
+    def api(query, api_token):
+        if '/contexts/' in query:
+            return {'contactEmail': 'editor@example.com'}
+        return _fake_api(query, api_token)
+
+    dp, _ = harvest(api, request=False)
+    stream = dp.harvest_publishers()
+    publisher = next(stream)
+    assert len(publisher.submissions) == 5
+    assert publisher.contactEmail == 'editor@example.com'
+    assert dp.publishers == []
+    dp.release(publisher)
+    assert publisher.submissions == [] and dp.issues == {}
+    assert list(stream) == []
+
+
+def test_request_pages_concurrent(configuration, harvest):
+    """pages after the first are requested side by side, in order"""
+    configuration.set('general', 'page_size', '100')
+    configuration.set('general', 'harvest_workers', '4')
+    queries = []
+
+    def api(query, api_token):
+        queries.append(query)
+        offset = int(query.split('offset=')[1].split('&')[0])
+        # server caps 'count' at 30
+        return {'items': list(range(offset, min(offset + 30, 95))),
+                'itemsMax': 95}
+
+    dp, _ = harvest(api, request=False)
+    items = dp.request_pages(
+        lambda start: dp.rest_call_submissions(JURL, start), 'token')
+    assert items == list(range(95))
+    assert len(queries) == 4
+    assert all('count=100' in query for query in queries)
+
+
+def test_page_size_capped(configuration, harvest):
+    configuration.set('general', 'page_size', '500')
+    dp, _ = harvest(request=False)
+    assert dp.page_size == 100
+
+
+def test_known_submissions_from_listing(harvest):
+    """no detail requests for processed submissions or remote_url set"""
+    queries = []
+
+    def counting_api(query, api_token):
+        queries.append(query)
+        return _fake_api(query, api_token)
+
+    for refresh in (False, True):
+        queries.clear()
+        dp, report = harvest(counting_api, processed={102, 103},
+                             refresh=refresh)
+        details = [q for q in queries if '/publications/' in q]
+        assert len(details) == (5 if refresh else 2)
+        submissions = dp.publishers[0].submissions
+        assert [s.id for s in submissions] == [1, 2, 3, 4, 5]
+        assert [[f['state'] for f in getattr(s, 'files', [])]
+                for s in submissions] == [
+            [None], ['state_processed'], ['state_processed'], [], [None]]
+        assert report.report['already processed submissions'] == [2, 3]
+
+
+def test_cursor_held_at_failed_submission(configuration, harvest):
+    """a failed detail request is requested again by the next run"""
+    def failing_api(query, api_token):
+        if query == f'{JURL}/cicadina/api/v1/submissions/3':
+            raise requests.exceptions.ConnectionError('reset')
+        return _fake_api(query, api_token)
+
+    configuration.set('general', 'incremental', 'True')
+    dp, report = harvest(failing_api)
+    assert [s.id for s in dp.publishers[0].submissions] == [1, 2, 4, 5]
+    assert report.report['error server request'] == [
+        f'{JURL}/cicadina/api/v1/submissions/3']
+    # everything else got packaged
+    harvest.store.mark_many(
+        [(pid, 'cicadina', None, None) for pid in (101, 102, 105)],
+        PACKAGED)
+    dp.save_cursors()
+    assert harvest.store.cursors() == {'cicadina': '2024-01-03 10:00:00'}
+
+    dp, _ = harvest(processed=harvest.store.ids(PACKAGED))
+    assert [s.id for s in dp.publishers[0].submissions] == [5, 4, 3]
+    assert dp.publishers[0].submissions[2].volume == 3
+    # not packaged again, cursor stays
+    dp.save_cursors()
+    assert harvest.store.cursors() == {'cicadina': '2024-01-03 10:00:00'}
+
+
+def test_context_error_skips_journal(configuration, harvest):
+    """an unreachable context is reported, its cursor stays"""
+    context_href = publishers.publisher['items'][0]['_href']
+
+    def failing_api(query, api_token):
+        if query == context_href:
+            raise requests.exceptions.ConnectionError('reset')
+        return _fake_api(query, api_token)
+
+    configuration.set('general', 'incremental', 'True')
+    dp, report = harvest(failing_api)
+    dp.request_contexts()
+    assert dp.publishers == []
+    assert report.report['error server request'] == [context_href]
+    dp.save_cursors()
+    assert harvest.store.cursors() == {}
+
+
+def test_publishers_error_is_reported(harvest):
+    def failing_api(query, api_token):
+        raise requests.exceptions.ConnectionError('reset')
+
+    dp, report = harvest(failing_api, request=False)
+    dp.request_publishers()
+    assert dp.items == []
+    assert report.report['error server request'] == [dp.journal_server]
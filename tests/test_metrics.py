@@ -0,0 +1,41 @@
+""" Test run metrics"""
+
+from lib.metrics import Metrics, endpoint_type, journal_from_name
+
+
+def test_endpoint_type():
+    base = 'https://ojs.example.com/cicadina/api/v1'
+    assert endpoint_type(f'{base}/contexts?isEnabled=true') == 'contexts'
+    assert endpoint_type(f'{base}/submissions?offset=0') == 'submissions'
+    assert endpoint_type(
+        f'{base}/submissions/3/publications/4') == 'publications'
+    assert endpoint_type(f'{base}/issues/7') == 'issues'
+    assert endpoint_type(
+        'https://ojs.example.com/cicadina/article/download/1/2/3') == 'files'
+    assert journal_from_name(
+        '/export/cicadina_publication_id_102_files_1.zip') == 'cicadina'
+
+
+def test_metrics_textfile(tmpdir):
+    metrics = Metrics()
+    metrics.observe('http_request_seconds', 0.2, endpoint='issues')
+    metrics.observe('http_request_seconds', 3.0, endpoint='issues')
+    metrics.inc('zip_bytes', 3 << 20, journal='cicadina')
+    metrics.inc('zip_bytes', 1 << 20, journal='cicadina')
+    metrics.inc('items', stage='package', journal='cicadina')
+    metrics.inc('journal_seconds', 2.0, stage='package', journal='cicadina')
+    metrics.set('stage_seconds', 4.5, stage='harvest')
+    path = tmpdir / 'journal2saf.prom'
+    metrics.write_textfile(path)
+    text = path.read_text(encoding='utf-8')
+    assert '# TYPE journal2saf_http_request_seconds histogram' in text
+    assert ('journal2saf_http_request_seconds_bucket'
+            '{endpoint="issues",le="0.25"} 1') in text
+    assert ('journal2saf_http_request_seconds_bucket'
+            '{endpoint="issues",le="+Inf"} 2') in text
+    assert f'journal2saf_zip_bytes{{journal="cicadina"}} {4 << 20}' in text
+    assert 'journal2saf_last_run_timestamp_seconds' in text
+    summary = metrics.summary()
+    assert 'harvest: 4.5s' in summary
+    assert 'http issues: 2 requests, avg 1.60s' in summary
+    assert 'cicadina: 1 zips, 4 Mb, 2.0 Mb/s' in summary
@@ -0,0 +1,158 @@
+""" Test batched DOI retrieval from DSpace"""
+
+import io
+import tarfile
+import configparser
+import pytest
+from contextlib import contextmanager
+from lib.retrieve_doi import RetrieveDOI
+from lib.state_store import StateStore, DOI_RECEIVED
+from journal2saf import Report
+
+
+class Attributes:
+
+    def __init__(self, filename, size) -> None:
+        self.filename = filename
+        self.st_size = size
+
+
+class FakeSFTP:
+
+    def __init__(self, files, store) -> None:
+        self.files = files
+        self.store = store
+        self.opened: list = []
+        self.removed: list = []
+
+    def listdir_attr(self, path):
+        return [Attributes(name, len(content))
+                for name, content in self.files.items()]
+
+    def open(self, path, mode):
+        handle = io.BytesIO(self.files[path.split('/')[-1]])
+        self.opened.append(handle)
+        return handle
+
+    def remove(self, path) -> None:
+        # deleted only after the local commit
+        assert len(self.store.names(DOI_RECEIVED)) == 5
+        self.removed.append(path)
+
+
+class Stream(io.BytesIO):
+
+    class channel:
+
+        @staticmethod
+        def recv_exit_status() -> int:
+            return 0
+
+
+class TarClient:
+    """answers 'tar -cf -' with the requested files, 'rm -f'
+       with nothing"""
+
+    def __init__(self, files) -> None:
+        self.files = files
+        self.commands: list = []
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        if ' rm -f ' in command:
+            return None, Stream(), Stream()
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            for name in command.split(' -- ')[-1].split():
+                info = tarfile.TarInfo(name)
+                info.size = len(self.files[name])
+                tar.addfile(info, io.BytesIO(self.files[name]))
+        return None, Stream(buffer.getvalue()), Stream()
+
+
+class Session:
+
+    server = 'dspace.example.com'
+
+    def __init__(self, sftp, client=None) -> None:
+        self.channel = sftp
+        self.client = client
+
+    def get_client(self):
+        return self.client
+
+    @contextmanager
+    def sftp(self):
+        yield self.channel
+
+
+@pytest.fixture
+def config(tmpdir):
+    CP = configparser.ConfigParser()
+    CP.read_dict({'dspace': {'server_doifiles': '/data/doi',
+                             'doi_batch': '2'},
+                  'export': {'export_path': str(tmpdir)}})
+    return CP
+
+
+@pytest.fixture
+def files():
+    return {f'hsg_publication_id_{num}_files_1.doi':
+            f'doi:10.25673/{num}\n'.encode() for num in range(1, 6)}
+
+
+def test_retrieve_in_batches(tmpdir, config, files):
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    files['done.doi'] = b'doi:10.25673/0'
+    sftp = FakeSFTP(files, store)
+    retrieve = RetrieveDOI(config, Report(), store=store,
+                           session=Session(sftp))
+    dois = retrieve.retrieve_files({'done.doi'})
+    assert dois['hsg_publication_id_3_files_1.doi'] == 'doi:10.25673/3'
+    assert len(sftp.opened) == 5
+    assert all(handle.closed for handle in sftp.opened)
+    assert len(sftp.removed) == 6
+    assert store.pending_remote_urls()[0] == (
+        1, 'hsg_publication_id_1_files_1', 'doi:10.25673/1')
+    assert tmpdir.join('hsg_publication_id_1_files_1.doi').read() == \
+        'doi:10.25673/1'
+
+
+def test_unreadable_files_are_skipped(tmpdir, config, files):
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    files['hsg_publication_id_x_files_1.doi'] = b'doi:10.25673/x'
+    files['hsg_publication_id_6_files_1.doi'] = b'\xff\xfe'
+    sftp = FakeSFTP(files, store)
+    report = Report()
+    retrieve = RetrieveDOI(config, report, store=store,
+                           session=Session(sftp))
+    dois = retrieve.retrieve_files()
+    assert len(dois) == 5
+    assert sorted(report.report['error reading DOI file']) == [
+        'hsg_publication_id_6_files_1.doi',
+        'hsg_publication_id_x_files_1.doi']
+    # left remote for inspection
+    assert len(sftp.removed) == 5
+
+
+def test_archive_in_batches(tmpdir, config, files):
+    config.set('dspace', 'doi_fetch', 'archive')
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    client = TarClient(files)
+    retrieve = RetrieveDOI(config, Report(), store=store,
+                           session=Session(None, client))
+    contents = retrieve.read_archive(list(files))
+    assert contents == files
+    assert len(client.commands) == 3
+
+
+def test_remove_in_batches(tmpdir, config, files):
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    sftp = FakeSFTP(files, store)
+    client = TarClient(files)
+    retrieve = RetrieveDOI(config, Report(), store=store,
+                           session=Session(sftp, client))
+    retrieve.retrieve_files()
+    assert len(client.commands) == 3
+    assert all(' rm -f -- ' in command for command in client.commands)
+    assert sftp.removed == []
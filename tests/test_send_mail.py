@@ -0,0 +1,65 @@
+""" Test report mail"""
+
+import io
+import zipfile
+import email
+from lib import send_mail
+from journal2saf import Report
+
+
+class Session:
+
+    sent: list = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def sendmail(self, sender, receivers, message) -> None:
+        self.sent.append((sender, receivers, message))
+
+
+def test_report_keeps_sample():
+    report = Report(sample=5)
+    for num in range(20000):
+        report.add('already processed submissions', num)
+    assert report.report['already processed submissions'] == list(range(5))
+    assert report.counts['already processed submissions'] == 20000
+
+
+def test_one_message_for_all_receivers(monkeypatch):
+    Session.sent = []
+    monkeypatch.setattr(send_mail, 'create_smtp_session',
+                        lambda *args: Session())
+    report = Report(sample=20)
+    report.add('elapsed time', '0:00:01')
+    for num in range(30):
+        report.add('write zip file', f'hsg_publication_id_{num}.zip')
+    send_mail.send_report('s@example.com', 'user', 'secret', 'smtp', 587,
+                          ['r1@example.com', 'r2@example.com'], False,
+                          report, 'ojs')
+    assert len(Session.sent) == 1
+    sender, receivers, raw = Session.sent[0]
+    assert receivers == ['r1@example.com', 'r2@example.com']
+    message = email.message_from_string(raw)
+    assert message['Subject'] == '[Success] OJS-DSpace-Migration: Report'
+    attachment, body = message.get_payload()
+    assert 'More than 10 entries! [30]' in body.get_payload()
+    with zipfile.ZipFile(io.BytesIO(attachment.get_payload(decode=True)))\
+            as zip_:
+        text = zip_.read('write_zip_file.txt').decode()
+    assert text.startswith('write zip file (first 20 of 30)\n')
+
+
+def test_nothing_to_report(monkeypatch):
+    Session.sent = []
+    monkeypatch.setattr(send_mail, 'create_smtp_session',
+                        lambda *args: Session())
+    report = Report()
+    report.add('elapsed time', '0:00:01')
+    report.add('metrics', 'harvest: 0.1s')
+    send_mail.send_report('s@example.com', 'user', 'secret', 'smtp', 587,
+                          ['r1@example.com'], False, report, 'ojs')
+    assert Session.sent == []
@@ -0,0 +1,83 @@
+""" Test shared SSH connection to DSpace"""
+
+import configparser
+import pytest
+import paramiko.client
+from lib.metrics import Metrics
+from lib.ssh_session import SSHSession
+from journal2saf import Report
+
+
+class Transport:
+
+    def __init__(self) -> None:
+        self.active = True
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def send_ignore(self) -> None:
+        if not self.active:
+            raise EOFError()
+
+
+class FakeClient:
+
+    connects: list = []
+
+    def __init__(self) -> None:
+        self.transport = Transport()
+
+    def load_system_host_keys(self) -> None:
+        pass
+
+    def set_missing_host_key_policy(self, policy) -> None:
+        pass
+
+    def connect(self, server, username, key_filename) -> None:
+        if server == 'down.example.com':
+            raise OSError('connection refused')
+        self.connects.append(server)
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self) -> None:
+        self.transport.active = False
+
+
+@pytest.fixture
+def session(monkeypatch):
+    FakeClient.connects = []
+    monkeypatch.setattr(paramiko.client, 'SSHClient', FakeClient)
+    CP = configparser.ConfigParser()
+    CP.read_dict({'scp': {'server': 'dspace.example.com', 'user': 'dspace',
+                          'key_filename': 'id_rsa'}})
+    return SSHSession(CP, Report(), Metrics())
+
+
+def test_connection_is_shared(session):
+    client = session.get_client()
+    assert session.get_client() is client
+    assert FakeClient.connects == ['dspace.example.com']
+    assert session.metrics.value('ssh_connects') == 1
+
+
+def test_reconnect_dropped_connection(session):
+    client = session.get_client()
+    client.transport.active = False
+    assert session.get_client() is not client
+    assert len(FakeClient.connects) == 2
+
+
+def test_connect_error_is_reported(session):
+    session.server = 'down.example.com'
+    assert session.get_client() is None
+    with session.sftp() as sftp:
+        assert sftp is None
+    assert list(session.report.report) == ['error ssh:down.example.com']
+    # no further attempt in this run
+    session.server = 'dspace.example.com'
+    assert session.get_client() is None
+    assert FakeClient.connects == []
+    assert session.report.counts['error ssh:down.example.com'] == 1
@@ -0,0 +1,62 @@
+""" Test local state database"""
+
+import configparser
+from lib.state_store import (
+    StateStore, HOME, PACKAGED, UPLOADED, DOI_RECEIVED, REMOTE_URL_WRITTEN,
+    publication_id_from_name)
+
+
+def test_import_markers(tmpdir):
+    export = tmpdir.mkdir('export')
+    export.join('hsg_publication_id_102_files_1.zip').write('')
+    export.join('hsg_publication_id_103_files_2.zip.done').write('')
+    export.join('hsg_publication_id_104_files_1.doi').write('doi:10.25673/1')
+    export.join('hsg_publication_id_105_files_1.doi.done').write('doi:x')
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    store.import_markers(export)
+    assert store.ids(PACKAGED) == {102, 103, 104, 105}
+    assert store.ids(UPLOADED) == {103, 104, 105}
+    assert store.has(104, DOI_RECEIVED)
+    assert not store.has(104, REMOTE_URL_WRITTEN)
+    assert store.pending_remote_urls() == [
+        (104, 'hsg_publication_id_104_files_1', 'doi:10.25673/1')]
+
+    # import happens only once
+    export.join('hsg_publication_id_106_files_1.zip').write('')
+    store.import_markers(export)
+    assert not store.has(106, PACKAGED)
+
+
+def test_mark(tmpdir):
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    store.mark(7, PACKAGED, journal='hsg', name='hsg_publication_id_7_files_1')
+    store.mark(7, DOI_RECEIVED, doi='doi:10.25673/7')
+    assert store.names(DOI_RECEIVED) == {'hsg_publication_id_7_files_1'}
+    store.mark(7, REMOTE_URL_WRITTEN)
+    assert store.pending_remote_urls() == []
+
+
+def test_forget(tmpdir):
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    store.mark_many([(7, 'hsg', None, None), (8, 'hsg', None, None)],
+                    PACKAGED)
+    assert store.forget([7, 9]) == 1
+    assert store.ids(PACKAGED) == {8}
+
+
+def test_default_path_independent_of_cwd(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    CP = configparser.ConfigParser()
+    CP.read_dict({'general': {}})
+    path = StateStore(CP).path
+    assert path.is_absolute()
+    assert path.parent == HOME / 'state'
+
+
+def test_publication_id_of_journal_with_underscore(tmpdir):
+    name = 'hsg_extra_publication_id_7_files_1'
+    assert publication_id_from_name(f'{name}.zip.done') == 7
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    store.mark(7, PACKAGED, journal='hsg_extra', name=name)
+    assert store.publication_id(name) == 7
+    assert store.publication_id('other') is None
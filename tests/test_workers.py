@@ -0,0 +1,48 @@
+""" Test worker helpers"""
+
+import threading
+import pytest
+from lib.workers import ordered_map, pipeline
+
+
+def test_ordered_map_keeps_order():
+    assert ordered_map(lambda x: x * 2, range(10), workers=4) == [
+        x * 2 for x in range(10)]
+
+
+def test_pipeline_passes_items_through_stages():
+    uploaded = []
+    threads = set()
+
+    def package(journal):
+        threads.add(threading.current_thread().name)
+        return [f'{journal}_{num}.zip' for num in range(2)]
+
+    def upload(zipfile):
+        threads.add(threading.current_thread().name)
+        uploaded.append(zipfile)
+        return ()
+
+    pipeline(iter(['a', 'b', 'c']), [package, upload], maxsize=1)
+    assert uploaded == ['a_0.zip', 'a_1.zip', 'b_0.zip', 'b_1.zip',
+                        'c_0.zip', 'c_1.zip']
+    assert threads == {'pipeline-0', 'pipeline-1'}
+
+
+def test_pipeline_stops_on_error():
+    seen = []
+
+    def source():
+        for num in range(100):
+            seen.append(num)
+            yield num
+
+    def package(num):
+        if num == 3:
+            raise ValueError('broken item')
+        return [num]
+
+    with pytest.raises(ValueError, match='broken item'):
+        pipeline(source(), [package, lambda num: ()], maxsize=1)
+    # backpressure: the source stopped early
+    assert len(seen) < 100
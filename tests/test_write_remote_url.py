@@ -0,0 +1,57 @@
+""" Test write-back of DOIs to OJS/OMP"""
+
+import time
+import configparser
+import requests
+from lib.state_store import StateStore, DOI_RECEIVED, REMOTE_URL_WRITTEN
+from lib.write_remote_url import WriteRemoteUrl
+from lib.retrieve_doi import RetrieveDOI
+from journal2saf import Report
+
+
+class Response:
+
+    def __init__(self, status_code) -> None:
+        self.status_code = status_code
+        self.reason = 'Forbidden'
+
+
+class FakeHttp:
+
+    def get(self, url, params):
+        publication_id = params['publication_id']
+        # later requests answer first
+        time.sleep(0.01 * (5 - publication_id))
+        if publication_id == 3:
+            raise requests.exceptions.ConnectionError('reset')
+        return Response(403 if publication_id == 4 else 200)
+
+
+def test_write_concurrently(tmpdir):
+    CP = configparser.ConfigParser()
+    CP.read_dict({
+        'general': {'journal_server': 'https://ojs.example.com/remote',
+                    'token': 'secret', 'update_remote_workers': '4'},
+        'dspace': {'server_doifiles': '/data/doi'},
+        'export': {'export_path': str(tmpdir),
+                   'doi_prefix': 'https://doi.org/'}})
+    store = StateStore(path=tmpdir / 'state.sqlite')
+    store.mark_many(
+        [(num, 'hsg', f'hsg_publication_id_{num}_files_1', f'doi:10.1/{num}')
+         for num in range(1, 5)], DOI_RECEIVED)
+    # local copies as kept by the DOI retrieval
+    RetrieveDOI(CP, Report(), store=store, session=object()).write_local(
+        {f'hsg_publication_id_{num}_files_1.doi': f'doi:10.1/{num}'
+         for num in range(1, 5)})
+    report = Report()
+    WriteRemoteUrl(CP, report, http=FakeHttp(), store=store).write()
+    assert store.ids(REMOTE_URL_WRITTEN) == {1, 2}
+    assert tmpdir.join('hsg_publication_id_2_files_1.doi.done').exists()
+    # not written yet, renamed by the next run
+    assert tmpdir.join('hsg_publication_id_3_files_1.doi').exists()
+    # report keeps the order of the publications
+    assert report.report['successfully committed remote_url'] == [
+        'https://doi.org/10.1/1', 'https://doi.org/10.1/2']
+    assert report.report['write remote_url failed'] == [
+        'https://doi.org/10.1/3']
+    assert report.report['rename DOI file to failed'] == ['Forbidden']